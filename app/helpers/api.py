@@ -0,0 +1,88 @@
+import asyncio
+import json
+from typing import Any, NamedTuple
+from urllib.parse import urljoin
+
+import aiohttp
+
+from config import Config
+from helpers import metrics
+
+
+class ApiError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class ApiResponse(NamedTuple):
+    status: int
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class ApiClient:
+    """
+    Asynchronous client for the API server.  Connections are kept alive between requests and every request is bound
+    by the `Config.API_TIMEOUT` timeout.  Connection failures, timeouts, and malformed URLs are all raised as an
+    `ApiError`.  Failed requests (including server errors) are counted in the `sisyphus_api_errors_total` metric.
+    """
+
+    session: aiohttp.ClientSession
+
+    def __init__(self, api_url: str = None, timeout: float = None):
+        """
+        ApiClient constructor
+        :param api_url: Override the API server URL
+        :param timeout: Override the total timeout for each request in seconds
+        """
+        self.api_url = api_url if api_url else Config.API_URL
+        self.timeout = aiohttp.ClientTimeout(total=timeout if timeout else Config.API_TIMEOUT)
+        self.session = None
+
+    async def __aenter__(self) -> "ApiClient":
+        self.session = aiohttp.ClientSession(timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.session.close()
+
+    async def request(self, method: str, path: str, **kwargs) -> ApiResponse:
+        """
+        Send a request to the API server
+        :param method: The HTTP method
+        :param path: The path of the endpoint on the API server
+        :param kwargs: Extra arguments passed to `aiohttp.ClientSession.request` (`params`, `json`, ...)
+        :return: The status code and body of the response
+        """
+        endpoint = path.replace(Config.HOST_UUID, "{worker_id}")
+        try:
+            async with self.session.request(method, urljoin(self.api_url, path), **kwargs) as r:
+                response = ApiResponse(status=r.status, text=await r.text())
+        except (aiohttp.ClientError, ValueError) as e:
+            metrics.api_errors.inc(endpoint=endpoint)
+            raise ApiError(message=f"{type(e).__name__}: {str(e)}")
+        except asyncio.TimeoutError:
+            metrics.api_errors.inc(endpoint=endpoint)
+            raise ApiError(message=f"Request to '{path}' timed out after {self.timeout.total} seconds")
+        if response.status >= 500:
+            metrics.api_errors.inc(endpoint=endpoint)
+        return response
+
+    async def get(self, path: str, **kwargs) -> ApiResponse:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> ApiResponse:
+        return await self.request("POST", path, **kwargs)
+
+    async def patch(self, path: str, **kwargs) -> ApiResponse:
+        return await self.request("PATCH", path, **kwargs)
@@ -0,0 +1,169 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Tuple, Union
+
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+
+def file_key(path: Union[str, Path]) -> Tuple[str, int, int]:
+    """
+    Generate a cache key for a file that changes whenever the file does.
+    :param path: The path of the file
+    :return: Tuple of the resolved path, size, and modification time of the file
+    """
+    path = Path(path)
+    stat = path.stat()
+    return str(path.resolve()), stat.st_size, stat.st_mtime_ns
+
+
+def file_fingerprint(path: Union[str, Path]) -> str:
+    """
+    Fingerprint the contents of a file without reading all of it: the size and a chunk from the start, middle, and
+    end of the file are hashed.  Unlike `file_key` the fingerprint stays the same when the file is copied or moved,
+    so it can key results that are shared between workers.  Fingerprints are cached by `file_key`.
+    :param path: The path of the file
+    :return: The fingerprint
+    """
+
+    def fingerprint():
+        digest = hashlib.sha256()
+        size = Path(path).stat().st_size
+        digest.update(str(size).encode())
+        offsets = {0, max(0, (size - FINGERPRINT_CHUNK_SIZE) // 2), max(0, size - FINGERPRINT_CHUNK_SIZE)}
+        with open(path, "rb") as f:
+            for offset in sorted(offsets):
+                f.seek(offset)
+                digest.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        return digest.hexdigest()
+
+    return fingerprint_cache.fetch(file_key(path), fingerprint)
+
+
+class Cache:
+    """
+    A small thread-safe LRU cache whose entries can optionally expire after `ttl` seconds.  Hits and misses are
+    counted in the `sisyphus_cache_requests_total` metric under the name of the cache.
+    """
+
+    def __init__(self, name: str, max_size: int = 128, ttl: float = None):
+        """
+        Cache constructor
+        :param name: The name of the cache, used for the metrics
+        :param max_size: The maximum number of entries to keep
+        :param ttl: How long entries stay valid in seconds, entries never expire if not provided
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Get a value from the cache
+        :param key: The key of the entry
+        :return: The cached value, or None if there's no valid entry
+        """
+        with self.__lock:
+            if key in self.__entries:
+                value, stored = self.__entries[key]
+                if self.ttl is None or time.monotonic() - stored < self.ttl:
+                    self.__entries.move_to_end(key)
+                    metrics.cache_requests.inc(cache=self.name, result="hit")
+                    return value
+                del self.__entries[key]
+        metrics.cache_requests.inc(cache=self.name, result="miss")
+        return None
+
+    def fetch(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Get a value from the cache, loading and storing it on a miss.  The loader runs outside of the lock so a slow
+        load doesn't block other lookups.
+        :param key: The key of the entry
+        :param loader: Called to produce the value on a miss
+        :return: The cached value
+        """
+        if (value := self.get(key)) is None:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self.__lock:
+            self.__entries[key] = (value, time.monotonic())
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+
+class FileCache:
+    """
+    A cache stored as a JSON file, for results that are expensive to produce and worth keeping across jobs, worker
+    restarts, and the workers sharing the file.  Keys are strings and values anything JSON can hold.  Writes hold a
+    lock on `<file>.lock` and replace the file in one go, so concurrent workers never see a half-written cache, and
+    the oldest entries are dropped past `max_size`.  Hits and misses are counted like the in-memory caches.
+
+    Reading and writing the file (and waiting for the lock another worker holds) blocks, so code running on the event
+    loop calls `get` and `set` in an executor.
+    """
+
+    def __init__(self, name: str, path: Path, max_size: int = 1024):
+        """
+        FileCache constructor
+        :param name: The name of the cache, used for the metrics
+        :param path: The cache file
+        :param max_size: The maximum number of entries to keep
+        """
+        self.name = name
+        self.path = path
+        self.max_size = max_size
+
+    def load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return dict()
+
+    def get(self, key: str) -> Any:
+        """
+        Get a value from the cache
+        :param key: The key of the entry
+        :return: The cached value, or None if there's no entry
+        """
+        value = self.load().get(key)
+        metrics.cache_requests.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                entries = self.load()
+                entries.pop(key, None)
+                entries[key] = value
+                while len(entries) > self.max_size:
+                    del entries[next(iter(entries))]
+                temp_file = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+                temp_file.write_text(json.dumps(entries))
+                os.replace(temp_file, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write the cache file '{self.path}': {str(e)}")
+
+
+fingerprint_cache = Cache(name="fingerprints", max_size=256)
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+from helpers.cache import Cache, FileCache, file_key
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 30
+
+capability_cache = Cache(name="capabilities", max_size=8)
+capability_file_cache = FileCache(name="capability_file", path=Config.CAPABILITY_CACHE_FILE, max_size=32)
+
+FFMPEG_LIST_ENTRY = re.compile(r"^\s*[A-Z.|]{3,6}\s+(\S+)\s")
+HANDBRAKE_LIST_ENTRY = re.compile(r"^\s{20,}(\S+)\s*$")
+
+
+def ffmpeg_path() -> Optional[Path]:
+    if path := os.getenv("FFMPEG_PATH", shutil.which("ffmpeg")):
+        return Path(path)
+    return None
+
+
+def handbrake_path() -> Optional[Path]:
+    if "HANDBRAKE_CLI_PATH" in list(Config.__dict__):
+        return Path(getattr(Config, "HANDBRAKE_CLI_PATH"))
+    if path := shutil.which("HandBrakeCLI"):
+        return Path(path)
+    return None
+
+
+def run_probe(command: List[str]) -> str:
+    return subprocess.run(
+        [str(i) for i in command],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        errors="replace",
+        timeout=PROBE_TIMEOUT,
+    ).stdout
+
+
+def parse_ffmpeg_list(output: str) -> List[str]:
+    """
+    Parse the output of `ffmpeg -encoders` or `ffmpeg -filters`, skipping the legend before the actual list
+    :param output: The output of `ffmpeg`
+    :return: The names in the list
+    """
+    lines = output.splitlines()
+    for index, line in enumerate(lines):
+        if line.strip().startswith("---") or line.strip() == "Filters:":
+            lines = lines[index + 1 :]
+            break
+    return sorted({m.group(1) for i in lines if (m := FFMPEG_LIST_ENTRY.match(i)) and m.group(1) != "="})
+
+
+def parse_handbrake_list(output: str, option: str) -> List[str]:
+    """
+    Parse the values listed under an option of `HandBrakeCLI --help` (e.g. the video encoders under `--encoder`)
+    :param output: The output of `HandBrakeCLI --help`
+    :param option: The option the values are listed under
+    :return: The listed values
+    """
+    values = list()
+    lines = iter(output.splitlines())
+    for line in lines:
+        if re.search(rf"{re.escape(option)}\s+<string>", line):
+            break
+    for line in lines:
+        if not (m := HANDBRAKE_LIST_ENTRY.match(line)):
+            break
+        values.append(m.group(1))
+    return values
+
+
+def filter_names(graph: str) -> List[str]:
+    """
+    Get the names of the filters used in an `ffmpeg` filter graph (e.g. `[0:v]scale=1280:-2,format=yuv420p[v]`)
+    :param graph: The filter graph
+    :return: The filter names
+    """
+    names = list()
+    for chain in re.split(r"[;,]", graph):
+        name = re.sub(r"\[[^\]]*\]", "", chain).split("=", 1)[0].strip()
+        # Pieces of filter arguments that contain commas don't look like a filter name (or `name@instance`)
+        if match := re.fullmatch(r"(\w+)(?:@\w+)?", name):
+            names.append(match.group(1))
+    return names
+
+
+def probe_ffmpeg(binary: Path) -> dict:
+    return {
+        "encoders": parse_ffmpeg_list(run_probe([binary, "-hide_banner", "-encoders"])),
+        "filters": parse_ffmpeg_list(run_probe([binary, "-hide_banner", "-filters"])),
+    }
+
+
+def probe_handbrake(binary: Path) -> dict:
+    output = run_probe([binary, "--help"])
+    return {
+        "encoders": parse_handbrake_list(output, "--encoder"),
+        "audio_encoders": parse_handbrake_list(output, "--aencoder"),
+    }
+
+
+def get_capabilities(binary: Optional[Path], prober: Callable[[Path], dict]) -> Optional[dict]:
+    """
+    Get what a binary supports.  Results are cached in memory and in `Config.CAPABILITY_CACHE_FILE` by the path,
+    size, and modification time of the binary, so a binary only gets probed again when it changes.
+    :param binary: The binary to probe
+    :param prober: Function that probes the binary
+    :return: The capabilities of the binary, or None if it doesn't exist or couldn't be probed
+    """
+    if binary is None:
+        return None
+    try:
+        key = file_key(binary)
+    except OSError:
+        return None
+
+    def load():
+        file_cache_key = ":".join(str(i) for i in key)
+        if (capabilities := capability_file_cache.get(file_cache_key)) is not None:
+            return capabilities
+        try:
+            capabilities = prober(binary)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not probe '{binary}': {str(e)}")
+            return None
+        capability_file_cache.set(file_cache_key, capabilities)
+        return capabilities
+
+    if (capabilities := capability_cache.get(key)) is None:
+        if (capabilities := load()) is not None:
+            capability_cache.set(key, capabilities)
+    return capabilities
+
+
+def ffmpeg_capabilities() -> Optional[dict]:
+    return get_capabilities(ffmpeg_path(), probe_ffmpeg)
+
+
+def handbrake_capabilities() -> Optional[dict]:
+    return get_capabilities(handbrake_path(), probe_handbrake)
+
+
+def probe_encoders() -> Dict[str, dict]:
+    """
+    Probe (or load from the cache) the capabilities of every encoder available on the worker
+    :return: The capabilities keyed by the name of the module using the encoder
+    """
+    probes = {"ffmpeg": ffmpeg_capabilities, "handbrake": handbrake_capabilities}
+    return {k: v for k, probe in probes.items() if (v := probe()) is not None}
+
+
+def capability_digest(capabilities: dict) -> str:
+    """
+    Short digest of a capability set, sent with every poll instead of the whole set
+    :param capabilities: The capabilities
+    :return: The digest
+    """
+    return hashlib.sha1(json.dumps(capabilities, sort_keys=True).encode()).hexdigest()[:16]
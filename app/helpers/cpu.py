@@ -0,0 +1,169 @@
+import asyncio
+import fcntl
+import logging
+import os
+import re
+from pathlib import Path
+from typing import IO, List, NamedTuple, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SYSFS_NODES = Path("/sys/devices/system/node")
+SYSFS_CPUS = Path("/sys/devices/system/cpu")
+
+
+class CpuSlot(NamedTuple):
+    index: int
+    cpus: List[int]
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """
+    Parse a kernel CPU list (e.g. `0-3,8-11`)
+    :param cpu_list: The CPU list
+    :return: The CPUs in the list
+    """
+    cpus = list()
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """
+    Format CPUs as a kernel CPU list (e.g. `0-3,8-11`)
+    :param cpus: The CPUs
+    :return: The CPU list
+    """
+    ranges = list()
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def core_key(cpu: int) -> tuple:
+    try:
+        topology = SYSFS_CPUS / f"cpu{cpu}" / "topology"
+        return int((topology / "physical_package_id").read_text()), int((topology / "core_id").read_text()), cpu
+    except (OSError, ValueError):
+        return 0, cpu, cpu
+
+
+def cpu_topology() -> List[List[int]]:
+    """
+    Get the CPUs this process may run on, grouped by NUMA node.  Within a node the CPUs are ordered by package and
+    core, so the hyperthreads of a core end up next to each other.
+    :return: The CPUs of each NUMA node
+    """
+    available = os.sched_getaffinity(0)
+    nodes = list()
+    for node in sorted(SYSFS_NODES.glob("node[0-9]*"), key=lambda i: int(i.name[4:])):
+        try:
+            cpus = [i for i in parse_cpu_list((node / "cpulist").read_text()) if i in available]
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(cpus)
+    # Anything the node list missed (or all of it, without NUMA information) counts as one more node
+    if missing := available.difference(*nodes):
+        nodes.append(sorted(missing))
+    return [sorted(i, key=core_key) for i in nodes]
+
+
+def partition_cpus(slots: int) -> List[List[int]]:
+    """
+    Split the CPUs of this machine into CPU sets for concurrent encodes.  With at least as many NUMA nodes as slots,
+    every slot gets whole nodes; otherwise the CPUs are split into consecutive runs (in topology order), so slots
+    only span NUMA nodes or split the hyperthreads of a core when the numbers don't divide evenly.
+    :param slots: The number of concurrent encodes
+    :return: The CPUs of each slot
+    """
+    nodes = cpu_topology()
+    if slots <= len(nodes):
+        return [sorted(cpu for node in nodes[i::slots] for cpu in node) for i in range(slots)]
+    cpus = [cpu for node in nodes for cpu in node]
+    slots = min(slots, len(cpus))
+    size, extra = divmod(len(cpus), slots)
+    partitions, start = list(), 0
+    for i in range(slots):
+        end = start + size + (1 if i < extra else 0)
+        partitions.append(sorted(cpus[start:end]))
+        start = end
+    return partitions
+
+
+class CpuLease:
+    """
+    Leases one of the `Config.CPU_SLOTS` CPU sets of the machine for an encode, so concurrent encodes (from several
+    workers on the same machine, or task processes) don't fight over the same cores.  Leases are `flock`s on a file
+    per slot in `Config.CPU_LOCK_DIRECTORY`, which the kernel releases when the holder exits, so a crashed worker
+    never keeps a slot.  Workers in separate containers need to share the lock directory.
+
+    Used as an async context manager that waits for a free slot, then returns it (or None when CPU slots are
+    disabled).
+    """
+
+    def __init__(self, slots: int = None):
+        """
+        CpuLease constructor
+        :param slots: Override the number of CPU slots
+        """
+        self.slots = Config.CPU_SLOTS if slots is None else slots
+        self.slot = None
+        self.__file: Optional[IO] = None
+
+    def try_acquire(self, index: int) -> bool:
+        lock_file = Config.CPU_LOCK_DIRECTORY / f"slot_{index}_of_{self.slots}.lock"
+        file = lock_file.open("a")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        self.__file = file
+        return True
+
+    async def __aenter__(self) -> Optional[CpuSlot]:
+        if self.slots <= 0:
+            return None
+        partitions = partition_cpus(self.slots)
+        try:
+            Config.CPU_LOCK_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not create the CPU lock directory, not pinning the encoder: {str(e)}")
+            return None
+        waiting = False
+        while True:
+            for index, cpus in enumerate(partitions):
+                if self.try_acquire(index):
+                    self.slot = CpuSlot(index, cpus)
+                    return self.slot
+            if not waiting:
+                logger.info("All CPU slots are in use, waiting for one to free up...")
+                waiting = True
+            await asyncio.sleep(Config.CPU_SLOT_POLL_INTERVAL)
+
+    async def __aexit__(self, *_) -> None:
+        if self.__file is not None:
+            fcntl.flock(self.__file, fcntl.LOCK_UN)
+            self.__file.close()
+            self.__file = None
+        self.slot = None
+
+
+def has_option(options: str, key: str) -> bool:
+    """
+    Check whether a `key=value:key=value` option string (like x265 params or HandBrake encopts) sets a key
+    :param options: The option string
+    :param key: The key
+    :return: Whether the key is set
+    """
+    return re.search(rf"(^|:){re.escape(key)}=", options) is not None
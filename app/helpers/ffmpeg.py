@@ -1,240 +1,511 @@
-import re
-import shlex
-import shutil
-import subprocess
-import time
-from pathlib import Path
-from typing import List, NamedTuple, Union
-
-from pymediainfo import MediaInfo
-from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
-
-SUBTITLES = "s"
-AUDIO = "a"
-VIDEO = "v"
-
-
-class TrackInfo(NamedTuple):
-    codec: str
-    track: int
-    language: str
-    bitrate: str
-    forced: bool
-    default: bool
-    frames: int
-    type: str
-    title: str = None
-    channels: str = None
-
-
-class Source:
-    source: int
-    stream_type: str
-    stream: int
-
-    def __init__(
-        self, source: int, stream_type: str = None, stream: int = None
-    ) -> None:
-        self.source = source
-        self.stream_type = stream_type
-        self.stream = stream
-
-    @property
-    def cli_options(self):
-        o = f"{self.source}"
-        if self.stream_type is not None:
-            o += f":{self.stream_type}"
-        if self.stream is not None:
-            o += f":{self.stream}"
-        return f"-map {o}"
-
-
-class SourceOutput:
-    stream_type: str
-    stream: int
-    options: dict
-
-    def __init__(
-        self, stream_type: str = None, stream: int = None, options: dict = None
-    ):
-        self.stream_type = stream_type
-        self.stream = stream
-        if options:
-            self.options = options
-        else:
-            self.options = dict()
-
-    @property
-    def cli_options(self):
-        command = ""
-        template = list()
-        if self.stream_type is not None:
-            template.append(f"{self.stream_type}")
-        if self.stream is not None:
-            template.append(f"{self.stream}")
-        template = ":".join(template)
-        for k, v in self.options.items():
-            if template:
-                has_template = ":"
-            else:
-                has_template = ""
-            if type(v) is dict:
-                i = ":".join([f"{i}={j}" for i, j in v.items()])
-                command += f"-{k}{has_template}{template} {i} "
-            else:
-                command += f"-{k}{has_template}{template} {v} "
-        return command.strip()
-
-
-class FfmpegMiscSettings:
-
-    overwrite: bool
-    progress_bar: bool
-    video_info: TrackInfo
-
-    def __init__(self):
-        self.overwrite = False
-        self.progress_bar = False
-        self.video_info = None
-
-
-class Ffmpeg:
-
-    inputs: List[Path]
-    mapped_sources: List[Source]
-    __output: Union[str, Path]
-    source_outputs: List[SourceOutput]
-    settings: FfmpegMiscSettings
-
-    def __init__(self, ffmpeg_path: Path = None):
-        if ffmpeg_path:
-            self.ffmpeg_path = Path(ffmpeg_path)
-        else:
-            self.ffmpeg_path = Path(shutil.which("ffmpeg"))
-        self.inputs = list()
-        self.mapped_sources = list()
-        self.mapped_outputs = list()
-        self.settings = FfmpegMiscSettings()
-
-    def generate_command(self) -> str:
-        command = f"{self.ffmpeg_path} "
-        if self.settings.overwrite:
-            command += "-y "
-        command += "-progress pipe:1 "
-        for i in self.inputs:
-            command += f'-i "{i}" '
-        for source in self.mapped_sources:
-            command += f"{source.cli_options} "
-        for source_output in self.mapped_outputs:
-            command += f"{source_output.cli_options} "
-        command += f'"{self.output}"'
-        return command.strip()
-
-    def run(self, verbose: bool = False) -> None:
-        command = shlex.split(self.generate_command())
-        if verbose:
-            subprocess.run(command)
-        else:
-            frames = self.settings.video_info.frames
-            progress = Progress(
-                TextColumn("[#ffff00]»[bold green] encode"),
-                BarColumn(
-                    bar_width=None,
-                ),
-                "[progress.percentage]{task.percentage:>3.1f}%",
-                "•",
-                "[green]{task.completed}/{task.total}[/green]",
-                "•",
-                TimeRemainingColumn(),
-            )
-            progress.start()
-            task = progress.add_task("test")
-            progress.update(task, total=frames)
-            process = subprocess.Popen(
-                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-            )
-
-            regex = r"frame=(\s*\d+)"
-            while True:
-                time.sleep(0.05)
-                output = process.stdout.readline()
-                if process.poll() is not None:
-                    break
-                if output:
-                    if m := re.search(regex, output.decode()):
-                        progress.update(task, completed=int(m.group(1)))
-            progress.update(task, completed=frames)
-            progress.stop()
-
-    @property
-    def output(self) -> Path:
-        return self.__output
-
-    @output.setter
-    def output(self, path: Union[str, Path]) -> None:
-        self.__output = Path(path)
-
-
-class FfmpegInfo:
-    def __init__(self, source_file: Path):
-        self.source_file = source_file
-        self.data = MediaInfo.parse(self.source_file)
-
-    @property
-    def video_tracks(self):
-        return self.process_tracks("Video")
-
-    @property
-    def audio_tracks(self):
-        return self.process_tracks("Audio")
-
-    @property
-    def subtitle_tracks(self):
-        return self.process_tracks("Text")
-
-    @property
-    def tracks(self):
-        return self.process_tracks("All")
-
-    def process_tracks(self, category: str):
-        if category != "All":
-            info = [i for i in self.data.tracks if i.track_type == category]
-        else:
-            info = self.data.tracks
-        temp = list()
-        count = 0
-        for t in info:
-            is_forced = False
-            is_default = False
-            if t.forced == "Yes":
-                is_forced = True
-            if t.default == "Yes":
-                is_default = True
-            temp.append(
-                TrackInfo(
-                    codec=t.codec_id,
-                    track=count,
-                    language=t.language,
-                    bitrate=t.bit_rate,
-                    channels=t.channel_s,
-                    forced=is_forced,
-                    default=is_default,
-                    title=t.title,
-                    frames=int(t.frame_count) if t.frame_count else None,
-                    type=t.track_type,
-                )
-            )
-            count += 1
-        return temp
-
-    @property
-    def video_tracks_raw(self):
-        return [i for i in self.data.tracks if i.track_type == "Video"]
-
-    @property
-    def audio_tracks_raw(self):
-        return [i for i in self.data.tracks if i.track_type == "Audio"]
-
-    @property
-    def subtitle_tracks_raw(self):
-        return [i for i in self.data.tracks if i.track_type == "Text"]
+import re
+import shlex
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Union
+
+from helpers.cache import Cache, file_key
+from helpers.cpu import has_option
+
+SUBTITLES = "s"
+AUDIO = "a"
+VIDEO = "v"
+
+probe_cache = Cache(name="probes", max_size=32)
+
+# The MediaInfo format of the streams produced by ffmpeg encoders, for deciding whether a stream can be copied
+ENCODER_FORMATS = {
+    "aac": "AAC",
+    "libfdk_aac": "AAC",
+    "ac3": "AC-3",
+    "eac3": "E-AC-3",
+    "flac": "FLAC",
+    "libmp3lame": "MPEG Audio",
+    "libopus": "Opus",
+    "opus": "Opus",
+    "libvorbis": "Vorbis",
+    "ass": "ASS",
+    "ssa": "ASS",
+    "srt": "UTF-8",
+    "subrip": "UTF-8",
+    "webvtt": "WebVTT",
+}
+# Options that filter the stream, a stream can't be copied if the output sets any of them
+PASSTHROUGH_BLOCKERS = ["af", "filter", "filter_complex"]
+PASSTHROUGH_KEPT_OPTIONS = ["metadata", "disposition"]
+# Video filter options that move into the shared filter graph when an output is part of a rendition ladder
+VIDEO_FILTER_OPTIONS = ["vf", "filter"]
+
+class TrackInfo(NamedTuple):
+    codec: str
+    track: int
+    language: str
+    bitrate: str
+    forced: bool
+    default: bool
+    frames: int
+    type: str
+    title: str = None
+    channels: str = None
+    duration: float = None
+    format: str = None
+    sampling_rate: int = None
+
+
+class Source:
+    source: int
+    stream_type: str
+    stream: int
+
+    def __init__(
+        self, source: int, stream_type: str = None, stream: int = None
+    ) -> None:
+        self.source = source
+        self.stream_type = stream_type
+        self.stream = stream
+
+    @property
+    def cli_options(self):
+        o = f"{self.source}"
+        if self.stream_type is not None:
+            o += f":{self.stream_type}"
+        if self.stream is not None:
+            o += f":{self.stream}"
+        return f"-map {o}"
+
+
+class SourceOutput:
+    stream_type: str
+    stream: int
+    options: dict
+
+    def __init__(
+        self, stream_type: str = None, stream: int = None, options: dict = None
+    ):
+        self.stream_type = stream_type
+        self.stream = stream
+        if options:
+            self.options = options
+        else:
+            self.options = dict()
+
+    def limit_threads(self, threads: int) -> None:
+        """
+        Limit the number of threads the encoder of this output uses (`-threads`, plus the thread pools of x265),
+        unless the output already sets them.
+        :param threads: The number of threads
+        """
+        self.options.setdefault("threads", threads)
+        codec = next((str(v) for k, v in self.options.items() if k in ["c", "codec", "vcodec"]), None)
+        if codec != "libx265":
+            return
+        params = self.options.get("x265-params")
+        if params is None:
+            self.options["x265-params"] = {"pools": threads}
+        elif isinstance(params, dict):
+            params.setdefault("pools", threads)
+        elif not has_option(str(params), "pools"):
+            self.options["x265-params"] = f"{params}:pools={threads}"
+
+    @property
+    def cli_options(self):
+        command = ""
+        template = list()
+        if self.stream_type is not None:
+            template.append(f"{self.stream_type}")
+        if self.stream is not None:
+            template.append(f"{self.stream}")
+        template = ":".join(template)
+        for k, v in self.options.items():
+            if template:
+                has_template = ":"
+            else:
+                has_template = ""
+            if type(v) is dict:
+                i = ":".join([f"{i}={j}" for i, j in v.items()])
+                command += f"-{k}{has_template}{template} {i} "
+            else:
+                command += f"-{k}{has_template}{template} {v} "
+        return command.strip()
+
+
+def parse_bitrate(value) -> Optional[float]:
+    """
+    Parse a bitrate the way ffmpeg does (e.g. `128k`, `1.5M`, `96000`)
+    :param value: The bitrate
+    :return: The bitrate in bits per second, or None if it can't be parsed
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)\s*", str(value))
+    if not match:
+        return None
+    return float(match.group(1)) * {"": 1, "k": 1e3, "m": 1e6, "g": 1e9}[match.group(2).lower()]
+
+
+def first_number(value) -> Optional[float]:
+    # MediaInfo reports multiple values separated by slashes (e.g. `6 / 2` channels) for some tracks
+    try:
+        return float(str(value).split("/")[0].strip())
+    except ValueError:
+        return None
+
+
+def passthrough_mismatch(track: TrackInfo, options: dict, bitrate_tolerance: float = 0.0) -> Optional[str]:
+    """
+    Check whether a source stream already satisfies the encoding options of an output, so it can be copied instead
+    of re-encoded.  The codec has to match, the source bitrate can't exceed the target bitrate (plus the tolerance),
+    and the channels and sample rate have to match when the options set them.  Options that filter the stream rule
+    out copying it.
+    :param track: The source stream
+    :param options: The encoding options of the output
+    :param bitrate_tolerance: How far the source bitrate may exceed the target bitrate, as a fraction of it
+    :return: Why the stream can't be copied, or None if it can
+    """
+    codec = next((str(v) for k, v in options.items() if k in ["c", "codec", "acodec", "scodec"]), None)
+    if codec is None or codec == "copy":
+        return "the output has no encoder to skip"
+    if (blocker := next((k for k in options if k in PASSTHROUGH_BLOCKERS), None)) is not None:
+        return f"the output filters the stream ('{blocker}')"
+    if ENCODER_FORMATS.get(codec) is None or ENCODER_FORMATS[codec] != track.format:
+        return f"the source is {track.format}, not what '{codec}' produces"
+    if "b" in options:
+        target, source = parse_bitrate(options["b"]), first_number(track.bitrate)
+        if target is None or source is None:
+            return "the source bitrate is unknown"
+        if source > target * (1 + bitrate_tolerance):
+            return f"the source bitrate {source / 1000:.0f}k is above the target {target / 1000:.0f}k"
+    if "ac" in options and first_number(track.channels) != first_number(options["ac"]):
+        return f"the source has {track.channels} channels instead of {options['ac']}"
+    if "ar" in options and first_number(track.sampling_rate) != first_number(options["ar"]):
+        return f"the source sample rate is {track.sampling_rate} instead of {options['ar']}"
+    return None
+
+
+class Rendition:
+    """
+    One output file of a rendition ladder, encoded from the same decode of the source as the other renditions.
+    """
+
+    output: Path
+    mapped_outputs: List[SourceOutput]
+
+    def __init__(self, output: Union[str, Path], mapped_outputs: List[SourceOutput] = None):
+        self.output = Path(output)
+        self.mapped_outputs = mapped_outputs if mapped_outputs else list()
+
+    @property
+    def video_outputs(self) -> List[SourceOutput]:
+        return [i for i in self.mapped_outputs if i.stream_type == VIDEO]
+
+
+class TrackEncode(NamedTuple):
+    source: Source
+    output: SourceOutput
+    path: Path
+
+
+class FfmpegMiscSettings:
+
+    overwrite: bool
+    progress_bar: bool
+    video_info: TrackInfo
+
+    def __init__(self):
+        self.overwrite = False
+        self.progress_bar = False
+        self.video_info = None
+
+
+class Ffmpeg:
+
+    inputs: List[Path]
+    mapped_sources: List[Source]
+    __output: Union[str, Path]
+    source_outputs: List[SourceOutput]
+    settings: FfmpegMiscSettings
+
+    def __init__(self, ffmpeg_path: Path = None):
+        if ffmpeg_path:
+            self.ffmpeg_path = Path(ffmpeg_path)
+        else:
+            self.ffmpeg_path = Path(shutil.which("ffmpeg"))
+        self.inputs = list()
+        self.mapped_sources = list()
+        self.mapped_outputs = list()
+        self.renditions = list()
+        self.settings = FfmpegMiscSettings()
+
+    @property
+    def all_outputs(self) -> List[SourceOutput]:
+        """
+        The outputs of the single output file, or of every rendition when encoding a ladder
+        """
+        return [*self.mapped_outputs, *[i for r in self.renditions for i in r.mapped_outputs]]
+
+    def ladder_graph(self) -> str:
+        """
+        Build the filter graph that feeds every video output of the renditions from one decode of the video source:
+        the source is split once, then each branch runs through the video filters of its output and ends up in a
+        `[vN]` label, numbered across the renditions in order.
+        :return: The filter graph
+        """
+        video = next(i for i in self.mapped_sources if i.stream_type == VIDEO)
+        label = f"[{video.source}:{VIDEO}" + (f":{video.stream}]" if video.stream is not None else "]")
+        outputs = [i for r in self.renditions for i in r.video_outputs]
+        chains = [
+            ",".join(str(v) for k, v in output.options.items() if k in VIDEO_FILTER_OPTIONS) or "null"
+            for output in outputs
+        ]
+        if len(chains) == 1:
+            return f"{label}{chains[0]}[v0]"
+        branches = "".join(f"[s{i}]" for i in range(len(chains)))
+        return ";".join([f"{label}split={len(chains)}{branches}", *[f"[s{i}]{c}[v{i}]" for i, c in enumerate(chains)]])
+
+    def split_tracks_problem(self) -> Optional[str]:
+        """
+        Check whether the audio and subtitle outputs can be encoded by their own processes, which needs every source
+        map entry to pick a single stream and every output to be set for a stream type
+        :return: Why the tracks can't be split, or None if they can
+        """
+        if self.renditions:
+            return "rendition ladders share one process"
+        if not all(i.stream_type is not None and i.stream is not None for i in self.mapped_sources):
+            return "the source map does not map single streams"
+        if not all(i.stream_type is not None for i in self.mapped_outputs):
+            return "some outputs are not set for a stream type"
+        if any("filter_complex" in i.options for i in self.mapped_outputs):
+            return "an output uses a complex filter graph"
+        return None
+
+    def track_encodes(self, directory: Path) -> List[TrackEncode]:
+        """
+        Plan a separate encode into `directory` for every audio and subtitle stream in the source map.  The n-th
+        mapped stream of a type gets the options of the output for stream n of that type, like in a single command.
+        :param directory: Where the intermediate files go
+        :return: The encodes, in source map order
+        """
+        tracks, counts = list(), dict()
+        for source in self.mapped_sources:
+            if source.stream_type == VIDEO:
+                continue
+            index = counts.get(source.stream_type, 0)
+            counts[source.stream_type] = index + 1
+            options = next(
+                (i.options for i in self.mapped_outputs if i.stream_type == source.stream_type and i.stream == index),
+                dict(),
+            )
+            path = directory / f"track_{len(tracks):02d}_{source.stream_type}{index}.mkv"
+            tracks.append(TrackEncode(source, SourceOutput(source.stream_type, 0, options), path))
+        return tracks
+
+    def generate_track_command(self, track: TrackEncode) -> str:
+        command = f"{self.ffmpeg_path} "
+        if self.settings.overwrite:
+            command += "-y "
+        command += f'-i "{self.inputs[track.source.source]}" '
+        command += f"-map 0:{track.source.stream_type}:{track.source.stream} "
+        if options := track.output.cli_options:
+            command += f"{options} "
+        return command + f'-f matroska "{track.path}"'
+
+    def generate_video_command(self, path: Path) -> str:
+        """
+        Generate the command for the video streams alone, written to an intermediate file
+        :param path: The intermediate file
+        :return: The command
+        """
+        command = f"{self.ffmpeg_path} "
+        if self.settings.overwrite:
+            command += "-y "
+        command += "-progress pipe:1 "
+        for i in self.inputs:
+            command += f'-i "{i}" '
+        for source in [i for i in self.mapped_sources if i.stream_type == VIDEO]:
+            command += f"{source.cli_options} "
+        for source_output in [i for i in self.mapped_outputs if i.stream_type == VIDEO]:
+            command += f"{source_output.cli_options} "
+        return command + f'-f matroska "{path}"'
+
+    def generate_mux_command(self, video: Optional[Path], tracks: List[TrackEncode]) -> str:
+        """
+        Generate the command that copies the intermediate files into the output, keeping the order of the source
+        map.  The global metadata and chapters come from the first intermediate file, which carries those of the
+        source.
+        :param video: The intermediate file of the video streams, if any
+        :param tracks: The track encodes
+        :return: The command
+        """
+        command = f"{self.ffmpeg_path} "
+        if self.settings.overwrite:
+            command += "-y "
+        paths = ([video] if video else []) + [i.path for i in tracks]
+        for path in paths:
+            command += f'-i "{path}" '
+        video_index = 0
+        for source in self.mapped_sources:
+            if source.stream_type == VIDEO:
+                command += f"-map 0:{VIDEO}:{video_index} "
+                video_index += 1
+            else:
+                track = next(i for i, t in enumerate(tracks) if t.source is source)
+                command += f"-map {track + (1 if video else 0)}:0 "
+        return command + f'-c copy "{self.output}"'
+
+    def generate_command(self) -> str:
+        command = f"{self.ffmpeg_path} "
+        if self.settings.overwrite:
+            command += "-y "
+        command += "-progress pipe:1 "
+        for i in self.inputs:
+            command += f'-i "{i}" '
+        if self.renditions:
+            return command + self.ladder_options()
+        for source in self.mapped_sources:
+            command += f"{source.cli_options} "
+        for source_output in self.mapped_outputs:
+            command += f"{source_output.cli_options} "
+        command += f'"{self.output}"'
+        return command.strip()
+
+    def ladder_options(self) -> str:
+        """
+        Generate the filter graph and output files of a rendition ladder.  Every rendition maps the same sources,
+        except that the video source is replaced by the filter graph outputs of its own video outputs.
+        :return: The part of the command after the inputs
+        """
+        command = f"-filter_complex {shlex.quote(self.ladder_graph())} "
+        label = 0
+        for rendition in self.renditions:
+            for source in self.mapped_sources:
+                if source.stream_type != VIDEO:
+                    command += f"{source.cli_options} "
+                    continue
+                for _ in rendition.video_outputs:
+                    command += f"-map [v{label}] "
+                    label += 1
+            for source_output in rendition.mapped_outputs:
+                options = source_output.options
+                if source_output.stream_type == VIDEO:
+                    options = {k: v for k, v in options.items() if k not in VIDEO_FILTER_OPTIONS}
+                command += f"{SourceOutput(source_output.stream_type, source_output.stream, options).cli_options} "
+            command += f'"{rendition.output}" '
+        return command.strip()
+
+    def run(self, verbose: bool = False) -> None:
+        command = shlex.split(self.generate_command())
+        if verbose:
+            subprocess.run(command)
+        else:
+            from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
+
+            frames = self.settings.video_info.frames
+            progress = Progress(
+                TextColumn("[#ffff00]»[bold green] encode"),
+                BarColumn(
+                    bar_width=None,
+                ),
+                "[progress.percentage]{task.percentage:>3.1f}%",
+                "•",
+                "[green]{task.completed}/{task.total}[/green]",
+                "•",
+                TimeRemainingColumn(),
+            )
+            progress.start()
+            task = progress.add_task("test")
+            progress.update(task, total=frames)
+            process = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            )
+
+            regex = r"frame=(\s*\d+)"
+            while True:
+                time.sleep(0.05)
+                output = process.stdout.readline()
+                if process.poll() is not None:
+                    break
+                if output:
+                    if m := re.search(regex, output.decode()):
+                        progress.update(task, completed=int(m.group(1)))
+            progress.update(task, completed=frames)
+            progress.stop()
+
+    @property
+    def output(self) -> Path:
+        return self.__output
+
+    @output.setter
+    def output(self, path: Union[str, Path]) -> None:
+        self.__output = Path(path)
+
+
+class FfmpegInfo:
+    def __init__(self, source_file: Path):
+        from pymediainfo import MediaInfo
+
+        self.source_file = source_file
+        self.data = probe_cache.fetch(
+            file_key(self.source_file), lambda: MediaInfo.parse(self.source_file)
+        )
+
+    @property
+    def video_tracks(self):
+        return self.process_tracks("Video")
+
+    @property
+    def audio_tracks(self):
+        return self.process_tracks("Audio")
+
+    @property
+    def subtitle_tracks(self):
+        return self.process_tracks("Text")
+
+    @property
+    def tracks(self):
+        return self.process_tracks("All")
+
+    def process_tracks(self, category: str):
+        if category != "All":
+            info = [i for i in self.data.tracks if i.track_type == category]
+        else:
+            info = self.data.tracks
+        temp = list()
+        count = 0
+        for t in info:
+            is_forced = False
+            is_default = False
+            if t.forced == "Yes":
+                is_forced = True
+            if t.default == "Yes":
+                is_default = True
+            temp.append(
+                TrackInfo(
+                    codec=t.codec_id,
+                    track=count,
+                    language=t.language,
+                    bitrate=t.bit_rate,
+                    channels=t.channel_s,
+                    forced=is_forced,
+                    default=is_default,
+                    title=t.title,
+                    frames=int(t.frame_count) if t.frame_count else None,
+                    type=t.track_type,
+                    duration=float(t.duration) / 1000 if t.duration else None,
+                    format=t.format,
+                    sampling_rate=t.sampling_rate,
+                )
+            )
+            count += 1
+        return temp
+
+    @property
+    def video_tracks_raw(self):
+        return [i for i in self.data.tracks if i.track_type == "Video"]
+
+    @property
+    def audio_tracks_raw(self):
+        return [i for i in self.data.tracks if i.track_type == "Audio"]
+
+    @property
+    def subtitle_tracks_raw(self):
+        return [i for i in self.data.tracks if i.track_type == "Text"]
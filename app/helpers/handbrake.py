@@ -1,270 +1,757 @@
-import shlex
-import shutil
-from pathlib import Path
-from typing import List, Union
-
-import box
-from box import Box
-
-
-class HandbrakeTrack:
-    """
-    Used to store audio and subtitle information.  Since they're fairly simple, you just need to pass the track number
-    and the options associated with each.  For available options, look under the Audio Options and Subtitles Options
-    in the help of HandBrakeCLI
-    """
-
-    options: Box
-    track: Union[int, str]
-
-    def __init__(self, track: Union[int, str], options: Union[Box, dict] = None):
-        """
-        HandbrakeTrack constructor
-        :param track: The track from the source file
-        :param options: The options for that track
-        """
-        self.track = track
-        if options is not None:
-            self.options = Box(options)
-        else:
-            self.options = Box()
-
-
-class Handbrake:
-    """
-    The core Handbrake module. This will build a correct CLI set of arguments for the HandBrakeCLI binary.
-    """
-
-    __source: Path
-    __output_file: Path
-    audio_tracks: List[HandbrakeTrack]
-    cli_path: Path
-    destination_options: Box
-    filter_options: Box
-    general_options: Box
-    picture_options: Box
-    source_options: Box
-    subtitle_tracks: List[HandbrakeTrack]
-    video_options: Box
-
-    def __init__(self, cli_path: Union[Path, str] = None):
-        """
-        Handbrake constructor
-        :param cli_path: Override the HandBrakeCLI binary path
-        """
-        if cli_path:
-            self.cli_path = Path(cli_path)
-        else:
-            self.cli_path = Path(shutil.which("HandBrakeCLI"))
-        self.audio_tracks = list()
-        self.destination_options = Box()
-        self.encoder_options = Box()
-        self.filters_options = Box()
-        self.general_options = Box()
-        self.picture_options = Box()
-        self.source_options = Box()
-        self.subtitle_tracks = list()
-        self.video_options = Box()
-
-    @property
-    def source(self) -> Path:
-        """
-        Return the source file as a Path
-        :return: Path of the source file
-        """
-        return Path(self.__source)
-
-    @source.setter
-    def source(self, source_file: Union[str, Path]):
-        """
-        Sets the source file path and ensures it's an actual Path object
-        :param source_file: The path of the source file (either string or Path)
-        """
-        self.__source = Path(source_file)
-
-    @property
-    def output_file(self) -> Path:
-        """
-        Return the output file as a Path
-        :return: Path of the output file
-        """
-        return Path(self.__output_file)
-
-    @output_file.setter
-    def output_file(self, output_file: Union[str, Path]):
-        """
-        Sets the output file path and ensures it's an actual Path object
-        :param output_file:
-        """
-        self.__output_file = Path(output_file)
-
-    @staticmethod
-    def __generate_generic_options(source: Box) -> List[str]:
-        """
-        Converts a Box of key/value options into a list of command-line parameters that can be used to feed
-        HandBrake.  Keys should avoid using dashes and instead use underscores which will be converted into dashes
-        for the key values.
-        :param source: Box of key/value options
-        :return: List of processed command-line options
-        """
-        command = list()
-        for k, v in source.items():
-            key = str(k).replace("_", "-")
-            if len(k) == 1:
-                command.append(f"-{key}")
-            else:
-                command.append(f"--{key}")
-            if v is not None and type(v) is not bool:
-                command.append(v)
-        return [str(i) for i in command]
-
-    def generate_general_options(self) -> List[str]:
-        """
-        Generates the video options.
-        :return: List of video options for the CLI
-        """
-        return self.__generate_generic_options(self.general_options)
-
-    def generate_video_options(self) -> List[str]:
-        """
-        Generates the video options.
-        :return: List of video options for the CLI
-        """
-        return self.__generate_generic_options(self.video_options)
-
-    def generate_source_options(self) -> List[str]:
-        """
-        Generates the source options.
-        :return: List of source options for the CLI
-        """
-        command = ["-i", str(self.source.absolute())]
-        command.extend(self.__generate_generic_options(self.source_options))
-        return command
-
-    def generate_destination_options(self) -> List[str]:
-        """
-        Generates the destination options.
-        :return: List of source options for the CLI
-        """
-        command = ["-o", str(self.output_file.absolute())]
-        command.extend(self.__generate_generic_options(self.destination_options))
-        return command
-
-    def generate_filters_options(self) -> List[str]:
-        """
-        Generates the filters options.
-        :return: List of filters options for the CLI
-        """
-        return self.__generate_generic_options(self.filters_options)
-
-    def generate_picture_options(self) -> List[str]:
-        """
-        Generates the picture options.
-        :return: List of picture options for the CLI
-        """
-        return self.__generate_generic_options(source=self.picture_options)
-
-    def generate_track_options(self, track_type: str) -> List[str]:
-        """
-        Processes all of the tracks in a list, then merges them into the appropriate CLI values (used for audio and
-        subtitles)
-        :param track_type: Type of track (either 'audio' or 'subtitles')
-        :return: List of audio/subtitle options for the CLI
-        """
-        unset_value = "-1"
-        options_list = list()
-        tracks = getattr(self, f"{track_type}_tracks")
-        if len(tracks) == 0:
-            return list()
-        for t in tracks:
-            [options_list.append(k) for k in t.options.keys() if k not in options_list]
-
-        results = Box()
-        for option in options_list:
-            results[option] = list()
-        results[track_type] = [str(i.track) for i in tracks]
-        for t in tracks:
-            for option in options_list:
-                try:
-                    results[option].append(t.options[option])
-                except box.exceptions.BoxKeyError:
-                    results[option].append(unset_value)
-        results = {k: ",".join([str(i) for i in v]) for k, v in results.items()}
-        return self.__generate_generic_options(Box(results))
-
-    def generate_audio_options(self) -> List[str]:
-        """
-        Generates the appropriate audio options from the tracks provided
-        :return: List of audio options for the CLI
-        """
-        return self.generate_track_options(track_type="audio")
-
-    def generate_subtitle_options(self) -> List[str]:
-        """
-        Generates the appropriate subtitle options from the tracks provided
-        :return: List of subtitle options for the CLI
-        """
-        return self.generate_track_options(track_type="subtitle")
-
-    def generate_cli(self, to_string: bool = False) -> Union[str, List]:
-        """
-        Generates the full command-line parameter set including the HandBrake binary path.
-        :param to_string: Convert the HandBrakeCLI command to a string
-        :return: Return the HandBrakeCLI command options
-        """
-        option_list = [
-            self.generate_general_options,
-            self.generate_source_options,
-            self.generate_destination_options,
-            self.generate_video_options,
-            self.generate_audio_options,
-            self.generate_picture_options,
-            self.generate_filters_options,
-            self.generate_subtitle_options,
-        ]
-        command = [str(self.cli_path)]
-        [command.extend(i()) for i in option_list]
-        if to_string:
-            return shlex.join(command)
-        return command
-
-
-if __name__ == "__main__":
-    """
-    This is a quick example of how everything works.  If adding options that require dashes, they need to be replaced
-    with underscores.  Also, beginning dashes for options should be removed.
-
-    For example: --no-deinterlace -> "no_deinterlace"
-
-    Tracks don't require options, and you don't have to ensure that every track has all of the options defined for each
-    track added.  Handbrake will figure all that out on its own.
-
-    Options that have no associated values (e.g. flags) must have a value associated with them of either None or True.
-    This will tell Handbrake to drop the value from the parameter list.
-
-    Source file and output files need to be defined _outside_ of their option groups.  This makes it easier to
-    validate.
-    """
-    h = Handbrake()
-    h.source = "test 2.mkv"
-    h.output_file = "output.mkv"
-    h.general_options.verbose = 3
-    h.source_options.chapters = "1-3"
-    h.destination_options.format = "av_mkv"
-    h.video_options.encoder = "x265_10bit"
-    h.video_options.q = 19
-    h.audio_tracks.append(
-        HandbrakeTrack(
-            track=1, options={"aencoder": "opus", "downmix": "stereo", "ab": "128"}
-        )
-    )
-    h.audio_tracks.append(
-        HandbrakeTrack(track=2, options={"aencoder": "ac3", "drc": 1.5})
-    )
-    h.picture_options.w = 1920
-    h.picture_options.h = 1080
-    h.filters_options.no_comb_detect = True
-    h.filters_options.no_deinterlace = True
-    h.subtitle_tracks.append(HandbrakeTrack(track=1))
-    h.subtitle_tracks.append(HandbrakeTrack(track=2))
-    print(h.generate_cli(to_string=True))
+import asyncio
+import copy
+import hashlib
+import itertools
+import json
+import logging
+import shlex
+import shutil
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Union
+
+import box
+from box import Box
+
+from config import Config
+from helpers.cache import Cache, FileCache, file_key
+from helpers.cpu import has_option
+from helpers.process import run_process
+
+logger = logging.getLogger(__name__)
+
+# The stage reported for each `State` of the `HandBrakeCLI --json` progress
+PROGRESS_STAGES = {
+    "SCANNING": "scanning",
+    "SCANDONE": "scanning",
+    "SEARCHING": "searching",
+    "WORKING": "encoding",
+    "PAUSED": "paused",
+    "MUXING": "muxing",
+    "WORKDONE": "done",
+}
+# HandBrake counts time in ticks of a 90 kHz clock
+TICKS_PER_SECOND = 90000
+# How much longer than its share a segment made of whole chapters may get before cutting by frame instead
+CHAPTER_SEGMENT_IMBALANCE = 1.5
+
+# The option sections a preset can hold, in the order they're put on the command line
+PRESET_SECTIONS = ["general", "source", "destination", "video", "picture", "filters"]
+
+scan_cache = FileCache(name="handbrake_scan", path=Config.HANDBRAKE_SCAN_CACHE_FILE)
+compiled_preset_cache = Cache(name="handbrake_presets", max_size=64)
+
+
+class Segment(NamedTuple):
+    options: dict
+    duration: float
+
+
+class HandbrakePreset(NamedTuple):
+    name: str
+    sections: dict
+    arguments: List[str]
+
+
+class HandbrakePresetError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class HandbrakeScanError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class HandbrakeQueueError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+class HandbrakeTrack:
+    """
+    Used to store audio and subtitle information.  Since they're fairly simple, you just need to pass the track number
+    and the options associated with each.  For available options, look under the Audio Options and Subtitles Options
+    in the help of HandBrakeCLI
+    """
+
+    options: Box
+    track: Union[int, str]
+
+    def __init__(self, track: Union[int, str], options: Union[Box, dict] = None):
+        """
+        HandbrakeTrack constructor
+        :param track: The track from the source file
+        :param options: The options for that track
+        """
+        self.track = track
+        if options is not None:
+            self.options = Box(options)
+        else:
+            self.options = Box()
+
+
+class HandbrakeJsonBlocks:
+    """
+    Incremental parser for the multi-line JSON blocks `HandBrakeCLI --json` prints behind a label (e.g.
+    `Progress: {...}`).  Lines are fed one at a time, and a block is returned once it's complete.  Log lines from
+    stderr that end up between the lines of a block are skipped.
+    """
+
+    def __init__(self, label: str):
+        """
+        HandbrakeJsonBlocks constructor
+        :param label: The label of the blocks to parse, blocks with other labels are skipped
+        """
+        self.prefix = f"{label}: "
+        self.lines = list()
+        self.depth = 0
+
+    def feed(self, line: str) -> Optional[dict]:
+        """
+        Feed a line of output to the parser
+        :param line: A line of output from `HandBrakeCLI`
+        :return: The block if the line completed one, None otherwise
+        """
+        if not self.lines:
+            if not line.startswith(f"{self.prefix}{{"):
+                return None
+            line = line[len(self.prefix):]
+        elif not line[:1].isspace() and not line.startswith(("}", "]")):
+            return None
+        self.lines.append(line)
+        self.depth += line.count("{") + line.count("[") - line.count("}") - line.count("]")
+        if self.depth > 0:
+            return None
+        block = "\n".join(self.lines)
+        self.lines, self.depth = list(), 0
+        try:
+            return json.loads(block)
+        except ValueError:
+            return None
+
+
+class HandbrakeProgress(HandbrakeJsonBlocks):
+    """
+    Parser for the `Progress: {...}` blocks `HandBrakeCLI --json` prints while scanning, encoding, and muxing
+    """
+
+    def __init__(self):
+        super().__init__("Progress")
+
+    @staticmethod
+    def progress_info(block: dict) -> Optional[dict]:
+        """
+        Turn a progress block into the progress reported by the module.  While encoding, that's the pass, the
+        current and average frame rates, HandBrake's own ETA in seconds, and how much of the whole encode (all
+        passes) is done.  The other stages only report how far along they are.
+        :param block: The progress block
+        :return: The progress, or None if the block has nothing to report
+        """
+        state = block.get("State")
+        if state not in PROGRESS_STAGES or state == "WORKDONE":
+            return None
+        # The details are in the one section next to the state (`Scanning`, `Working`, `Muxing`, ...)
+        section = next((v for v in block.values() if isinstance(v, dict)), dict())
+        progress = float(section.get("Progress", 0))
+        info = {"stage": PROGRESS_STAGES[state]}
+        if "Pass" in section:
+            passes = max(int(section.get("PassCount", 1)), 1)
+            current_pass = min(max(int(section["Pass"]), 1), passes)
+            progress = (current_pass - 1 + progress) / passes
+            info.update(
+                {
+                    "pass": current_pass,
+                    "pass_count": passes,
+                    "fps": float(section.get("Rate", 0)),
+                    "average_fps": float(section.get("RateAvg", 0)),
+                    "eta": int(section.get("ETASeconds", 0)),
+                }
+            )
+        info["percent_complete"] = "{:0.2f}".format(min(progress, 1) * 100)
+        return info
+
+    @staticmethod
+    def sequence_id(block: dict) -> Optional[int]:
+        """
+        Find which job of the process a progress block is about
+        :param block: The progress block
+        :return: The `SequenceID` of the job, None if the block isn't about a job (like the scan)
+        """
+        section = next((v for v in block.values() if isinstance(v, dict)), dict())
+        return section.get("SequenceID") or None
+
+
+def title_duration(duration: dict) -> float:
+    """
+    Convert a `Duration` of a HandBrake scan to seconds
+    :param duration: The duration, in ticks and in hours, minutes, and seconds
+    :return: The duration in seconds
+    """
+    if "Ticks" in duration:
+        return duration["Ticks"] / TICKS_PER_SECOND
+    return duration.get("Hours", 0) * 3600 + duration.get("Minutes", 0) * 60 + duration.get("Seconds", 0)
+
+
+class HandbrakeScan:
+    """
+    Scans every title of a source with `HandBrakeCLI --scan --json`, for validating and resolving titles and tracks
+    before encoding.  Only what the module needs from the scan (the titles with their duration, frame rate, chapters,
+    and audio and subtitle tracks) is kept, and cached in `Config.HANDBRAKE_SCAN_CACHE_FILE` by the path, size, and
+    modification time of the source, so a source only gets scanned once no matter how many tasks encode it.
+    """
+
+    def __init__(self, cli_path: Path, source: Path):
+        """
+        HandbrakeScan constructor
+        :param cli_path: The `HandBrakeCLI` binary
+        :param source: The source to scan
+        """
+        self.cli_path = cli_path
+        self.source = source
+
+    def cache_key(self) -> str:
+        return ":".join(str(i) for i in file_key(self.source))
+
+    async def run(self) -> dict:
+        """
+        Scan the source, or get the scan from the cache
+        :return: The scan, with the `titles` of the source, the index of its `main_feature`, and whether it was
+        `cached`
+        """
+        loop = asyncio.get_running_loop()
+        cache_key = await loop.run_in_executor(None, self.cache_key)
+        if (scan := await loop.run_in_executor(None, scan_cache.get, cache_key)) is not None:
+            return {**scan, "cached": True}
+        # Previews are only used for crop detection, which an encode does on its own
+        command = [self.cli_path, "--scan", "--json", "--previews", "1:0", "-t", "0", "-i", self.source]
+        parser = HandbrakeJsonBlocks("JSON Title Set")
+        title_sets, output = list(), list()
+
+        def parse(line: str):
+            output.append(line)
+            if (block := parser.feed(line)) is not None:
+                title_sets.append(block)
+
+        return_code = await run_process(command, parse)
+        if return_code != 0 or not title_sets:
+            raise HandbrakeScanError(
+                f"Could not scan '{self.source}' (exit code {return_code}): {shlex.join(str(i) for i in command)}: "
+                f"{output[-5:]}"
+            )
+        scan = self.parse_title_set(title_sets[-1])
+        await loop.run_in_executor(None, scan_cache.set, cache_key, scan)
+        return {**scan, "cached": False}
+
+    @staticmethod
+    def parse_title_set(title_set: dict) -> dict:
+        """
+        Pick what the module needs out of the title set of a scan
+        :param title_set: The `JSON Title Set` block printed by the scan
+        :return: The titles and the main feature
+        """
+        titles = list()
+        for title in title_set.get("TitleList", list()):
+            frame_rate = title.get("FrameRate", dict())
+            titles.append(
+                {
+                    "index": title["Index"],
+                    "duration": title_duration(title.get("Duration", dict())),
+                    "frame_rate": frame_rate.get("Num", 0) / frame_rate.get("Den", 1) if frame_rate else None,
+                    "chapters": [title_duration(i.get("Duration", dict())) for i in title.get("ChapterList", list())],
+                    "audio": [
+                        {
+                            "track": i.get("TrackNumber", position + 1),
+                            "language": i.get("LanguageCode"),
+                            "language_name": i.get("Language"),
+                            "codec": i.get("CodecName"),
+                        }
+                        for position, i in enumerate(title.get("AudioList", list()))
+                    ],
+                    "subtitle": [
+                        {
+                            "track": i.get("TrackNumber", position + 1),
+                            "language": i.get("LanguageCode"),
+                            "language_name": i.get("Language"),
+                            "format": i.get("SourceName"),
+                        }
+                        for position, i in enumerate(title.get("SubtitleList", list()))
+                    ],
+                }
+            )
+        main_feature = title_set.get("MainFeature")
+        return {"titles": titles, "main_feature": main_feature if main_feature and main_feature > 0 else None}
+
+
+class HandbrakeQueue:
+    """
+    Encodes several sources in a single `HandBrakeCLI` process through a queue file (`--queue-import-file`), instead
+    of starting a process (which scans its source all over again) for each of them.  The queue holds libhb's own job
+    JSON, which `HandBrakeCLI --queue-export-file` exports once for every distinct set of options, and which is then
+    copied for every encode with those options with the source and destination of the encode swapped in.  The jobs
+    are numbered in the order they're added, and that number is the `SequenceID` the progress of the job comes with.
+    """
+
+    def __init__(self, cli_path: Path, directory: Path):
+        """
+        HandbrakeQueue constructor
+        :param cli_path: The `HandBrakeCLI` binary
+        :param directory: Where to write the exported jobs and the queue file
+        """
+        self.cli_path = cli_path
+        self.directory = directory
+        self.exported = dict()
+        self.jobs = list()
+
+    async def add(self, encoder: "Handbrake", chapters: int = 0) -> int:
+        """
+        Add an encode to the queue, exporting the job of its options first if no encode before it had the same ones
+        :param encoder: The command builder of the encode
+        :param chapters: The number of chapters of the title the encode is from, so the encode covers all of them
+        when the export picked the chapters of another source
+        :return: The `SequenceID` of the encode
+        """
+        key = encoder.option_key()
+        if key not in self.exported:
+            self.exported[key] = await self.export(encoder, self.directory / f"export_{len(self.exported):03d}.json")
+        job = copy.deepcopy(self.exported[key])
+        job["Source"]["Path"] = str(encoder.source.absolute())
+        job["Destination"]["File"] = str(encoder.output_file.absolute())
+        if chapters and not encoder.sets_range() and job["Source"].get("Range", dict()).get("Type") == "chapter":
+            job["Source"]["Range"] = {**job["Source"]["Range"], "Start": 1, "End": chapters}
+        job["SequenceID"] = len(self.jobs) + 1
+        self.jobs.append(job)
+        return job["SequenceID"]
+
+    @staticmethod
+    async def export(encoder: "Handbrake", path: Path) -> dict:
+        """
+        Export the job of an encode with `HandBrakeCLI --queue-export-file`
+        :param encoder: The command builder of the encode
+        :param path: Where to export the job to
+        :return: The job JSON of the encode
+        """
+        command = [*encoder.generate_cli(), "--queue-export-file", str(path)]
+        output = list()
+        return_code = await run_process(command, output.append)
+        try:
+            if return_code != 0:
+                raise ValueError(f"exit code {return_code}")
+            queue = await asyncio.get_running_loop().run_in_executor(None, path.read_text)
+            return json.loads(queue)[0]["Job"]
+        except (OSError, ValueError, LookupError, TypeError) as e:
+            raise HandbrakeQueueError(
+                f"Could not export the job of '{encoder.source.name}' ({str(e)}): "
+                f"{shlex.join(str(i) for i in command)}: {output[-5:]}"
+            )
+
+    def write(self) -> Path:
+        """
+        Write the queue file
+        :return: The path of the queue file
+        """
+        path = self.directory / "queue.json"
+        path.write_text(json.dumps([{"Job": i} for i in self.jobs]))
+        return path
+
+    def generate_cli(self, path: Path) -> List[str]:
+        """
+        Generate the command that encodes the whole queue
+        :param path: The path of the queue file
+        :return: The `HandBrakeCLI` command
+        """
+        return [str(self.cli_path), "--queue-import-file", str(path), "--json"]
+
+
+def plan_segments(title: dict, count: int) -> List[Segment]:
+    """
+    Split a title into segments of about the same length that can be encoded on their own.  If the chapters of the
+    title can be grouped into segments of about the same length, the segments are runs of whole chapters
+    (`chapters`), otherwise they're cut by frame (or by time if the frame rate isn't known) with `start_at` and
+    `stop_at`.
+    :param title: The title, from the scan of the source
+    :param count: The number of segments
+    :return: The source options and the duration of every segment
+    """
+    chapters = title["chapters"]
+    if len(chapters) >= count and all(i > 0 for i in chapters):
+        ends, total = list(itertools.accumulate(chapters)), sum(chapters)
+        # Cut at the chapter boundary closest to the share of every segment, keeping a chapter for every segment
+        cuts = [0]
+        for k in range(1, count):
+            candidates = range(cuts[-1] + 1, len(chapters) - (count - k) + 1)
+            cuts.append(min(candidates, key=lambda i: abs(ends[i - 1] - total * k / count)))
+        cuts.append(len(chapters))
+        segments = [Segment({"chapters": f"{a + 1}-{b}"}, sum(chapters[a:b])) for a, b in zip(cuts, cuts[1:])]
+        if max(i.duration for i in segments) <= total / count * CHAPTER_SEGMENT_IMBALANCE:
+            return segments
+    if title.get("frame_rate"):
+        frames = round(title["duration"] * title["frame_rate"])
+        cuts = [round(frames * i / count) for i in range(count + 1)]
+        unit, rate = "frame", title["frame_rate"]
+    else:
+        cuts = [round(title["duration"] * i / count, 3) for i in range(count + 1)]
+        unit, rate = "duration", 1
+    segments = list()
+    for index, (start, end) in enumerate(zip(cuts, cuts[1:])):
+        # The first segment starts at the start of the title, the last one runs to its end.  Stops are relative
+        # to the start.
+        options = dict()
+        if index > 0:
+            options["start_at"] = f"{unit}:{start}"
+        if index < count - 1:
+            options["stop_at"] = f"{unit}:{round(end - start, 3)}"
+        segments.append(Segment(options, (end - start) / rate))
+    return segments
+
+
+def find_file_presets(presets: list) -> dict:
+    """
+    Find the presets of a HandBrake preset export, including the ones in folders
+    :param presets: The `PresetList` of the export
+    :return: The presets by name
+    """
+    found = dict()
+    for preset in presets:
+        if preset.get("Folder"):
+            found.update(find_file_presets(preset.get("ChildrenArray", list())))
+        elif "PresetName" in preset:
+            found[preset["PresetName"]] = preset
+    return found
+
+
+def load_preset_file(path: Union[str, Path], name: str) -> HandbrakePreset:
+    """
+    Load a preset from a HandBrake preset export (as saved by the GUI or `HandBrakeCLI --preset-export`).  HandBrake
+    reads the export itself with `--preset-import-file`, so only the video encoder and its options are taken from
+    the preset, for sizing the encoder threads and checking the encoder.  Loaded presets are cached by the path,
+    size, and modification time of the export.
+    :param path: The preset export
+    :param name: The name of the preset in the export
+    :return: The preset
+    """
+    try:
+        key = ("file", *file_key(path), name)
+    except OSError:
+        raise HandbrakePresetError(f"The preset file '{path}' does not exist.")
+
+    def load():
+        try:
+            presets = find_file_presets(json.loads(Path(path).read_text()).get("PresetList", list()))
+        except (OSError, ValueError, AttributeError) as e:
+            raise HandbrakePresetError(f"Could not read the preset file '{path}': {str(e)}")
+        if (preset := presets.get(name)) is None:
+            raise HandbrakePresetError(f"There is no preset '{name}' in the preset file '{path}'.")
+        video_options = {"encoder": preset.get("VideoEncoder", "x264")}
+        if preset.get("VideoOptionExtra"):
+            video_options["encopts"] = preset["VideoOptionExtra"]
+        arguments = ["--preset-import-file", str(Path(path).absolute()), "--preset", name]
+        return HandbrakePreset(name, {"video_options": video_options}, arguments)
+
+    return compiled_preset_cache.fetch(key, load)
+
+
+class Handbrake:
+    """
+    The core Handbrake module. This will build a correct CLI set of arguments for the HandBrakeCLI binary.
+    """
+
+    __source: Path
+    __output_file: Path
+    audio_tracks: List[HandbrakeTrack]
+    cli_path: Path
+    destination_options: Box
+    filter_options: Box
+    general_options: Box
+    picture_options: Box
+    preset: Optional[HandbrakePreset]
+    source_options: Box
+    subtitle_tracks: List[HandbrakeTrack]
+    video_options: Box
+
+    def __init__(self, cli_path: Union[Path, str] = None):
+        """
+        Handbrake constructor
+        :param cli_path: Override the HandBrakeCLI binary path
+        """
+        if cli_path:
+            self.cli_path = Path(cli_path)
+        else:
+            self.cli_path = Path(shutil.which("HandBrakeCLI"))
+        self.audio_tracks = list()
+        self.destination_options = Box()
+        self.encoder_options = Box()
+        self.filters_options = Box()
+        self.general_options = Box()
+        self.picture_options = Box()
+        self.preset = None
+        self.source_options = Box()
+        self.subtitle_tracks = list()
+        self.video_options = Box()
+
+    def limit_threads(self, threads: int) -> None:
+        """
+        Limit the number of threads the video encoder uses (`pools` for x265, `threads` for x264) through the
+        encoder options, unless they already set it.  The encoder and its options can also come from the preset.
+        :param threads: The number of threads
+        """
+        video_options = {**(self.preset.sections.get("video_options", dict()) if self.preset else dict())}
+        video_options.update(self.video_options)
+        encoder = str(video_options.get("encoder", video_options.get("e", "x264")))
+        if encoder.startswith("x265"):
+            key = "pools"
+        elif encoder.startswith("x264"):
+            key = "threads"
+        else:
+            return
+        encopts = str(video_options.get("encopts", ""))
+        if not has_option(encopts, key):
+            self.video_options["encopts"] = f"{encopts}:{key}={threads}" if encopts else f"{key}={threads}"
+
+    @staticmethod
+    def compile_preset(name: str, preset: dict) -> HandbrakePreset:
+        """
+        Compile a preset into the command-line options it stands for, so jobs using it only have to generate the
+        options they set themselves.  Compiled presets are cached by their contents, so a preset is only compiled
+        again after it changes.
+        :param name: The name of the preset
+        :param preset: The option sections of the preset (`video_options`, `filters_options`, ...)
+        :return: The compiled preset
+        """
+        digest = hashlib.sha256(json.dumps(preset, sort_keys=True, default=str).encode()).hexdigest()
+
+        def compile_options():
+            sections = {f"{i}_options": dict(preset.get(f"{i}_options") or dict()) for i in PRESET_SECTIONS}
+            arguments = list()
+            for section in sections.values():
+                arguments.extend(Handbrake.__generate_generic_options(Box(section)))
+            return HandbrakePreset(name, sections, arguments)
+
+        return compiled_preset_cache.fetch(("compiled", name, digest), compile_options)
+
+    @property
+    def source(self) -> Path:
+        """
+        Return the source file as a Path
+        :return: Path of the source file
+        """
+        return Path(self.__source)
+
+    @source.setter
+    def source(self, source_file: Union[str, Path]):
+        """
+        Sets the source file path and ensures it's an actual Path object
+        :param source_file: The path of the source file (either string or Path)
+        """
+        self.__source = Path(source_file)
+
+    @property
+    def output_file(self) -> Path:
+        """
+        Return the output file as a Path
+        :return: Path of the output file
+        """
+        return Path(self.__output_file)
+
+    @output_file.setter
+    def output_file(self, output_file: Union[str, Path]):
+        """
+        Sets the output file path and ensures it's an actual Path object
+        :param output_file:
+        """
+        self.__output_file = Path(output_file)
+
+    @staticmethod
+    def __generate_generic_options(source: Box) -> List[str]:
+        """
+        Converts a Box of key/value options into a list of command-line parameters that can be used to feed
+        HandBrake.  Keys should avoid using dashes and instead use underscores which will be converted into dashes
+        for the key values.
+        :param source: Box of key/value options
+        :return: List of processed command-line options
+        """
+        command = list()
+        for k, v in source.items():
+            key = str(k).replace("_", "-")
+            if len(k) == 1:
+                command.append(f"-{key}")
+            else:
+                command.append(f"--{key}")
+            if v is not None and type(v) is not bool:
+                command.append(v)
+        return [str(i) for i in command]
+
+    def generate_general_options(self) -> List[str]:
+        """
+        Generates the video options.
+        :return: List of video options for the CLI
+        """
+        return self.__generate_generic_options(self.general_options)
+
+    def generate_video_options(self) -> List[str]:
+        """
+        Generates the video options.
+        :return: List of video options for the CLI
+        """
+        return self.__generate_generic_options(self.video_options)
+
+    def generate_source_options(self) -> List[str]:
+        """
+        Generates the source options.
+        :return: List of source options for the CLI
+        """
+        command = ["-i", str(self.source.absolute())]
+        command.extend(self.__generate_generic_options(self.source_options))
+        return command
+
+    def generate_destination_options(self) -> List[str]:
+        """
+        Generates the destination options.
+        :return: List of source options for the CLI
+        """
+        command = ["-o", str(self.output_file.absolute())]
+        command.extend(self.__generate_generic_options(self.destination_options))
+        return command
+
+    def generate_filters_options(self) -> List[str]:
+        """
+        Generates the filters options.
+        :return: List of filters options for the CLI
+        """
+        return self.__generate_generic_options(self.filters_options)
+
+    def generate_picture_options(self) -> List[str]:
+        """
+        Generates the picture options.
+        :return: List of picture options for the CLI
+        """
+        return self.__generate_generic_options(source=self.picture_options)
+
+    def generate_track_options(self, track_type: str) -> List[str]:
+        """
+        Processes all of the tracks in a list, then merges them into the appropriate CLI values (used for audio and
+        subtitles)
+        :param track_type: Type of track (either 'audio' or 'subtitles')
+        :return: List of audio/subtitle options for the CLI
+        """
+        unset_value = "-1"
+        options_list = list()
+        tracks = getattr(self, f"{track_type}_tracks")
+        if len(tracks) == 0:
+            return list()
+        for t in tracks:
+            [options_list.append(k) for k in t.options.keys() if k not in options_list]
+
+        results = Box()
+        for option in options_list:
+            results[option] = list()
+        results[track_type] = [str(i.track) for i in tracks]
+        for t in tracks:
+            for option in options_list:
+                try:
+                    results[option].append(t.options[option])
+                except box.exceptions.BoxKeyError:
+                    results[option].append(unset_value)
+        results = {k: ",".join([str(i) for i in v]) for k, v in results.items()}
+        return self.__generate_generic_options(Box(results))
+
+    def generate_audio_options(self) -> List[str]:
+        """
+        Generates the appropriate audio options from the tracks provided
+        :return: List of audio options for the CLI
+        """
+        return self.generate_track_options(track_type="audio")
+
+    def generate_subtitle_options(self) -> List[str]:
+        """
+        Generates the appropriate subtitle options from the tracks provided
+        :return: List of subtitle options for the CLI
+        """
+        return self.generate_track_options(track_type="subtitle")
+
+    def option_key(self) -> tuple:
+        """
+        The command without the source and output file, which is the same for encodes that only differ in those
+        :return: The options of the command
+        """
+        command = self.generate_cli()
+        for flag in ["-i", "-o"]:
+            index = command.index(flag)
+            del command[index:index + 2]
+        return tuple(command)
+
+    def sets_range(self) -> bool:
+        """
+        Whether the options of the encode (or its preset) pick a part of the title
+        :return: True if they set the chapters or where to start or stop
+        """
+        command = self.generate_cli()
+        return any(i in command for i in ["-c", "--chapters", "--start-at", "--stop-at"])
+
+    def generate_cli(self, to_string: bool = False) -> Union[str, List]:
+        """
+        Generates the full command-line parameter set including the HandBrake binary path.
+        :param to_string: Convert the HandBrakeCLI command to a string
+        :return: Return the HandBrakeCLI command options
+        """
+        option_list = [
+            self.generate_general_options,
+            self.generate_source_options,
+            self.generate_destination_options,
+            self.generate_video_options,
+            self.generate_audio_options,
+            self.generate_picture_options,
+            self.generate_filters_options,
+            self.generate_subtitle_options,
+        ]
+        # The options of the job come after the ones of the preset, so they override it
+        command = [str(self.cli_path)]
+        if self.preset:
+            command.extend(self.preset.arguments)
+        [command.extend(i()) for i in option_list]
+        if to_string:
+            return shlex.join(command)
+        return command
+
+
+if __name__ == "__main__":
+    """
+    This is a quick example of how everything works.  If adding options that require dashes, they need to be replaced
+    with underscores.  Also, beginning dashes for options should be removed.
+
+    For example: --no-deinterlace -> "no_deinterlace"
+
+    Tracks don't require options, and you don't have to ensure that every track has all of the options defined for each
+    track added.  Handbrake will figure all that out on its own.
+
+    Options that have no associated values (e.g. flags) must have a value associated with them of either None or True.
+    This will tell Handbrake to drop the value from the parameter list.
+
+    Source file and output files need to be defined _outside_ of their option groups.  This makes it easier to
+    validate.
+    """
+    h = Handbrake()
+    h.source = "test 2.mkv"
+    h.output_file = "output.mkv"
+    h.general_options.verbose = 3
+    h.source_options.chapters = "1-3"
+    h.destination_options.format = "av_mkv"
+    h.video_options.encoder = "x265_10bit"
+    h.video_options.q = 19
+    h.audio_tracks.append(
+        HandbrakeTrack(
+            track=1, options={"aencoder": "opus", "downmix": "stereo", "ab": "128"}
+        )
+    )
+    h.audio_tracks.append(
+        HandbrakeTrack(track=2, options={"aencoder": "ac3", "drc": 1.5})
+    )
+    h.picture_options.w = 1920
+    h.picture_options.h = 1080
+    h.filters_options.no_comb_detect = True
+    h.filters_options.no_deinterlace = True
+    h.subtitle_tracks.append(HandbrakeTrack(track=1))
+    h.subtitle_tracks.append(HandbrakeTrack(track=2))
+    print(h.generate_cli(to_string=True))
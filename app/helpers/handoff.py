@@ -0,0 +1,130 @@
+import copy
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, List, NamedTuple, Optional
+
+import modules.shared
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+FIFO = "fifo"
+SPOOL = "spool"
+
+
+class Handoff(NamedTuple):
+    producer: int
+    consumer: int
+    path: str
+    mode: str
+
+
+def references(value: Any, path: str) -> bool:
+    """
+    Check whether job data refers to a file anywhere
+    :param value: The job data
+    :param path: The file
+    :return: Whether any string in the data is the path of the file
+    """
+    if isinstance(value, dict):
+        return any(references(i, path) for i in value.values())
+    if isinstance(value, list):
+        return any(references(i, path) for i in value)
+    return isinstance(value, str) and Path(value) == Path(path)
+
+
+def replace_path(value: Any, path: str, replacement: str) -> Any:
+    """
+    Copy job data with every reference to a file pointing to another file instead
+    :param value: The job data
+    :param path: The file
+    :param replacement: The file to point to
+    :return: The copied data
+    """
+    if isinstance(value, dict):
+        return {k: replace_path(v, path, replacement) for k, v in value.items()}
+    if isinstance(value, list):
+        return [replace_path(i, path, replacement) for i in value]
+    if isinstance(value, str) and Path(value) == Path(path):
+        return replacement
+    return copy.deepcopy(value)
+
+
+def module_class(task: str) -> Optional[type]:
+    module_info = modules.shared.registry.get(task)
+    return module_info.load() if module_info is not None else None
+
+
+def plan_handoff(tasks: List[dict], index: int) -> Optional[Handoff]:
+    """
+    Work out whether the output of a task can be handed to the next task without going through storage.  The next
+    task has to read the output, and no other task may use it except to delete it.  If the producer can write the
+    output to a pipe and the consumer can read it from one (neither needs to seek in it), both run at the same time
+    connected by a named pipe, unless CPU slots are enabled and both of them wait for one: the consumer could then
+    wait forever for the slot the producer holds while it's blocked on the pipe.  Otherwise the output is spooled in
+    `Config.HANDOFF_DIRECTORY` on the worker and removed once the consumer is done, so it never touches shared
+    storage.  `mkvmerge` seeks in its inputs (`streams_input` is False), so an encode handed to `mkvmerge` is always
+    spooled, never piped.
+    :param tasks: The tasks of the job, as `{name: data}`
+    :param index: The position of the producing task
+    :return: The handoff, or None if the output has to be written where the job says
+    """
+    if index + 1 >= len(tasks):
+        return None
+    (producer, producer_data), (consumer, consumer_data) = [next(iter(i.items())) for i in tasks[index:index + 2]]
+    producer_class, consumer_class = module_class(producer), module_class(consumer)
+    if producer_class is None or consumer_class is None or producer_class.output_key is None:
+        return None
+    if not isinstance(path := producer_data.get(producer_class.output_key), str):
+        return None
+    if not references(consumer_data, path):
+        return None
+    for position, task in enumerate(tasks):
+        if position in [index, index + 1]:
+            continue
+        name, data = next(iter(task.items()))
+        remaining = {k: v for k, v in data.items() if not (name == "cleanup" and k == "delete_files")}
+        if references(remaining, path):
+            return None
+    if not producer_class.streams_output(producer_data) or not consumer_class.streams_input(consumer_data, path):
+        return Handoff(index, index + 1, path, SPOOL)
+    if Config.CPU_SLOTS > 0 and producer_class.leases_cpus and consumer_class.leases_cpus:
+        return Handoff(index, index + 1, path, SPOOL)
+    return Handoff(index, index + 1, path, FIFO)
+
+
+class HandoffFile:
+    """
+    The local file (named pipe or spooled file) that replaces the output of a task during a handoff.  Used as a
+    context manager that creates the file in `Config.HANDOFF_DIRECTORY` and removes it afterwards.
+    """
+
+    def __init__(self, job_id: str, handoff: Handoff):
+        """
+        HandoffFile constructor
+        :param job_id: The ID of the job
+        :param handoff: The handoff
+        """
+        self.handoff = handoff
+        self.directory = Config.HANDOFF_DIRECTORY / f"{job_id}_{handoff.producer:02d}"
+        # The extension stays, since encoders pick the container by it
+        self.path = self.directory / Path(handoff.path).name
+
+    def rewrite(self, data: dict) -> dict:
+        """
+        Point the data of the producer or consumer at the local file
+        :param data: The data of the task
+        :return: The rewritten data
+        """
+        return replace_path(data, self.handoff.path, str(self.path))
+
+    def __enter__(self) -> "HandoffFile":
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.handoff.mode == FIFO:
+            os.mkfifo(self.path)
+        return self
+
+    def __exit__(self, *_) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,33 +1,115 @@
-import json
-import threading
-import time
-from urllib.parse import urljoin
-
-import redis
-import requests
-
-import modules.shared
-from config import Config
-
-
-def set_heartbeat():
-    while True:
-        try:
-            requests.post(
-                urljoin(Config.API_URL, f"/worker/status/{Config.HOST_UUID}"),
-                json=modules.shared.message,
-            )
-        except (
-            requests.exceptions.ConnectionError,
-            requests.exceptions.InvalidSchema,
-            requests.exceptions.MissingSchema,
-            requests.exceptions.InvalidURL,
-        ):
-            pass
-        time.sleep(5)
-
-
-def start_heartbeat():
-    x = threading.Thread(target=set_heartbeat)
-    x.daemon = True
-    x.start()
+import asyncio
+import json
+import logging
+from typing import Callable, List
+
+import modules.shared
+from config import Config
+from helpers import metrics
+from helpers.api import ApiClient, ApiError
+from helpers.status import generate_delta, wait_for_event
+
+logger = logging.getLogger(__name__)
+
+
+def update_status_message(status: str, **kwargs):
+    """
+    Set the state of the worker in the status message, along with its capabilities.
+    :param status: The status of the worker
+    :param kwargs: The job and task the status is about (`job_title`, `job_id`, `task`)
+    """
+    message = {
+        "status": status,
+        "hostname": Config.HOSTNAME,
+        "version": Config.VERSION,
+        "capabilities": modules.shared.capabilities,
+        "encoders": modules.shared.encoder_capabilities,
+        "capability_digest": modules.shared.capability_digest,
+    }
+    kwargs_filter = ["job_title", "job_id", "task"]
+    for k, v in kwargs.items():
+        if k in kwargs_filter:
+            message[k] = str(v)
+    modules.shared.status.set_state(message)
+
+
+class HeartbeatPublisher:
+    """
+    Publishes the worker status to the API over the keep-alive API session.  State transitions are sent as soon as
+    they happen, progress updates are coalesced to `Config.HEARTBEAT_PROGRESS_INTERVAL`, and only the keys that
+    changed since the last successful send are transmitted.  The full message is sent whenever the server needs to
+    resync (startup, connection failures, or the server not knowing the worker).
+
+    The server can ask the worker to cancel jobs by responding to a heartbeat with `{"cancel": [job_id, ...]}`.
+    """
+
+    def __init__(self, api: ApiClient, on_cancel: Callable[[List[str]], None] = None):
+        self.api = api
+        self.on_cancel = on_cancel
+        self.path = f"/worker/status/{Config.HOST_UUID}"
+        self.last_sent = None
+        self.last_send_time = 0.0
+        self.delta_supported = True
+
+    async def send(self, message: dict) -> None:
+        """
+        Send the status message to the API, either as a delta or the full message.
+        :param message: The current status message
+        """
+        self.last_send_time = asyncio.get_running_loop().time()
+        if self.last_sent is None or not self.delta_supported:
+            r = await self.api.post(self.path, json=message)
+        else:
+            r = await self.api.patch(self.path, json=generate_delta(self.last_sent, message))
+            if r.status in [405, 501]:
+                logger.info("API does not support status deltas, sending full status messages.")
+                self.delta_supported = False
+                r = await self.api.post(self.path, json=message)
+            elif r.status == 404:
+                r = await self.api.post(self.path, json=message)
+        if r.ok:
+            self.last_sent = message
+            self.process_response(r.text)
+        else:
+            self.last_sent = None
+
+    def process_response(self, text: str) -> None:
+        """
+        Pass any job cancellations in the heartbeat response along to the `on_cancel` callback.
+        :param text: The body of the heartbeat response
+        """
+        try:
+            data = json.loads(text)
+        except json.decoder.JSONDecodeError:
+            return
+        if self.on_cancel and type(data) is dict and data.get("cancel"):
+            self.on_cancel([str(i) for i in data["cancel"]])
+
+    async def flush(self) -> None:
+        """
+        Send any status changes that haven't gone out yet, used to register the worker with the server on startup
+        and when the worker shuts down.
+        """
+        try:
+            await self.send(modules.shared.status.take())
+        except ApiError:
+            pass
+
+    async def run(self) -> None:
+        status = modules.shared.status
+        loop = asyncio.get_running_loop()
+        while True:
+            keepalive = Config.HEARTBEAT_INTERVAL - (loop.time() - self.last_send_time)
+            # When nothing changes before the keepalive is due, an empty delta is sent so the server doesn't
+            # expire the worker.  Progress-only changes wait out the rest of the coalescing window unless a state
+            # transition shows up in the meantime.
+            if await wait_for_event(status.changed, keepalive) and not status.transition.is_set():
+                coalesce = Config.HEARTBEAT_PROGRESS_INTERVAL - (loop.time() - self.last_send_time)
+                await wait_for_event(status.transition, coalesce)
+            message = status.take()
+            start_time = loop.time()
+            try:
+                await self.send(message)
+                metrics.heartbeat_duration.observe(loop.time() - start_time)
+            except ApiError:
+                self.last_sent = None
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import IO, Optional, TextIO
+
+import modules.shared
+from config import Config
+from helpers.process import (
+    read_lines,
+    set_io_priority,
+    start_process,
+    terminate_process_group,
+)
+from helpers.report import TaskReport
+from helpers.resources import ProcessSampler
+from modules.base import publish_progress
+
+logger = logging.getLogger(__name__)
+
+TASK_RUNNER = Path(__file__).resolve().parents[1] / "task_runner.py"
+MEBIBYTE = 1024 * 1024
+
+
+class TaskChannel:
+    """
+    The task process end of the pipe to the worker.  Installed as `modules.shared.status` in the task process, so the
+    status changes and progress of the module are streamed to the worker as JSON lines instead of going into a
+    `WorkerStatus`.  Writes are locked since modules may report progress from executor threads.
+    """
+
+    def __init__(self, stream: TextIO):
+        """
+        TaskChannel constructor
+        :param stream: The pipe to the worker
+        """
+        self.stream = stream
+        self.__lock = threading.Lock()
+
+    def send(self, message_type: str, **kwargs) -> None:
+        line = json.dumps({"type": message_type, **kwargs})
+        with self.__lock:
+            self.stream.write(f"{line}\n")
+            self.stream.flush()
+
+    def set_state(self, message: dict) -> None:
+        self.send("state", message=message)
+
+    def update_progress(self, info: dict) -> None:
+        self.send("progress", info=info)
+
+
+def create_cgroup(name: str) -> Optional[Path]:
+    """
+    Create a cgroup for a task process under `Config.TASK_CGROUP`, which has to be a cgroup v2 directory delegated
+    to the worker with the `memory` and `cpu` controllers enabled for its children.
+    :param name: The name of the cgroup
+    :return: The cgroup directory, or None if cgroups aren't used or it couldn't be created
+    """
+    if Config.TASK_CGROUP is None:
+        return None
+    cgroup = Config.TASK_CGROUP / name
+    try:
+        cgroup.mkdir(exist_ok=True)
+        if Config.TASK_CGROUP_MEMORY_MAX:
+            (cgroup / "memory.max").write_text(Config.TASK_CGROUP_MEMORY_MAX)
+        if Config.TASK_CGROUP_CPU_MAX:
+            (cgroup / "cpu.max").write_text(Config.TASK_CGROUP_CPU_MAX)
+    except OSError as e:
+        logger.warning(f"Could not create the cgroup '{cgroup}': {str(e)}")
+        remove_cgroup(cgroup)
+        return None
+    return cgroup
+
+
+def remove_cgroup(cgroup: Optional[Path]) -> None:
+    if cgroup is None:
+        return
+    try:
+        cgroup.rmdir()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove the cgroup '{cgroup}': {str(e)}")
+
+
+def limit_process(pid: int, cgroup: Optional[Path]) -> None:
+    """
+    Apply the configured resource limits and priorities to a task process.  This happens before the task process
+    is sent its task, so everything it starts (like the encoders) inherits them.  The rlimits are per process: the
+    memory limit caps the address space and the CPU limit the CPU time of each process on its own.
+    :param pid: The task process
+    :param cgroup: The cgroup to move the task process into, if any
+    """
+    try:
+        if Config.TASK_MEMORY_LIMIT:
+            limit = Config.TASK_MEMORY_LIMIT * MEBIBYTE
+            resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+        if Config.TASK_CPU_LIMIT:
+            # SIGXCPU at the soft limit, SIGKILL at the hard limit if the process ignores it
+            limit = (Config.TASK_CPU_LIMIT, Config.TASK_CPU_LIMIT + Config.PROCESS_KILL_TIMEOUT)
+            resource.prlimit(pid, resource.RLIMIT_CPU, limit)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not limit the resources of the task process: {str(e)}")
+    try:
+        if Config.TASK_NICE:
+            os.setpriority(os.PRIO_PROCESS, pid, Config.TASK_NICE)
+        if Config.TASK_IONICE_CLASS:
+            set_io_priority(pid, Config.TASK_IONICE_CLASS, Config.TASK_IONICE_LEVEL)
+    except OSError as e:
+        logger.warning(f"Could not lower the priority of the task process: {str(e)}")
+    if cgroup is not None:
+        try:
+            (cgroup / "cgroup.procs").write_text(str(pid))
+        except OSError as e:
+            logger.warning(f"Could not move the task process into the cgroup '{cgroup}': {str(e)}")
+
+
+def send_spec(stdin: IO[bytes], spec: dict) -> None:
+    try:
+        with stdin:
+            stdin.write(json.dumps(spec).encode())
+    except ConnectionError:
+        # The task process died before reading its task, which gets reported by the caller
+        pass
+
+
+async def run_isolated_task(
+    report: TaskReport, job_id: str, job_title: str, task: str, data: dict, index: int, profile: bool = False
+) -> bool:
+    """
+    Run a task in a short-lived task process (`task_runner.py`) instead of the worker process, so whatever the
+    module leaks or hogs goes away with the process and the limits in `Config` can be applied to it.  Status changes
+    and progress are streamed back over the stdout of the task process; the logs of the task go to stderr as usual.
+    If the awaiting task is cancelled, the task process is terminated, which cancels the task and kills its
+    encoders in turn.
+    :param report: The report of the task, filled in with the profile, details, and IO of the task process
+    :param job_id: The ID of the job the task belongs to
+    :param job_title: The title of the job the task belongs to
+    :param task: The name of the task module
+    :param data: The data for the task module
+    :param index: The position of the task in the job
+    :param profile: Profile the module in the task process
+    :return: Whether the task completed
+    """
+    cgroup = create_cgroup(f"{job_id}_{index:02d}")
+    process = await start_process([sys.executable, TASK_RUNNER], stdin=subprocess.PIPE, stderr=None)
+    sampler = ProcessSampler(process.pid)
+    sampler_task = asyncio.create_task(sampler.run())
+    result = None
+    try:
+        limit_process(process.pid, cgroup)
+        spec = {
+            "job_id": job_id,
+            "job_title": job_title,
+            "task": task,
+            "data": data,
+            "index": index,
+            "profile": profile,
+            "capabilities": modules.shared.capabilities,
+            "encoder_capabilities": modules.shared.encoder_capabilities,
+        }
+        await asyncio.get_running_loop().run_in_executor(None, send_spec, process.popen.stdin, spec)
+        async for line in read_lines(process.stdout):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.warning(f" ! [{job_title} -> {task}] Unexpected output from the task process: {line}")
+                continue
+            if message["type"] == "progress":
+                publish_progress(task, message["info"])
+            elif message["type"] == "state":
+                modules.shared.status.set_state(message["message"])
+            elif message["type"] == "result":
+                result = message
+        sampler.sample()
+        return_code = await process.wait()
+    except asyncio.CancelledError:
+        await terminate_process_group(process)
+        raise
+    finally:
+        sampler_task.cancel()
+        sampler.commit(process.rusage)
+        remove_cgroup(cgroup)
+    if result is None:
+        logger.critical(
+            f" ! [{job_title} -> {task}] TASK FAILED: The task process exited with code {return_code} without "
+            f"finishing the task."
+        )
+        return False
+    # The IO of the encoders is already in the IO of the task process, which reaped them
+    report.usage.max_rss = max(report.usage.max_rss, result["usage"]["max_rss"])
+    report.profile = result["profile"]
+    report.details.update(result["details"])
+    return result["completed"]
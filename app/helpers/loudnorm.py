@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shlex
+from pathlib import Path
+from typing import Iterable, List
+
+from config import Config
+from helpers.cache import FileCache, file_key
+from helpers.process import run_process
+
+logger = logging.getLogger(__name__)
+
+# The ranges `ffmpeg` accepts for the targets of the `loudnorm` filter
+LOUDNORM_RANGES = {"I": (-70.0, -5.0), "TP": (-9.0, 0.0), "LRA": (1.0, 50.0)}
+MEASUREMENTS = ["input_i", "input_tp", "input_lra", "input_thresh", "target_offset"]
+
+loudnorm_cache = FileCache(name="loudnorm", path=Config.FFMPEG_LOUDNORM_CACHE_FILE)
+
+
+class LoudnormError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+def loudnorm_targets(settings) -> dict:
+    """
+    Get the targets of a `loudnorm` output setting, which is either `true` for the defaults or a dict overriding
+    some of them
+    :param settings: The setting of the output
+    :return: The integrated loudness (`I`), true peak (`TP`), and loudness range (`LRA`) targets
+    """
+    targets = dict(Config.FFMPEG_LOUDNORM_TARGETS)
+    if isinstance(settings, dict):
+        targets.update({k: float(v) for k, v in settings.items()})
+    return targets
+
+
+def validate_targets(settings) -> List[str]:
+    """
+    Check the `loudnorm` setting of an output
+    :param settings: The setting of the output
+    :return: List of problems, empty if the setting is valid
+    """
+    if settings is True:
+        return list()
+    if not isinstance(settings, dict):
+        return ["'loudnorm' must be true or a dict of targets"]
+    problems = list()
+    for k, v in settings.items():
+        if k not in LOUDNORM_RANGES:
+            problems.append(f"unknown target '{k}', expected one of {', '.join(LOUDNORM_RANGES)}")
+            continue
+        low, high = LOUDNORM_RANGES[k]
+        try:
+            if not low <= float(v) <= high:
+                problems.append(f"'{k}' must be between {low} and {high}")
+        except (TypeError, ValueError):
+            problems.append(f"'{k}' must be a number")
+    return problems
+
+
+def target_options(targets: dict) -> str:
+    return ":".join(f"{k}={v}" for k, v in targets.items())
+
+
+class LoudnessAnalysis:
+    """
+    The measurement pass of two-pass EBU R128 normalization with the `loudnorm` filter of `ffmpeg`.  Only the audio
+    stream is decoded, run through the filters of the output and measured, and the measurements are cached in
+    `Config.FFMPEG_LOUDNORM_CACHE_FILE` by the path, size, and modification time of the source, the stream, the
+    filters, and the targets, so encoding the same source again goes straight to the normalizing pass.
+    """
+
+    def __init__(self, ffmpeg_path: Path, source: Path, stream: int, targets: dict, filters: str = None):
+        """
+        LoudnessAnalysis constructor
+        :param ffmpeg_path: The `ffmpeg` binary
+        :param source: The source file
+        :param stream: The audio stream of the source
+        :param targets: The `loudnorm` targets
+        :param filters: Audio filters the output applies before normalizing, if any
+        """
+        self.ffmpeg_path = ffmpeg_path
+        self.source = source
+        self.stream = stream
+        self.targets = targets
+        self.filters = filters
+
+    def cache_key(self) -> str:
+        key = {
+            "source": file_key(self.source),
+            "stream": self.stream,
+            "targets": self.targets,
+            "filters": self.filters,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    async def run(self, cpus: Iterable[int] = None) -> dict:
+        """
+        Measure the stream, or get the measurements from the cache
+        :param cpus: Run the measurement on these CPUs, any CPU if not provided
+        :return: The measurements (`input_i`, `input_tp`, `input_lra`, `input_thresh`, `target_offset`), and whether
+        they were `cached`
+        """
+        loop = asyncio.get_running_loop()
+        cache_key = await loop.run_in_executor(None, self.cache_key)
+        if (measured := await loop.run_in_executor(None, loudnorm_cache.get, cache_key)) is not None:
+            return {**measured, "cached": True}
+        chain = [self.filters] if self.filters else []
+        chain.append(f"loudnorm={target_options(self.targets)}:print_format=json")
+        command = [
+            *[self.ffmpeg_path, "-hide_banner", "-nostats", "-i", self.source, "-map", f"0:a:{self.stream}"],
+            *["-af", ",".join(chain), "-f", "null", os.devnull],
+        ]
+        output = list()
+        if await run_process(command, output.append, cpus=cpus) != 0:
+            raise LoudnormError(f"`ffmpeg` failed: {shlex.join(str(i) for i in command)}: {output[-5:]}")
+        measured = self.parse_measurements(output)
+        await loop.run_in_executor(None, loudnorm_cache.set, cache_key, measured)
+        return {**measured, "cached": False}
+
+    @staticmethod
+    def parse_measurements(lines: List[str]) -> dict:
+        """
+        Parse the JSON block `loudnorm` prints at the end of the measurement pass.  Only the lines from the last
+        `{` to the `}` after it are parsed, since `ffmpeg` may print more (like its final stats) after the block.
+        :param lines: The output of `ffmpeg`
+        :return: The measurements
+        """
+        try:
+            start = max(i for i, line in enumerate(lines) if line.strip() == "{")
+            end = next(i for i in range(start, len(lines)) if lines[i].strip() == "}")
+            values = json.loads("\n".join(lines[start:end + 1]))
+            return {k: float(values[k]) for k in MEASUREMENTS}
+        except (ValueError, KeyError, StopIteration):
+            raise LoudnormError("`ffmpeg` did not report the loudness measurements")
+
+    def normalize_filter(self, measured: dict) -> str:
+        """
+        Build the `loudnorm` filter of the normalizing pass from the measurements
+        :param measured: The measurements
+        :return: The filter
+        """
+        return (
+            f"loudnorm={target_options(self.targets)}:measured_I={measured['input_i']}:"
+            f"measured_TP={measured['input_tp']}:measured_LRA={measured['input_lra']}:"
+            f"measured_thresh={measured['input_thresh']}:offset={measured['target_offset']}:linear=true"
+        )
@@ -0,0 +1,188 @@
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+TASK_DURATION_BUCKETS = [1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 28800]
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    labels = [f'{k}="{str(v)}"' for k, v in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(labels) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if type(value) is float else str(value)
+
+
+class Metric:
+    """
+    Base class for the metrics exposed in the Prometheus text format.  Every metric is thread-safe since modules
+    running in executor threads update them too.
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: List[str] = None):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels) if labels else tuple()
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], object] = dict()
+
+    def key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[i]) for i in self.label_names)
+
+    def render_samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.label_names, k)} {format_value(v)}" for k, v in self.values.items()]
+
+    def render(self) -> List[str]:
+        with self.lock:
+            samples = self.render_samples()
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.metric_type}",
+            *samples,
+        ]
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, description: str, labels: List[str] = None, buckets: List[float] = None):
+        super().__init__(name, description, labels)
+        self.buckets = (buckets if buckets else DEFAULT_BUCKETS) + [float("inf")]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = entry = self.values[key]
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render_samples(self) -> List[str]:
+        samples = list()
+        for key, (counts, total, count) in self.values.items():
+            for bucket, bucket_count in zip(self.buckets, counts):
+                labels = format_labels(self.label_names, key, f'le="{format_value(bucket)}"')
+                samples.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = format_labels(self.label_names, key)
+            samples.append(f"{self.name}_sum{labels} {format_value(total)}")
+            samples.append(f"{self.name}_count{labels} {count}")
+        return samples
+
+
+jobs = Counter("sisyphus_jobs_total", "Jobs processed by outcome.", ["outcome"])
+tasks = Counter("sisyphus_tasks_total", "Tasks processed by module and outcome.", ["module", "outcome"])
+task_duration = Histogram(
+    "sisyphus_task_duration_seconds",
+    "Wall time of tasks by module.",
+    ["module"],
+    buckets=TASK_DURATION_BUCKETS,
+)
+encoder_fps = Gauge("sisyphus_encoder_fps", "Current frames per second of the running encoder.", ["module"])
+encoder_speed = Gauge("sisyphus_encoder_speed", "Current speed of the running encoder relative to realtime.", ["module"])
+poll_duration = Histogram("sisyphus_poll_duration_seconds", "Latency of polling the API for a job.")
+api_errors = Counter("sisyphus_api_errors_total", "Failed requests to the API by endpoint.", ["endpoint"])
+heartbeat_duration = Histogram("sisyphus_heartbeat_duration_seconds", "Latency of sending a heartbeat.")
+cache_requests = Counter("sisyphus_cache_requests_total", "Cache lookups by cache and result.", ["cache", "result"])
+
+registry: List[Metric] = [
+    jobs,
+    tasks,
+    task_duration,
+    encoder_fps,
+    encoder_speed,
+    poll_duration,
+    api_errors,
+    heartbeat_duration,
+    cache_requests,
+]
+
+
+def record_job(report) -> None:
+    """
+    Record the outcome of a finished job and its tasks
+    :param report: The JobReport of the finished job
+    """
+    jobs.inc(outcome=report.outcome)
+    for task in report.tasks:
+        tasks.inc(module=task.task, outcome=task.outcome)
+        task_duration.observe(task.wall_time, module=task.task)
+
+
+def reset_encoder(module: str) -> None:
+    """
+    Reset the encoder gauges of a module once its task is done
+    :param module: The name of the module
+    """
+    encoder_fps.set(0, module=module)
+    encoder_speed.set(0, module=module)
+
+
+def render() -> str:
+    """
+    Render every metric in the registry in the Prometheus text format
+    :return: The metrics page
+    """
+    lines = list()
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server():
+    """
+    Start the metrics endpoint on `Config.METRICS_HOST`:`Config.METRICS_PORT` if a port is configured.
+    :return: The runner of the metrics server, or None if it's disabled
+    """
+    if not Config.METRICS_PORT:
+        return None
+    from aiohttp import web
+
+    async def metrics_handler(_request):
+        return web.Response(
+            body=render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, Config.METRICS_HOST, Config.METRICS_PORT).start()
+    logger.info(f"Metrics endpoint listening on {Config.METRICS_HOST}:{Config.METRICS_PORT}/metrics")
+    return runner
@@ -0,0 +1,231 @@
+import asyncio
+import ctypes
+import ctypes.util
+import functools
+import os
+import platform
+import re
+import resource
+import signal
+import subprocess
+import sys
+import threading
+from typing import AsyncIterator, Callable, Iterable, List, Optional
+
+from config import Config
+from helpers.resources import ProcessSampler, task_usage
+
+LINE_SEPARATOR = re.compile(rb"[\r\n]+")
+READ_SIZE = 65536
+PR_SET_PDEATHSIG = 1
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# There's no wrapper for ioprio_set in libc, so it has to be called by its syscall number
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314, "ppc64le": 273, "s390x": 282}
+
+if sys.platform.startswith("linux"):
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+else:
+    libc = None
+
+
+def set_parent_death_signal() -> None:
+    """
+    Runs in the child between fork and exec: have the kernel kill the child if the worker dies without getting the
+    chance to clean up (e.g. SIGKILL or an OOM kill).
+    """
+    if libc is not None:
+        libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+
+
+def prepare_child(cpus: Iterable[int] = None) -> None:
+    """
+    Runs in the child between fork and exec: set the parent death signal and pin the child to its CPUs before it
+    starts any threads.
+    :param cpus: The CPUs the child may run on, any CPU if not provided
+    """
+    set_parent_death_signal()
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+
+def set_io_priority(pid: int, io_class: int, level: int) -> None:
+    """
+    Set the IO scheduling class and priority of a process, like `ionice -c <class> -n <level> -p <pid>`.  Processes
+    started by the process afterwards inherit it.
+    :param pid: The process
+    :param io_class: 1 for realtime, 2 for best-effort, 3 for idle
+    :param level: The priority within the class, from 0 (highest) to 7 (lowest)
+    """
+    if libc is None or (syscall := IOPRIO_SET_SYSCALLS.get(platform.machine())) is None:
+        raise OSError(f"Setting the IO priority is not supported on {platform.system()} {platform.machine()}")
+    if libc.syscall(syscall, IOPRIO_WHO_PROCESS, pid, io_class << IOPRIO_CLASS_SHIFT | level) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+class ChildProcess:
+    """
+    A process started by `start_process`.  The worker reaps it itself with `wait4` instead of leaving that to the
+    child watcher of asyncio, which gives the `rusage` of the process (including everything it waited for), so its
+    CPU time and peak memory can go to the task that started it even when tasks run at the same time.
+    """
+
+    def __init__(self, popen: subprocess.Popen, stdout: Optional[asyncio.StreamReader]):
+        """
+        ChildProcess constructor
+        :param popen: The started process
+        :param stdout: Reader for the stdout of the process, if it's a pipe
+        """
+        self.popen = popen
+        self.pid = popen.pid
+        self.stdout = stdout
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[resource.struct_rusage] = None
+        loop = asyncio.get_running_loop()
+        self.__exited = loop.create_future()
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            # Without pidfds (before Linux 5.3) a thread waits for the process, like the threaded child watcher
+            threading.Thread(target=self.__wait_thread, args=(loop,), daemon=True).start()
+        else:
+            loop.add_reader(pidfd, self.__pidfd_ready, loop, pidfd)
+
+    def __pidfd_ready(self, loop: asyncio.AbstractEventLoop, pidfd: int) -> None:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+        self.__reaped(*os.wait4(self.pid, 0))
+
+    def __wait_thread(self, loop: asyncio.AbstractEventLoop) -> None:
+        result = os.wait4(self.pid, 0)
+        try:
+            loop.call_soon_threadsafe(self.__reaped, *result)
+        except RuntimeError:
+            # The event loop is gone, nobody is waiting for the process anymore
+            pass
+
+    def __reaped(self, _: int, status: int, rusage: resource.struct_rusage) -> None:
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.rusage = rusage
+        # Popen would otherwise try to reap the process again when it's garbage collected
+        self.popen.returncode = self.returncode
+        if not self.__exited.done():
+            self.__exited.set_result(self.returncode)
+
+    async def wait(self) -> int:
+        """
+        Wait for the process to exit
+        :return: The return code of the process, negative if it was killed by a signal
+        """
+        return await asyncio.shield(self.__exited)
+
+
+async def start_process(
+    command: List[str],
+    stdin: Optional[int] = subprocess.DEVNULL,
+    stderr: Optional[int] = subprocess.STDOUT,
+    preexec_fn: Callable[[], None] = set_parent_death_signal,
+) -> ChildProcess:
+    """
+    Start a process in its own session with its stdout connected to a stream reader
+    :param command: The command and its arguments
+    :param stdin: The stdin of the process, as for `subprocess.Popen`
+    :param stderr: The stderr of the process, as for `subprocess.Popen` (merged into stdout by default)
+    :param preexec_fn: Called in the child between fork and exec
+    :return: The process
+    """
+    loop = asyncio.get_running_loop()
+    popen = subprocess.Popen(
+        [str(i) for i in command],
+        stdin=stdin,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        start_new_session=True,
+        preexec_fn=preexec_fn,
+    )
+    stdout = asyncio.StreamReader(limit=READ_SIZE)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdout), popen.stdout)
+    return ChildProcess(popen, stdout)
+
+
+async def terminate_process_group(process: ChildProcess) -> None:
+    """
+    Terminate a process and everything it spawned.  The process group gets a SIGTERM and is killed outright if it
+    hasn't exited after `Config.PROCESS_KILL_TIMEOUT` seconds.
+    :param process: A process started in its own session by `run_process`
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), timeout=Config.PROCESS_KILL_TIMEOUT)
+    except (ProcessLookupError, asyncio.TimeoutError):
+        pass
+    finally:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        if process.returncode is None:
+            await process.wait()
+
+
+async def read_lines(stream: asyncio.StreamReader) -> AsyncIterator[str]:
+    """
+    Read lines from a process stream as they come in.  Both carriage returns and newlines end a line since encoders
+    like to redraw their status line with a bare carriage return.
+    :param stream: The stream to read from
+    :return: Async iterator of decoded lines
+    """
+    buffer = b""
+    while chunk := await stream.read(READ_SIZE):
+        lines = LINE_SEPARATOR.split(buffer + chunk)
+        buffer = lines.pop()
+        for line in lines:
+            if line:
+                yield line.decode(errors="replace")
+    if buffer:
+        yield buffer.decode(errors="replace")
+
+
+async def run_process(
+    command: List[str],
+    line_callback: Callable[[str], None] = None,
+    cpus: Iterable[int] = None,
+    started_callback: Callable[[int], None] = None,
+) -> int:
+    """
+    Run a command, merging stderr into stdout and passing each line of output to the callback.  If the awaiting task
+    is cancelled, or the callback raises, the process (and its whole process group) gets killed before the
+    cancellation or the exception is passed on.  When
+    the resource usage of the current task is being tracked, the CPU time, peak memory, and IO of the process are
+    added to it.
+    :param command: The command and its arguments
+    :param line_callback: Called with every line of output from the process
+    :param cpus: Pin the process (and everything it starts) to these CPUs
+    :param started_callback: Called with the PID of the process once it has started
+    :return: The return code of the process
+    """
+    process = await start_process(
+        command, preexec_fn=functools.partial(prepare_child, list(cpus) if cpus else None)
+    )
+    sampler = None
+    if task_usage.get() is not None:
+        sampler = ProcessSampler(process.pid)
+        sampler_task = asyncio.create_task(sampler.run())
+    try:
+        if started_callback:
+            started_callback(process.pid)
+        async for line in read_lines(process.stdout):
+            if line_callback:
+                line_callback(line)
+        if sampler:
+            sampler.sample()
+        return await process.wait()
+    except BaseException:
+        # Nothing reads the output anymore, so the process would block on a full pipe (holding its CPU slot)
+        await terminate_process_group(process)
+        raise
+    finally:
+        if sampler:
+            sampler_task.cancel()
+            sampler.commit(process.rusage)
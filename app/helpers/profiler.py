@@ -0,0 +1,115 @@
+import cProfile
+import functools
+import inspect
+import logging
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TaskProfiler:
+    """
+    Profiles the module methods of a single task with `cProfile`.  Every wrapped call gets its own profile in the
+    thread it runs on (the event loop for coroutines, an executor thread otherwise), and the profiles are merged once
+    the task is done.  Since coroutines are profiled on the event loop, anything else running on the loop while they
+    wait (like the heartbeat) shows up in the profile too.
+    """
+
+    def __init__(self, job_id: str, task: str, index: int):
+        """
+        TaskProfiler constructor
+        :param job_id: The ID of the job the task belongs to
+        :param task: The name of the task module
+        :param index: The position of the task in the job
+        """
+        self.file = Config.PROFILING_DIRECTORY / job_id / f"{index:02d}_{task}.prof"
+        self.profiles: List[cProfile.Profile] = list()
+
+    def wrap(self, method: Callable) -> Callable:
+        """
+        Wrap a module method (or constructor) so that its calls get profiled
+        :param method: The method to profile
+        :return: The profiled method, a coroutine function if the method is one
+        """
+        if inspect.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def profiled_coroutine(*args, **kwargs):
+                profile = self.start()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    if profile:
+                        profile.disable()
+
+            return profiled_coroutine
+
+        @functools.wraps(method)
+        def profiled(*args, **kwargs):
+            profile = self.start()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if profile:
+                    profile.disable()
+
+        return profiled
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """
+        Start a new profile in the current thread.  Profiling is skipped if another profiler is already active.
+        :return: The running profile, or None if it couldn't be started
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            logger.warning(f"Could not start profiling: {str(e)}")
+            return None
+        self.profiles.append(profile)
+        return profile
+
+    def stats(self) -> Optional["pstats.Stats"]:
+        import pstats
+
+        profiles = [i for i in self.profiles if i.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def finish(self) -> Optional[dict]:
+        """
+        Merge the profiles of the task, write them to `Config.PROFILING_DIRECTORY`, and summarize the functions that
+        took the most time (not counting the functions they called).
+        :return: The summary for the job report, or None if nothing was profiled
+        """
+        if (stats := self.stats()) is None:
+            return None
+        summary = {
+            "file": None,
+            "total_time": round(stats.total_tt, 6),
+            "top_functions": [
+                {
+                    "function": f"{Path(file).name}:{line}({name})" if line else name,
+                    "calls": calls,
+                    "total_time": round(total_time, 6),
+                    "cumulative_time": round(cumulative_time, 6),
+                }
+                for (file, line, name), (_, calls, total_time, cumulative_time, _) in sorted(
+                    stats.stats.items(), key=lambda i: i[1][2], reverse=True
+                )[: Config.PROFILING_TOP_FUNCTIONS]
+            ],
+        }
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(self.file)
+            summary["file"] = str(self.file)
+        except OSError as e:
+            logger.warning(f"Could not write the profile to '{self.file}': {str(e)}")
+        return summary
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shlex
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+from config import Config
+from helpers.cache import FileCache, file_fingerprint
+from helpers.ffmpeg import SourceOutput
+from helpers.process import run_process
+
+logger = logging.getLogger(__name__)
+
+METRICS = {
+    "ssim": re.compile(r"SSIM .*All:(\d+(?:\.\d+)?)"),
+    "psnr": re.compile(r"PSNR .*average:(\d+(?:\.\d+)?|inf)"),
+}
+FILTER_OPTIONS = ["vf", "filter"]
+
+quality_cache = FileCache(name="quality", path=Config.FFMPEG_QUALITY_CACHE_FILE)
+
+
+class QualitySearchError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(self.message)
+
+
+def plain_options(options: dict) -> dict:
+    # `SourceOutput` only renders plain dicts as `key=value:key=value`, so Box values are turned back into dicts
+    return {k: dict(v) if isinstance(v, dict) else v for k, v in options.items()}
+
+
+class QualitySearch:
+    """
+    Finds the cheapest CRF for a video output that still meets a quality target.  A few short samples spread over
+    the source are extracted once (losslessly, with the filters of the output applied), encoded with the options of
+    the output at every candidate CRF in parallel, and scored against the extracted samples with the `ssim` or
+    `psnr` filter of `ffmpeg`.  Of the CRFs whose worst sample meets the target, the one with the smallest samples
+    wins.
+
+    Results are cached in `Config.FFMPEG_QUALITY_CACHE_FILE` by the fingerprint of the source, the output options,
+    and the search settings, so the same source and profile only get searched once.
+    """
+
+    def __init__(
+        self,
+        ffmpeg_path: Path,
+        source: Path,
+        stream: int,
+        options: dict,
+        settings: dict,
+        duration: Optional[float] = None,
+    ):
+        """
+        QualitySearch constructor
+        :param ffmpeg_path: The `ffmpeg` binary
+        :param source: The source file
+        :param stream: The video stream of the source to encode
+        :param options: The options of the video output, without the CRF being searched for
+        :param settings: The search settings (`target`, `metric`, `crf`, `samples`, `sample_duration`)
+        :param duration: The duration of the source in seconds, if known
+        """
+        self.ffmpeg_path = ffmpeg_path
+        self.source = source
+        self.stream = stream
+        self.options = plain_options({k: v for k, v in options.items() if k != "crf"})
+        self.target = float(settings["target"])
+        self.metric = settings.get("metric", "ssim")
+        self.crf_values = sorted(settings.get("crf", Config.FFMPEG_QUALITY_CRF_VALUES))
+        self.samples = int(settings.get("samples", Config.FFMPEG_QUALITY_SAMPLES))
+        self.sample_duration = float(settings.get("sample_duration", Config.FFMPEG_QUALITY_SAMPLE_DURATION))
+        self.duration = duration
+
+    @staticmethod
+    def validate_settings(settings: dict) -> List[str]:
+        """
+        Check the search settings of a job
+        :param settings: The search settings
+        :return: List of problems, empty if the settings are valid
+        """
+        problems = list()
+        try:
+            float(settings["target"])
+        except (KeyError, TypeError, ValueError):
+            problems.append("'target' must be a number")
+        if settings.get("metric", "ssim") not in METRICS:
+            problems.append(f"'metric' must be one of {', '.join(METRICS)}")
+        crf_values = settings.get("crf", Config.FFMPEG_QUALITY_CRF_VALUES)
+        if not crf_values or not all(isinstance(i, (int, float)) for i in crf_values):
+            problems.append("'crf' must be a list of numbers")
+        return problems
+
+    def cache_key(self) -> str:
+        key = {
+            "source": file_fingerprint(self.source),
+            "stream": self.stream,
+            "options": self.options,
+            "target": self.target,
+            "metric": self.metric,
+            "crf": self.crf_values,
+            "samples": self.samples,
+            "sample_duration": self.sample_duration,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def sample_starts(self) -> List[float]:
+        """
+        Spread the samples evenly over the source, each in the middle of its share of the source
+        :return: The start of every sample in seconds
+        """
+        if not self.duration or self.duration <= self.sample_duration:
+            return [0.0]
+        share = self.duration / self.samples
+        return [max(0.0, share * (i + 0.5) - self.sample_duration / 2) for i in range(self.samples)]
+
+    async def run(self, cpus: Iterable[int] = None, progress: Callable[[int, int], None] = None) -> dict:
+        """
+        Run the search, or get its result from the cache
+        :param cpus: Run the encodes on these CPUs, any CPU if not provided
+        :param progress: Called with the number of finished and total encodes
+        :return: The chosen `crf`, along with the worst `scores` and total `sizes` of the samples at every CRF
+        """
+        loop = asyncio.get_running_loop()
+        cache_key = await loop.run_in_executor(None, self.cache_key)
+        if (result := await loop.run_in_executor(None, quality_cache.get, cache_key)) is not None:
+            return {**result, "cached": True}
+        directory = Path(tempfile.mkdtemp(prefix="sisyphus-quality-"))
+        try:
+            samples = await asyncio.gather(
+                *[self.extract_sample(directory, i, start, cpus) for i, start in enumerate(self.sample_starts())]
+            )
+            cpus = list(cpus) if cpus else sorted(os.sched_getaffinity(0))
+            threads = max(1, len(cpus) // Config.FFMPEG_QUALITY_PARALLEL)
+            semaphore = asyncio.Semaphore(Config.FFMPEG_QUALITY_PARALLEL)
+            jobs = [(sample, crf) for crf in self.crf_values for sample in samples]
+            finished = 0
+
+            async def encode(sample: Path, crf: float) -> tuple:
+                nonlocal finished
+                async with semaphore:
+                    score_and_size = await self.encode_sample(sample, crf, threads, cpus)
+                finished += 1
+                if progress:
+                    progress(finished, len(jobs))
+                return crf, score_and_size
+
+            scores, sizes = dict(), dict()
+            for crf, (score, size) in await asyncio.gather(*[encode(sample, crf) for sample, crf in jobs]):
+                scores[crf] = min(score, scores.get(crf, score))
+                sizes[crf] = sizes.get(crf, 0) + size
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        passing = [crf for crf in self.crf_values if scores[crf] >= self.target]
+        if passing:
+            crf = min(passing, key=lambda i: (sizes[i], -i))
+        else:
+            crf = self.crf_values[0]
+            logger.warning(
+                f"No CRF met the {self.metric} target of {self.target} (best: {scores[crf]}), using CRF {crf}."
+            )
+        result = {
+            "crf": crf,
+            "metric": self.metric,
+            "target": self.target,
+            "scores": {str(k): v for k, v in scores.items()},
+            "sizes": {str(k): v for k, v in sizes.items()},
+        }
+        await loop.run_in_executor(None, quality_cache.set, cache_key, result)
+        return {**result, "cached": False}
+
+    async def ffmpeg(self, arguments: list, cpus: Iterable[int] = None) -> List[str]:
+        output = list()
+        command = [self.ffmpeg_path, "-hide_banner", "-nostats", "-y", *arguments]
+        if await run_process(command, output.append, cpus=cpus) != 0:
+            raise QualitySearchError(f"`ffmpeg` failed: {shlex.join(str(i) for i in command)}: {output[-5:]}")
+        return output
+
+    async def extract_sample(self, directory: Path, index: int, start: float, cpus: Iterable[int] = None) -> Path:
+        sample = directory / f"sample_{index}.mkv"
+        filters = [arg for k, v in self.options.items() if k in FILTER_OPTIONS for arg in ["-vf", str(v)]]
+        await self.ffmpeg(
+            [
+                *["-ss", f"{start:.3f}", "-i", self.source, "-t", f"{self.sample_duration:.3f}"],
+                *["-map", f"0:v:{self.stream}", *filters, "-c:v", "ffv1", sample],
+            ],
+            cpus,
+        )
+        return sample
+
+    async def encode_sample(self, sample: Path, crf: float, threads: int, cpus: Iterable[int] = None) -> tuple:
+        """
+        Encode a sample at a CRF and score it against the sample
+        :return: The score and the size of the encoded sample in bytes
+        """
+        encoded = sample.with_name(f"{sample.stem}_crf{crf}.mkv")
+        options = {k: v for k, v in self.options.items() if k not in FILTER_OPTIONS}
+        output = SourceOutput(stream_type="v", stream=0, options={**options, "crf": crf})
+        output.limit_threads(threads)
+        await self.ffmpeg(["-i", sample, "-map", "0:v:0", *shlex.split(output.cli_options), encoded], cpus)
+        lines = await self.ffmpeg(
+            ["-i", encoded, "-i", sample, "-lavfi", f"[0:v][1:v]{self.metric}", "-f", "null", os.devnull], cpus
+        )
+        scores = [m.group(1) for i in lines if (m := METRICS[self.metric].search(i))]
+        if not scores:
+            raise QualitySearchError(f"`ffmpeg` did not report a {self.metric} score for '{encoded.name}'")
+        return float(scores[-1]), encoded.stat().st_size
+
@@ -0,0 +1,103 @@
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from config import Config
+from helpers.resources import ResourceUsage
+
+
+class TaskReport:
+    """
+    The outcome, wall time, and resource usage of a single task in a job.
+    """
+
+    task: str
+    outcome: str
+    wall_time: float
+    usage: ResourceUsage
+    profile: dict
+    details: dict
+
+    def __init__(self, task: str):
+        self.task = task
+        self.outcome = "running"
+        self.wall_time = 0.0
+        self.usage = ResourceUsage()
+        self.profile = None
+        self.details = dict()
+        self.__start = time.monotonic()
+
+    def finish(self, outcome: str) -> None:
+        """
+        Record the outcome of the task along with how long it ran
+        :param outcome: One of 'completed', 'failed', or 'cancelled'
+        """
+        self.outcome = outcome
+        self.wall_time = time.monotonic() - self.__start
+
+    def to_dict(self) -> dict:
+        report = {
+            "task": self.task,
+            "outcome": self.outcome,
+            "wall_time": round(self.wall_time, 3),
+            "usage": self.usage.to_dict(),
+        }
+        if self.profile is not None:
+            report["profile"] = self.profile
+        if self.details:
+            report["details"] = self.details
+        return report
+
+
+class JobReport:
+    """
+    The result of a job that gets posted to the API once the job is done.
+    """
+
+    job_id: str
+    job_title: str
+    outcome: str
+    tasks: List[TaskReport]
+
+    def __init__(self, job_id: str, job_title: str):
+        self.job_id = job_id
+        self.job_title = job_title
+        self.outcome = "running"
+        self.tasks = list()
+        self.started_at = datetime.now(timezone.utc)
+        self.wall_time = 0.0
+        self.__start = time.monotonic()
+
+    def add_task(self, task: str) -> TaskReport:
+        """
+        Start the report for the next task of the job
+        :param task: The name of the task module
+        :return: The report of the task
+        """
+        report = TaskReport(task=task)
+        self.tasks.append(report)
+        return report
+
+    def finish(self, outcome: str) -> None:
+        """
+        Record the outcome of the job along with how long it ran.  Any task still running shares the outcome.
+        :param outcome: One of 'completed', 'failed', 'cancelled', or 'interrupted'
+        """
+        self.outcome = outcome
+        self.wall_time = time.monotonic() - self.__start
+        for task in self.tasks:
+            if task.outcome == "running":
+                task.finish(outcome)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "job_title": self.job_title,
+            "worker_id": Config.HOST_UUID,
+            "hostname": Config.HOSTNAME,
+            "version": Config.VERSION,
+            "outcome": self.outcome,
+            "started_at": self.started_at.isoformat(),
+            "wall_time": round(self.wall_time, 3),
+            "tasks": [i.to_dict() for i in self.tasks],
+        }
@@ -0,0 +1,142 @@
+import asyncio
+import resource
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+
+
+class ResourceUsage:
+    """
+    Resources consumed by the external processes of a task.  CPU times are in seconds, memory in kilobytes, and IO
+    in bytes.  `read_bytes`/`write_bytes` are what actually hit the storage layer while `read_chars`/`write_chars`
+    count everything passed through read/write calls (which includes network filesystems).
+    """
+
+    user_time: float
+    system_time: float
+    max_rss: int
+    read_bytes: int
+    write_bytes: int
+    read_chars: int
+    write_chars: int
+
+    def __init__(self):
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.max_rss = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.read_chars = 0
+        self.write_chars = 0
+
+    def add_io(self, io: dict) -> None:
+        """
+        Add the final IO counters of a process
+        :param io: The counters from `/proc/<pid>/io`
+        """
+        self.read_bytes += io.get("read_bytes", 0)
+        self.write_bytes += io.get("write_bytes", 0)
+        self.read_chars += io.get("rchar", 0)
+        self.write_chars += io.get("wchar", 0)
+
+    def add_rusage(self, rusage: resource.struct_rusage) -> None:
+        """
+        Add the CPU time and peak memory of a reaped process
+        :param rusage: The `rusage` of the process from `wait4`, which includes everything it waited for
+        """
+        self.user_time += rusage.ru_utime
+        self.system_time += rusage.ru_stime
+        self.max_rss = max(self.max_rss, rusage.ru_maxrss)
+
+    def to_dict(self) -> dict:
+        return {
+            "user_time": round(self.user_time, 3),
+            "system_time": round(self.system_time, 3),
+            "max_rss": self.max_rss,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+            "read_chars": self.read_chars,
+            "write_chars": self.write_chars,
+        }
+
+
+task_usage: ContextVar[Optional[ResourceUsage]] = ContextVar("task_usage", default=None)
+"""The resource usage of the task currently running in this context, if it's being tracked."""
+
+
+class TaskUsageTracker:
+    """
+    Tracks the resources used by the external processes of a task.  CPU time and peak memory come from the `rusage`
+    of every process `run_process` starts (and reaps) for the task, while the IO counters are sampled from `/proc`
+    (the kernel drops them once the process is reaped).  Since the usage is collected per process, tasks running at
+    the same time each only get their own processes.
+
+    Used as a context manager around the task, the usage is then available in `usage`.
+    """
+
+    def __init__(self, usage: ResourceUsage = None):
+        """
+        TaskUsageTracker constructor
+        :param usage: The usage to fill in, a new one is created if not provided
+        """
+        self.usage = usage if usage is not None else ResourceUsage()
+        self.__token = None
+
+    def __enter__(self) -> "TaskUsageTracker":
+        self.__token = task_usage.set(self.usage)
+        return self
+
+    def __exit__(self, *_) -> None:
+        task_usage.reset(self.__token)
+
+
+def read_process_io(pid: int) -> dict:
+    """
+    Read the IO counters of a process
+    :param pid: The process
+    :return: The counters from `/proc/<pid>/io` (e.g. `rchar`, `read_bytes`), empty if they can't be read
+    """
+    io = dict()
+    try:
+        for line in Path(f"/proc/{pid}/io").read_text().splitlines():
+            key, value = line.split(":")
+            io[key] = int(value)
+    except (OSError, ValueError):
+        return dict()
+    return io
+
+
+class ProcessSampler:
+    """
+    Samples the IO counters of a running process from `/proc/<pid>/io` and adds them, along with the `rusage` of the
+    process, to the usage of the current task once the process is done.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.io = dict()
+
+    def sample(self) -> None:
+        if io := read_process_io(self.pid):
+            self.io = io
+
+    async def run(self) -> None:
+        """
+        Sample the process until cancelled
+        """
+        while True:
+            self.sample()
+            await asyncio.sleep(Config.RESOURCE_SAMPLE_INTERVAL)
+
+    def commit(self, rusage: Optional[resource.struct_rusage]) -> None:
+        """
+        Add the last sampled values to the usage of the current task
+        :param rusage: The `rusage` of the process, None if it couldn't be reaped
+        """
+        if (usage := task_usage.get()) is None:
+            return
+        if rusage is not None:
+            usage.add_rusage(rusage)
+        usage.add_io(self.io)
@@ -0,0 +1,110 @@
+import asyncio
+import copy
+import threading
+
+
+class WorkerStatus:
+    """
+    Thread-safe holder for the worker status message.  Writers (the main loop and the modules, which may be running
+    in executor threads) update the state through `set_state` and `update_progress`, and the heartbeat publisher
+    reads consistent snapshots from it without ever seeing a half-built message.
+    """
+
+    changed: asyncio.Event
+    transition: asyncio.Event
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__state = dict()
+        self.__loop = None
+        self.changed = None
+        self.transition = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Bind the change notifications to the event loop the heartbeat publisher runs on.
+        :param loop: The running event loop
+        """
+        self.__loop = loop
+        self.changed = asyncio.Event()
+        self.transition = asyncio.Event()
+        if self.__state:
+            self.changed.set()
+            self.transition.set()
+
+    def __notify(self, *events: asyncio.Event) -> None:
+        if self.__loop is None:
+            return
+        for event in events:
+            self.__loop.call_soon_threadsafe(event.set)
+
+    def set_state(self, message: dict) -> None:
+        """
+        Replace the status message on a state transition (job accepted, task change, failure).  Transitions are
+        flagged so the heartbeat publisher sends them immediately.
+        :param message: The new status message
+        """
+        with self.__lock:
+            if message == self.__state:
+                return
+            self.__state = copy.deepcopy(message)
+        self.__notify(self.transition, self.changed)
+
+    def update_progress(self, info: dict) -> None:
+        """
+        Update the progress data of the current task.  Progress isn't urgent and gets coalesced by the heartbeat
+        publisher.
+        :param info: The progress information
+        """
+        with self.__lock:
+            self.__state["data"] = copy.deepcopy(info)
+        self.__notify(self.changed)
+
+    def snapshot(self) -> dict:
+        """
+        Return a copy of the current status message
+        :return: The current status message
+        """
+        with self.__lock:
+            return copy.deepcopy(self.__state)
+
+    def take(self) -> dict:
+        """
+        Return a snapshot of the current status message and clear the pending change flags.  Must be called from
+        the event loop the status is bound to.
+        :return: The current status message
+        """
+        with self.__lock:
+            self.changed.clear()
+            self.transition.clear()
+            return copy.deepcopy(self.__state)
+
+
+def generate_delta(previous: dict, current: dict) -> dict:
+    """
+    Generate the changes between two status messages.  Keys that were removed are sent with a `None` value.
+    :param previous: The status message the server already has
+    :param current: The current status message
+    :return: Dictionary of changed keys
+    """
+    delta = {k: v for k, v in current.items() if previous.get(k) != v}
+    delta.update({k: None for k in previous.keys() if k not in current})
+    return delta
+
+
+async def wait_for_event(event: asyncio.Event, timeout: float) -> bool:
+    """
+    Wait for an event to be set
+    :param event: The event to wait on
+    :param timeout: The maximum amount of time to wait in seconds
+    :return: Whether the event was set before the timeout
+    """
+    if event.is_set():
+        return True
+    # Not `asyncio.wait_for`, which loses a cancellation that comes in just as the event gets set
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        done, _ = await asyncio.wait({waiter}, timeout=max(timeout, 0))
+    finally:
+        waiter.cancel()
+    return bool(done)
@@ -0,0 +1,232 @@
+"""
+Runs the jobs the worker gets from the API queue.  This is kept apart from `sisyphus` so the worker doesn't import
+the task machinery (and its dependencies) until it has a job to run.
+"""
+import asyncio
+import logging
+from box import Box
+from datetime import datetime
+
+import modules.shared
+from config import Config
+from helpers import metrics
+from helpers.handoff import FIFO, Handoff, HandoffFile, plan_handoff
+from helpers.heartbeat import update_status_message
+from helpers.isolation import run_isolated_task
+from helpers.profiler import TaskProfiler
+from helpers.report import JobReport
+from helpers.resources import TaskUsageTracker
+from modules.base import call_module_method
+from modules.exceptions import (
+    JobValidationError,
+    JobRunFailureError,
+    JobConfigurationError,
+    JobModuleInitError,
+)
+
+
+async def run_job(job: dict, report: JobReport):
+    """
+    Run all of the tasks in a job.  When the worker is draining, the job stops at the next task boundary.
+    :param job: The job from the API queue
+    :param report: The report to record the outcome of the job and its tasks in
+    """
+    job = Box(job)
+    job_failed = False
+    job_start_time = datetime.now()
+    job_title = job.job_title
+    job_id = job.job_id
+    job_tasks = [list(i.keys())[0] for i in job.tasks]
+    job_tasks_str = " -> ".join(job_tasks)
+    profiling = Config.PROFILING_ENABLED or bool(job.get("profile", False))
+    update_status_message(
+        status="in_progress",
+        job_title=job_title,
+        job_id=job_id,
+        task="preparing",
+    )
+    logging.info(f"ACCEPTED JOB: {job_title}: {job_id}")
+    logging.info(f" + [{job_title}] Tasks in job: {job_tasks_str}")
+    if missing := [i for i in job_tasks if i not in modules.shared.capabilities]:
+        logging.critical(
+            f" ! [{job_title}] Worker cannot run the task(s) {', '.join(missing)}, abandoning job."
+        )
+        logging.critical(f"JOB FAILED: {job_title}: {job_id}")
+        report.finish("failed")
+        update_status_message(
+            status="failed", job_title=job_title, job_id=job_id, task=missing[0]
+        )
+        return
+    handoffs = Config.TASK_HANDOFF or bool(job.get("handoff", False))
+    index = 0
+    while index < len(job.tasks):
+        task = list(job.tasks[index].keys())[0]
+        if modules.shared.draining.is_set():
+            logging.critical(
+                f" ! [{job_title} -> {task}] Worker is draining, stopping job before task."
+            )
+            logging.critical(f"JOB INTERRUPTED: {job_title}: {job_id}")
+            report.finish("interrupted")
+            update_status_message(
+                status="interrupted", job_title=job_title, job_id=job_id, task=task
+            )
+            return
+        update_status_message(
+            status="in_progress", job_title=job_title, job_id=job_id, task=task
+        )
+        handoff = plan_handoff(job.tasks, index) if handoffs else None
+        if handoff is None:
+            task_completed = await execute_task(job, report, index, task, job.tasks[index][task], profiling)
+            index += 1
+        else:
+            task_completed = await execute_handoff(job, report, handoff, profiling)
+            index += 2
+        if not task_completed:
+            logging.critical(f"JOB FAILED: {job_title}: {job_id}")
+            job_failed = True
+            break
+    if job_failed:
+        report.finish("failed")
+        update_status_message(
+            status="failed", job_title=job_title, job_id=job_id, task=task
+        )
+        return
+    report.finish("completed")
+    logging.info(f"COMPLETED JOB: {job_title}: {job_id}")
+    job_run_time = datetime.now() - job_start_time
+    logging.info(f"DURATION: {job_run_time}")
+
+
+async def execute_task(job: Box, report: JobReport, index: int, task: str, data: Box, profiling: bool) -> bool:
+    """
+    Run a task of a job, recording it in the report of the job
+    :param job: The job
+    :param report: The report of the job
+    :param index: The position of the task in the job
+    :param task: The name of the task module
+    :param data: The data for the task module
+    :param profiling: Profile the task
+    :return: Whether the task completed
+    """
+    task_start_time = datetime.now()
+    task_report = report.add_task(task)
+    profiler = TaskProfiler(job.job_id, task, index) if profiling and not Config.TASK_ISOLATION else None
+    try:
+        with TaskUsageTracker(task_report.usage):
+            if Config.TASK_ISOLATION:
+                task_completed = await run_isolated_task(
+                    task_report, job.job_id, job.job_title, task, data, index, profiling
+                )
+            else:
+                task_completed = await run_task(job.job_title, task, data, profiler, task_report.details)
+    finally:
+        metrics.reset_encoder(task)
+        if profiler:
+            task_report.profile = profiler.finish()
+    if not task_completed:
+        task_report.finish("failed")
+        return False
+    task_report.finish("completed")
+    task_run_time = datetime.now() - task_start_time
+    logging.info(
+        f" + [{job.job_title} -> {task}] Completed task in '{task_run_time}'."
+    )
+    return True
+
+
+async def execute_handoff(job: Box, report: JobReport, handoff: Handoff, profiling: bool) -> bool:
+    """
+    Run a task along with the next task, which reads the output of the first one from a local file instead of the
+    file the job names (see `helpers.handoff.plan_handoff`).  With a named pipe both tasks run at the same time, and
+    if either one fails the other is stopped, since it would otherwise wait on the pipe forever.  Each task only
+    gets the resource usage of its own processes.  A spooled file is written and read by the tasks one after the
+    other.
+    :param job: The job
+    :param report: The report of the job
+    :param handoff: The handoff between the tasks
+    :param profiling: Profile the tasks
+    :return: Whether both tasks completed
+    """
+    (producer, producer_data), (consumer, consumer_data) = [
+        next(iter(i.items())) for i in job.tasks[handoff.producer:handoff.consumer + 1]
+    ]
+    with HandoffFile(job.job_id, handoff) as handoff_file:
+        logging.info(
+            f" + [{job.job_title}] Handing '{handoff.path}' from {producer} to {consumer} through "
+            f"{'a named pipe' if handoff.mode == FIFO else 'a local file'}: {handoff_file.path}"
+        )
+        producer_data = Box(handoff_file.rewrite(producer_data))
+        consumer_data = Box(handoff_file.rewrite(consumer_data))
+        if handoff.mode != FIFO:
+            if not await execute_task(job, report, handoff.producer, producer, producer_data, profiling):
+                return False
+            return await execute_task(job, report, handoff.consumer, consumer, consumer_data, profiling)
+        # cProfile can only profile one of the tasks on this thread at a time, so only the producer gets profiled
+        # unless the tasks run in their own task processes
+        consumer_profiling = profiling and Config.TASK_ISOLATION
+        tasks = [
+            asyncio.create_task(execute_task(job, report, handoff.producer, producer, producer_data, profiling)),
+            asyncio.create_task(
+                execute_task(job, report, handoff.consumer, consumer, consumer_data, consumer_profiling)
+            ),
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                if not await finished:
+                    return False
+            return True
+        finally:
+            for i in tasks:
+                i.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_task(
+    job_title: str, task: str, data: Box, profiler: TaskProfiler = None, details: dict = None
+) -> bool:
+    """
+    Load the module for a task, then validate and run it.
+    :param job_title: The title of the job the task belongs to
+    :param task: The name of the task module
+    :param data: The data for the task module
+    :param profiler: Profile the initialization, validation, and run of the module with this profiler
+    :param details: Filled in with the details the module adds to the report of the task
+    :return: Whether the task completed
+    """
+    profiled = profiler.wrap if profiler else lambda method: method
+    module_info = modules.shared.registry.get(task)
+    if module_info is None or (module := module_info.load()) is None:
+        logging.critical(
+            f" ! [{job_title} -> {task}] TASK FAILED: Could not load module, abandoning task."
+        )
+        return False
+    try:
+        task_instance = await call_module_method(
+            profiled(module), data=data, job_title=job_title
+        )
+    except JobModuleInitError as e:
+        logging.critical(
+            f" ! [{job_title}] Could not initialize module '{task}': {e.message}"
+        )
+        return False
+    logging.info(f" + [{job_title}] Successfully loaded module: {task}")
+    logging.debug(f" + [{job_title} -> {task}] Validating data: '{data}'")
+    try:
+        await call_module_method(profiled(task_instance.validate))
+        logging.info(
+            f" + [{job_title} -> {task}] Running task from module..."
+        )
+        await call_module_method(profiled(task_instance.run))
+    except (
+        JobValidationError,
+        JobRunFailureError,
+        JobConfigurationError,
+    ) as e:
+        logging.critical(
+            f" ! [{job_title} -> {task}] {type(e).__name__}: {e.message}"
+        )
+        return False
+    finally:
+        if details is not None:
+            details.update(getattr(task_instance, "details", dict()))
+    return True
@@ -1,41 +1,119 @@
-import json
-from urllib.parse import urljoin
-
-import requests
-from box import Box
-
-import modules.shared
-from config import Config
-
-
-class BaseModule:
-
-    data: Box
-    job_title: str
-    module_name: str
-
-    def __init__(self, job_data: dict, job_title: str):
-        self.data = Box(job_data)
-        self.job_title = job_title
-
-    def run(self):
-        pass
-
-    def validate(self):
-        pass
-
-    def set_status(self, status: str = "in_progress", **kwargs):
-        message = {
-            "status": status,
-            "hostname": Config.HOSTNAME,
-            "version": Config.VERSION,
-            "task": self.module_name,
-        }
-        kwargs_filter = ["job_title", "job_id", "task"]
-        for k, v in kwargs.items():
-            if k in kwargs_filter:
-                message[k] = str(v)
-        modules.shared.message = message
-
-    def update_progress(self, info: dict):
-        modules.shared.message['data'] = info
+import asyncio
+import functools
+import inspect
+import shutil
+from typing import Callable, List, Optional
+
+from box import Box
+
+import modules.shared
+from config import Config
+from helpers import metrics
+
+
+class BaseModule:
+
+    data: Box
+    job_title: str
+    module_name: str
+    details: dict
+    required_binaries: List[str] = list()
+    # The data key of the file the module writes, which the worker can hand straight to the next task
+    output_key: Optional[str] = None
+    # Whether the module waits for a CPU slot (`helpers.cpu.CpuLease`) before running its encoder
+    leases_cpus: bool = False
+
+    def __init__(self, job_data: dict, job_title: str):
+        self.data = Box(job_data)
+        self.job_title = job_title
+        # Anything the module wants to add to the report of the task
+        self.details = dict()
+
+    @classmethod
+    def check(cls) -> List[str]:
+        """
+        Check whether the module can run on this worker, called once when the worker starts.  By default this makes
+        sure the binaries in `required_binaries` are on the PATH.
+        :return: List of problems, empty if the module can run
+        """
+        return missing_binaries(cls.required_binaries)
+
+    @classmethod
+    def streams_output(cls, data: dict) -> bool:
+        """
+        Whether the module can write the file in `output_key` to a named pipe for this job data, which needs a format
+        that's written front to back without seeking.
+        :param data: The data of the task
+        :return: Whether the output can be a pipe
+        """
+        return False
+
+    @classmethod
+    def streams_input(cls, data: dict, path: str) -> bool:
+        """
+        Whether the module can read one of its input files from a named pipe for this job data, which needs the file
+        to be read once from front to back.
+        :param data: The data of the task
+        :param path: The input file
+        :return: Whether the input can be a pipe
+        """
+        return False
+
+    def run(self):
+        pass
+
+    def validate(self):
+        pass
+
+    def set_status(self, status: str = "in_progress", **kwargs):
+        message = {
+            "status": status,
+            "hostname": Config.HOSTNAME,
+            "version": Config.VERSION,
+            "task": self.module_name,
+            "capabilities": modules.shared.capabilities,
+        }
+        kwargs_filter = ["job_title", "job_id", "task"]
+        for k, v in kwargs.items():
+            if k in kwargs_filter:
+                message[k] = str(v)
+        modules.shared.status.set_state(message)
+
+    def update_progress(self, info: dict):
+        publish_progress(self.module_name, info)
+
+
+def missing_binaries(binaries: List[str]) -> List[str]:
+    """
+    Check whether binaries are on the PATH
+    :param binaries: The names of the binaries
+    :return: A problem for every binary that's missing
+    """
+    return [f"could not find the '{i}' binary" for i in binaries if not shutil.which(i)]
+
+
+def publish_progress(module_name: str, info: dict):
+    """
+    Pass the progress of a module on to the heartbeat and the encoder metrics
+    :param module_name: The name of the module
+    :param info: The progress information
+    """
+    modules.shared.status.update_progress(info)
+    if "fps" in info:
+        metrics.encoder_fps.set(float(info["fps"]), module=module_name)
+    if "speed" in info:
+        metrics.encoder_speed.set(float(info["speed"]), module=module_name)
+
+
+async def call_module_method(method: Callable, *args, **kwargs):
+    """
+    Call a module method (or constructor) from the event loop.  Coroutine functions are awaited directly, while
+    synchronous ones are run in the default executor so that existing modules keep working without blocking the
+    heartbeat or the API polling.
+    :param method: The module method to call
+    :return: Whatever the method returns
+    """
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
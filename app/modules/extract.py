@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import shlex
+from pathlib import Path
+
+import box
+import modules.shared
+from config import Config
+from helpers.ffmpeg import Ffmpeg as Ff
+from helpers.ffmpeg import Source, SourceOutput
+from helpers.process import run_process
+from helpers.resources import read_process_io
+from modules import exceptions as ex
+from modules.base import BaseModule
+
+logger = logging.getLogger(__name__)
+
+STREAM_TYPES = ["v", "a", "s", "d", "t"]
+CODEC_OPTIONS = ["c", "codec"]
+
+
+class Extract(BaseModule):
+    """
+    Pulls any number of streams out of a source into their own files with a single `ffmpeg` process, so the source
+    is only read once no matter how many streams are extracted.  Streams are copied unless their options pick an
+    encoder.
+    """
+
+    required_binaries = ["ffmpeg"]
+
+    def __init__(self, data: dict, job_title: str):
+        super().__init__(data, job_title)
+        self.encoder = Ff()
+        self.encoder.ffmpeg_path = os.getenv("FFMPEG_PATH", self.encoder.ffmpeg_path)
+        self.module_name = "extract"
+        self.source_size = None
+
+    async def validate(self):
+        logger.info(f" + [{self.job_title} -> {self.module_name}] Validating module configuration...")
+        for i in ["source", "streams"]:
+            if i not in self.data.keys():
+                raise ex.JobConfigurationError(
+                    message=f"Failed to load job, could not find key '{i}'.", module=self.module_name
+                )
+        source = Path(self.data.source)
+        if not (source.is_file() or source.is_fifo()):
+            raise ex.JobValidationError(
+                message=f"Input file '{source.name}' does not exist.", module=self.module_name
+            )
+        if not self.data.streams:
+            raise ex.JobValidationError(message="There are no streams to extract.", module=self.module_name)
+        output_files = set()
+        for stream in self.data.streams:
+            try:
+                stream_type, output_file = stream.stream_type, Path(stream.output_file)
+                int(stream.stream)
+            except (box.BoxKeyError, TypeError, ValueError):
+                raise ex.JobConfigurationError(
+                    message="Every stream needs a 'stream_type', a numeric 'stream', and an 'output_file'.",
+                    module=self.module_name,
+                )
+            if stream_type not in STREAM_TYPES:
+                raise ex.JobValidationError(
+                    message=f"Unknown stream type '{stream_type}', expected one of {', '.join(STREAM_TYPES)}.",
+                    module=self.module_name,
+                )
+            if output_file == source:
+                raise ex.JobValidationError(
+                    message=f"The output file '{output_file.name}' would overwrite the source.", module=self.module_name
+                )
+            if output_file in output_files:
+                raise ex.JobValidationError(
+                    message=f"The output file '{output_file.name}' is used more than once.", module=self.module_name
+                )
+            output_files.add(output_file)
+        self.check_capabilities()
+
+    def check_capabilities(self):
+        """
+        Make sure the encoders picked by the streams are supported by the `ffmpeg` binary on this worker.  Skipped if
+        the binary couldn't be probed.
+        """
+        if (capabilities := modules.shared.encoder_capabilities.get("ffmpeg")) is None:
+            return
+        for stream in self.data.streams:
+            for k, v in stream.get("options", dict()).items():
+                if k in CODEC_OPTIONS and str(v) != "copy" and str(v) not in capabilities["encoders"]:
+                    raise ex.JobValidationError(
+                        message=f"The encoder '{v}' is not supported by the Ffmpeg binary on this worker.",
+                        module=self.module_name,
+                    )
+
+    def generate_command(self) -> str:
+        """
+        Build one `ffmpeg` command with an output file per extracted stream
+        :return: The command
+        """
+        command = f'{self.encoder.ffmpeg_path} -y -nostats -i "{self.data.source}" '
+        for stream in self.data.streams:
+            options = dict(stream.get("options", dict()))
+            if not any(k in CODEC_OPTIONS for k in options):
+                options = {"c": "copy", **options}
+            command += f"{Source(0, stream.stream_type, stream.stream).cli_options} "
+            command += f"{SourceOutput(options=options).cli_options} "
+            command += f'"{stream.output_file}" '
+        return command.strip()
+
+    @classmethod
+    def streams_input(cls, data: dict, path: str) -> bool:
+        return True
+
+    async def watch_progress(self, pid: int):
+        """
+        Report the progress of the extraction by how much of the source `ffmpeg` has read so far, until cancelled
+        :param pid: The `ffmpeg` process
+        """
+        while True:
+            if bytes_read := read_process_io(pid).get("rchar"):
+                self.update_progress(
+                    {
+                        "bytes_read": bytes_read,
+                        "total_bytes": self.source_size,
+                        "percent_complete": "{:0.2f}".format(min(bytes_read / self.source_size, 1) * 100),
+                    }
+                )
+            await asyncio.sleep(Config.HEARTBEAT_PROGRESS_INTERVAL)
+
+    async def run(self):
+        self.source_size = max(Path(self.data.source).stat().st_size, 1)
+        command_raw = self.generate_command()
+        logger.info(f" + [{self.job_title} -> {self.module_name}] Running command: {command_raw}")
+        watchers = list()
+
+        def started(pid: int):
+            # The size of a source handed over through a pipe isn't known, the task writing it reports the progress
+            if not Path(self.data.source).is_fifo():
+                watchers.append(asyncio.create_task(self.watch_progress(pid)))
+
+        try:
+            return_code = await run_process(shlex.split(command_raw), started_callback=started)
+        finally:
+            for watcher in watchers:
+                watcher.cancel()
+        if return_code != 0:
+            raise ex.JobRunFailureError(
+                message=f"`ffmpeg` command returned exit code {return_code}, command: {command_raw}",
+                module=self.module_name,
+            )
+        self.details["extracted"] = [
+            {
+                "stream": f"{i.stream_type}:{i.stream}",
+                "output_file": str(i.output_file),
+                "size": Path(i.output_file).stat().st_size if Path(i.output_file).exists() else None,
+            }
+            for i in self.data.streams
+        ]
+        return True
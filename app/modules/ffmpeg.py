@@ -1,160 +1,549 @@
-import json
-import logging
-import os
-import re
-import shlex
-import subprocess
-import time
-from pathlib import Path
-from urllib.parse import urljoin
-
-import box
-import requests
-from config import Config
-from helpers.ffmpeg import Ffmpeg as Ff
-from helpers.ffmpeg import FfmpegInfo, Source, SourceOutput
-from modules import exceptions as ex
-from modules.base import BaseModule
-
-logger = logging.getLogger(__name__)
-
-
-class Ffmpeg(BaseModule):
-    def __init__(self, data: dict, job_title: str):
-        super().__init__(data, job_title)
-        self.encoder = Ff()
-        self.encoder.ffmpeg_path = os.getenv("FFMPEG_PATH", self.encoder.ffmpeg_path)
-        self.module_name = "ffmpeg"
-
-    def process_files(self):
-        self.encoder.output = self.data.output_file
-        self.encoder.inputs.extend(self.data.sources)
-        self.encoder.settings.overwrite = True
-
-        self.build_source_map()
-        self.build_source_outputs()
-
-    def validate(self):
-        logger.info(f" + [{self.job_title} -> {self.module_name}] Validating module configuration...")
-        self.process_files()
-        if not self.encoder.ffmpeg_path:
-            raise ex.JobValidationError(
-                message=f"Could not find the Ffmpeg binary.", module="ffmpeg"
-            )
-
-        for file in [Path(i) for i in self.encoder.inputs]:
-            if not file.is_file() or not file.exists():
-                raise ex.JobValidationError(
-                    message=f"Input file '{file.name}' does not exist.", module="ffmpeg"
-                )
-
-        for i in ["source_map", "sources"]:
-            if i not in self.data.keys():
-                raise ex.JobValidationError(
-                    message=f"Failed to load job, could not find key 'source_map'.",
-                    module="ffmpeg",
-                )
-
-    def run(self):
-        video_info = FfmpegInfo(Path(self.data.sources[0]))
-        total_frames = video_info.video_tracks[0].frames
-
-        command_raw = self.encoder.generate_command()
-        logger.info(
-            f" + [{self.job_title} -> {self.module_name}] Running command: {command_raw}"
-        )
-        command = shlex.split(command_raw)
-        process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-        )
-
-        while True:
-            time.sleep(1)
-            if (return_code := process.poll()) is not None:
-                break
-            for line in process.stdout:
-                if match := re.search(r"frame=(\s*\d+)", line.decode()):
-                    current_frame = int(match.group(1))
-                    progress = {
-                        "current_frame": current_frame,
-                        "total_frames": total_frames,
-                        "percent_complete": "{:0.2f}".format(
-                            current_frame / total_frames * 100
-                        ),
-                    }
-                    self.update_progress(progress)
-
-        if return_code != 0:
-            raise ex.JobRunFailureError(
-                message=f"`ffmpeg` command returned exit code {return_code}, command: {command_raw}",
-                module="ffmpeg",
-            )
-        return True
-
-    def build_source_map(self):
-        try:
-            for source in self.data.source_map:
-                temp = Source(
-                    source=source.source,
-                    stream_type=source.stream_type,
-                    stream=source.stream,
-                )
-                self.encoder.mapped_sources.append(temp)
-        except box.BoxKeyError as e:
-            raise ex.JobConfigurationError(
-                message=f"Failed to load job, could not find key 'source_map'.",
-                module="ffmpeg",
-            )
-
-    def build_source_outputs(self):
-        for output in self.data.output_map:
-            encode_options = dict()
-
-            try:
-                encode_payload = {
-                    "module": "ffmpeg",
-                    "dataset": "profiles",
-                    "name": output.profile,
-                }
-                try:
-                    encode_profile = json.loads(
-                        requests.get(
-                            urljoin(Config.API_URL, "/worker/data"),
-                            params=encode_payload,
-                        ).text
-                    )
-                except json.decoder.JSONDecodeError:
-                    raise ex.JobConfigurationError(
-                        message="Could not validate the profile JSON from the API.",
-                        module=self.module_name,
-                    )
-                encode_profile_options = encode_profile["settings"]
-                encode_options.update(encode_profile_options)
-            except (
-                requests.exceptions.ConnectionError,
-                requests.exceptions.InvalidSchema,
-                requests.exceptions.MissingSchema,
-                requests.exceptions.InvalidURL,
-            ):
-                raise ex.JobValidationError(
-                    message=f"The profile '{output.profile}' was not found, abandoning job.",
-                    module=self.module_name,
-                )
-            except box.exceptions.BoxKeyError:
-                pass
-            except IndexError:
-                raise ex.JobValidationError(
-                    message=f"The profile '{output.profile}' was not found, abandoning job.",
-                    module=self.module_name,
-                )
-            try:
-                encode_options.update(output.options)
-            except box.exceptions.BoxKeyError:
-                pass
-
-            temp = SourceOutput(
-                stream_type=output.stream_type,
-                stream=output.stream,
-                options=encode_options,
-            )
-            self.encoder.mapped_outputs.append(temp)
+import asyncio
+import json
+import logging
+import os
+import re
+import shlex
+import shutil
+import tempfile
+from pathlib import Path
+
+import box
+import modules.shared
+from config import Config
+from helpers.api import ApiError
+from helpers.cache import Cache
+from helpers.capabilities import filter_names
+from helpers.cpu import CpuLease, format_cpu_list
+from helpers.ffmpeg import Ffmpeg as Ff
+from helpers.ffmpeg import (
+    PASSTHROUGH_KEPT_OPTIONS,
+    FfmpegInfo,
+    Rendition,
+    Source,
+    SourceOutput,
+    passthrough_mismatch,
+)
+from helpers.loudnorm import LoudnessAnalysis, LoudnormError, loudnorm_targets, validate_targets
+from helpers.process import run_process
+from helpers.quality import QualitySearch, QualitySearchError
+from modules import exceptions as ex
+from modules.base import BaseModule
+
+logger = logging.getLogger(__name__)
+
+profile_cache = Cache(name="profiles", ttl=Config.PROFILE_CACHE_TTL)
+
+CODEC_OPTIONS = ["c", "codec", "vcodec", "acodec", "scodec"]
+# Containers `ffmpeg` can write without seeking back into the file
+STREAMABLE_CONTAINERS = [".mkv", ".mka", ".mks", ".webm", ".ts", ".nut"]
+FILTER_OPTIONS = ["vf", "af", "filter", "filter_complex"]
+
+
+class Ffmpeg(BaseModule):
+    required_binaries = ["ffmpeg"]
+    output_key = "output_file"
+    leases_cpus = True
+
+    def __init__(self, data: dict, job_title: str):
+        super().__init__(data, job_title)
+        self.encoder = Ff()
+        self.encoder.ffmpeg_path = os.getenv("FFMPEG_PATH", self.encoder.ffmpeg_path)
+        self.module_name = "ffmpeg"
+        self.total_frames = None
+        self.stats = dict()
+        self.rendition_stats = dict()
+        self.quality_searches = list()
+        self.passthrough_candidates = list()
+        self.loudnorm_outputs = list()
+        self.parallel_tracks = bool(self.data.get("parallel_tracks", Config.FFMPEG_PARALLEL_TRACKS))
+
+    @classmethod
+    def streams_output(cls, data: dict) -> bool:
+        if "renditions" in data or data.get("parallel_tracks", Config.FFMPEG_PARALLEL_TRACKS):
+            return False
+        return Path(str(data.get("output_file", ""))).suffix.lower() in STREAMABLE_CONTAINERS
+
+    @classmethod
+    def streams_input(cls, data: dict, path: str) -> bool:
+        # Parallel tracks, quality searches, loudness measurements, and passthrough checks all read the sources again
+        if data.get("parallel_tracks", Config.FFMPEG_PARALLEL_TRACKS):
+            return False
+        outputs = [*data.get("output_map", []), *[i for r in data.get("renditions", []) for i in r.output_map]]
+        passthrough = data.get("passthrough", Config.FFMPEG_PASSTHROUGH)
+        for output in outputs:
+            if output.get("quality_search") or output.get("loudnorm") or output.get("passthrough", passthrough):
+                return False
+        return True
+
+    async def process_files(self):
+        self.encoder.inputs.extend(self.data.sources)
+        self.encoder.settings.overwrite = True
+
+        self.build_source_map()
+        if "renditions" in self.data:
+            await self.build_renditions()
+        else:
+            self.encoder.output = self.data.output_file
+            self.encoder.mapped_outputs.extend(await self.build_source_outputs(self.data.output_map))
+
+    async def validate(self):
+        logger.info(f" + [{self.job_title} -> {self.module_name}] Validating module configuration...")
+        await self.process_files()
+        if not self.encoder.ffmpeg_path:
+            raise ex.JobValidationError(
+                message=f"Could not find the Ffmpeg binary.", module="ffmpeg"
+            )
+        self.check_capabilities()
+        for output, settings in self.loudnorm_outputs:
+            if output.stream_type != "a":
+                raise ex.JobValidationError(
+                    message="Loudness normalization can only be used on audio outputs.", module=self.module_name
+                )
+            if problems := validate_targets(settings):
+                raise ex.JobValidationError(
+                    message=f"Invalid loudnorm settings: {'; '.join(problems)}", module=self.module_name
+                )
+        if self.encoder.renditions:
+            self.validate_renditions()
+            if self.data.get("parallel_tracks"):
+                raise ex.JobValidationError(
+                    message="Parallel tracks can't be combined with renditions.", module=self.module_name
+                )
+
+        for output, settings in self.quality_searches:
+            if output.stream_type != "v":
+                raise ex.JobValidationError(
+                    message="A quality search can only be run for video outputs.", module=self.module_name
+                )
+            if problems := QualitySearch.validate_settings(settings):
+                raise ex.JobValidationError(
+                    message=f"Invalid quality search settings: {'; '.join(problems)}", module=self.module_name
+                )
+
+        for file in [Path(i) for i in self.encoder.inputs]:
+            if not (file.is_file() or file.is_fifo()):
+                raise ex.JobValidationError(
+                    message=f"Input file '{file.name}' does not exist.", module="ffmpeg"
+                )
+
+        for i in ["source_map", "sources"]:
+            if i not in self.data.keys():
+                raise ex.JobValidationError(
+                    message=f"Failed to load job, could not find key 'source_map'.",
+                    module="ffmpeg",
+                )
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # A source handed over through a pipe can only be read once, by the encode itself
+        if not Path(self.data.sources[0]).is_fifo():
+            video_info = await loop.run_in_executor(None, FfmpegInfo, Path(self.data.sources[0]))
+            self.total_frames = video_info.video_tracks[0].frames if video_info.video_tracks else None
+        if self.passthrough_candidates:
+            await self.apply_passthrough()
+
+        async with CpuLease() as slot:
+            if slot:
+                logger.info(
+                    f" + [{self.job_title} -> {self.module_name}] Pinned to CPUs {format_cpu_list(slot.cpus)} "
+                    f"(slot {slot.index})"
+                )
+            for output, settings in self.quality_searches:
+                await self.search_quality(output, settings, slot.cpus if slot else None)
+            for index, (output, settings) in enumerate(self.loudnorm_outputs):
+                self.update_progress(
+                    {
+                        "stage": "loudnorm",
+                        "percent_complete": "{:0.2f}".format(index / len(self.loudnorm_outputs) * 100),
+                    }
+                )
+                await self.normalize_loudness(output, settings, slot.cpus if slot else None)
+            if slot:
+                # The video encoders of a ladder run side by side, so they share the CPUs of the slot
+                video_outputs = [i for i in self.encoder.all_outputs if i.stream_type == "v"]
+                for output in video_outputs:
+                    output.limit_threads(max(1, len(slot.cpus) // len(video_outputs)))
+            problem = self.encoder.split_tracks_problem() if self.parallel_tracks else None
+            if problem is not None:
+                logger.info(
+                    f" + [{self.job_title} -> {self.module_name}] Encoding all tracks in one process, {problem}."
+                )
+            cpus = slot.cpus if slot else None
+            if self.parallel_tracks and problem is None:
+                await self.run_split_tracks(cpus)
+            else:
+                await self.run_command(self.encoder.generate_command(), self.parse_progress, cpus)
+        return True
+
+    async def run_command(self, command_raw: str, line_callback=None, cpus: list = None):
+        """
+        Run an `ffmpeg` command, failing the task if it doesn't succeed
+        :param command_raw: The command
+        :param line_callback: Called with every line of output
+        :param cpus: Run the command on these CPUs
+        """
+        logger.info(
+            f" + [{self.job_title} -> {self.module_name}] Running command: {command_raw}"
+        )
+        return_code = await run_process(shlex.split(command_raw), line_callback, cpus=cpus)
+        if return_code != 0:
+            raise ex.JobRunFailureError(
+                message=f"`ffmpeg` command returned exit code {return_code}, command: {command_raw}",
+                module="ffmpeg",
+            )
+
+    async def run_split_tracks(self, cpus: list = None):
+        """
+        Encode the video and every audio and subtitle track in separate `ffmpeg` processes at the same time, into
+        intermediate files next to the output, then copy them into the output.  Up to
+        `Config.FFMPEG_TRACK_PROCESSES` track encodes run at once.  If any encode fails, the others are stopped.
+        :param cpus: Run the encodes on these CPUs
+        """
+        output = self.encoder.output
+        directory = Path(tempfile.mkdtemp(prefix=f".{output.stem}.tracks-", dir=output.parent))
+        try:
+            tracks = self.encoder.track_encodes(directory)
+            has_video = any(i.stream_type == "v" for i in self.encoder.mapped_sources)
+            video = directory / "video.mkv" if has_video else None
+            semaphore = asyncio.Semaphore(Config.FFMPEG_TRACK_PROCESSES)
+            self.stats.update({"tracks_complete": 0, "tracks_total": len(tracks)})
+
+            async def encode_track(track):
+                async with semaphore:
+                    await self.run_command(self.encoder.generate_track_command(track), cpus=cpus)
+                self.stats["tracks_complete"] += 1
+                if not has_video:
+                    self.update_progress(
+                        {
+                            "stage": "tracks",
+                            "percent_complete": "{:0.2f}".format(self.stats["tracks_complete"] / len(tracks) * 100),
+                            **self.stats,
+                        }
+                    )
+
+            encodes = [asyncio.create_task(encode_track(i)) for i in tracks]
+            if video:
+                encodes.append(
+                    asyncio.create_task(
+                        self.run_command(self.encoder.generate_video_command(video), self.parse_progress, cpus)
+                    )
+                )
+            try:
+                await asyncio.gather(*encodes)
+            except BaseException:
+                for encode in encodes:
+                    encode.cancel()
+                await asyncio.gather(*encodes, return_exceptions=True)
+                raise
+            self.update_progress({"stage": "mux", **self.stats})
+            await self.run_command(self.encoder.generate_mux_command(video, tracks), cpus=cpus)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, directory, True)
+
+    async def search_quality(self, output: SourceOutput, settings: dict, cpus: list = None):
+        """
+        Find the cheapest CRF that meets the quality target of a video output and put it into the output options
+        :param output: The video output
+        :param settings: The quality search settings of the output
+        :param cpus: Run the sample encodes on these CPUs
+        """
+        try:
+            source = [i for i in self.encoder.mapped_sources if i.stream_type == "v"][output.stream]
+        except IndexError:
+            source = Source(source=0, stream_type="v", stream=0)
+        path = Path(self.data.sources[source.source])
+        stream = source.stream or 0
+        loop = asyncio.get_running_loop()
+        video_info = await loop.run_in_executor(None, FfmpegInfo, path)
+        search = QualitySearch(
+            self.encoder.ffmpeg_path, path, stream, output.options, settings, video_info.video_tracks[stream].duration
+        )
+        logger.info(
+            f" + [{self.job_title} -> {self.module_name}] Searching for the CRF that meets {search.metric} "
+            f"{search.target} (CRF {', '.join(str(i) for i in search.crf_values)})..."
+        )
+
+        def progress(finished: int, total: int):
+            self.update_progress(
+                {"stage": "quality_search", "percent_complete": "{:0.2f}".format(finished / total * 100)}
+            )
+
+        try:
+            result = await search.run(cpus, progress)
+        except QualitySearchError as e:
+            raise ex.JobRunFailureError(message=f"Quality search failed: {e.message}", module=self.module_name)
+        output.options["crf"] = result["crf"]
+        logger.info(
+            f" + [{self.job_title} -> {self.module_name}] Using CRF {result['crf']} for video output {output.stream}"
+            f"{' (cached)' if result['cached'] else ''}, {search.metric} by CRF: {result['scores']}"
+        )
+
+    async def apply_passthrough(self):
+        """
+        Switch the audio and subtitle outputs that opted into passthrough to stream copy when their source stream
+        already matches what the output would encode (see `helpers.ffmpeg.passthrough_mismatch`).  Outputs are
+        matched to the source streams mapped in the same order, so this is skipped unless every entry in the
+        `source_map` picks a single stream.  The copied streams are added to the report of the task.
+        """
+        if not all(i.stream_type is not None and i.stream is not None for i in self.encoder.mapped_sources):
+            logger.info(
+                f" + [{self.job_title} -> {self.module_name}] Not checking for passthrough, the source map does not "
+                f"map single streams."
+            )
+            return
+        loop = asyncio.get_running_loop()
+        infos = dict()
+        passed = list()
+        for output in self.passthrough_candidates:
+            sources = [i for i in self.encoder.mapped_sources if i.stream_type == output.stream_type]
+            if output.stream is None or output.stream >= len(sources):
+                continue
+            source = sources[output.stream]
+            if source.source not in infos:
+                infos[source.source] = await loop.run_in_executor(
+                    None, FfmpegInfo, Path(self.data.sources[source.source])
+                )
+            info = infos[source.source]
+            tracks = info.audio_tracks if output.stream_type == "a" else info.subtitle_tracks
+            if source.stream >= len(tracks):
+                continue
+            track = tracks[source.stream]
+            reason = passthrough_mismatch(track, output.options, Config.FFMPEG_PASSTHROUGH_BITRATE_TOLERANCE)
+            if reason is not None:
+                logger.debug(
+                    f" + [{self.job_title} -> {self.module_name}] Encoding output {output.stream_type}:"
+                    f"{output.stream}, {reason}."
+                )
+                continue
+            options = {k: v for k, v in output.options.items() if k in PASSTHROUGH_KEPT_OPTIONS}
+            output.options = {"c": "copy", **options}
+            passed.append(
+                {
+                    "output": f"{output.stream_type}:{output.stream}",
+                    "source": f"{source.source}:{source.stream_type}:{source.stream}",
+                    "format": track.format,
+                    "bitrate": track.bitrate,
+                }
+            )
+        if passed:
+            logger.info(
+                f" + [{self.job_title} -> {self.module_name}] Copying outputs that match their source: "
+                f"{', '.join(i['output'] for i in passed)}"
+            )
+        self.details["passthrough"] = passed
+
+    async def normalize_loudness(self, output: SourceOutput, settings, cpus: list = None):
+        """
+        Measure the loudness of the source stream of an audio output (or get the measurements from the cache) and
+        add the `loudnorm` filter with the measurements to the audio filters of the output
+        :param output: The audio output
+        :param settings: The `loudnorm` setting of the output
+        :param cpus: Run the measurement on these CPUs
+        """
+        try:
+            source = [i for i in self.encoder.mapped_sources if i.stream_type == "a"][output.stream]
+        except IndexError:
+            source = Source(source=0, stream_type="a", stream=output.stream)
+        path = Path(self.data.sources[source.source])
+        stream = source.stream or 0
+        filters = output.options.get("af")
+        analysis = LoudnessAnalysis(self.encoder.ffmpeg_path, path, stream, loudnorm_targets(settings), filters)
+        try:
+            measured = await analysis.run(cpus)
+        except LoudnormError as e:
+            raise ex.JobRunFailureError(message=f"Loudness analysis failed: {e.message}", module=self.module_name)
+        output.options["af"] = ",".join([*([str(filters)] if filters else []), analysis.normalize_filter(measured)])
+        if "ar" not in output.options:
+            # `loudnorm` resamples to 192 kHz internally, so the output keeps the sample rate of the source
+            info = await asyncio.get_running_loop().run_in_executor(None, FfmpegInfo, path)
+            if stream < len(info.audio_tracks) and info.audio_tracks[stream].sampling_rate:
+                output.options["ar"] = info.audio_tracks[stream].sampling_rate
+        logger.info(
+            f" + [{self.job_title} -> {self.module_name}] Normalizing audio output {output.stream} from "
+            f"{measured['input_i']} LUFS{' (cached)' if measured['cached'] else ''}"
+        )
+
+    def check_capabilities(self):
+        """
+        Make sure the encoders and filters used by the outputs are supported by the `ffmpeg` binary on this worker.
+        Skipped if the binary couldn't be probed.
+        """
+        if (capabilities := modules.shared.encoder_capabilities.get("ffmpeg")) is None:
+            return
+        if self.loudnorm_outputs and "loudnorm" not in capabilities["filters"]:
+            raise ex.JobValidationError(
+                message="The filter 'loudnorm' is not supported by the Ffmpeg binary on this worker.",
+                module=self.module_name,
+            )
+        for output in self.encoder.all_outputs:
+            for k, v in output.options.items():
+                if k in CODEC_OPTIONS and str(v) != "copy" and str(v) not in capabilities["encoders"]:
+                    raise ex.JobValidationError(
+                        message=f"The encoder '{v}' is not supported by the Ffmpeg binary on this worker.",
+                        module=self.module_name,
+                    )
+                if k in FILTER_OPTIONS:
+                    for name in filter_names(str(v)):
+                        if name not in capabilities["filters"]:
+                            raise ex.JobValidationError(
+                                message=f"The filter '{name}' is not supported by the Ffmpeg binary on this worker.",
+                                module=self.module_name,
+                            )
+
+    def parse_progress(self, line: str):
+        """
+        Parse a line of `ffmpeg` output, keeping track of the encoding stats and updating the progress on every
+        frame count.  The renditions of a ladder are fed by the same decode, so they share the frame count, while
+        the quantizer `ffmpeg` reports for the video of every output file is tracked per rendition.
+        :param line: A line of output from `ffmpeg`
+        """
+        if match := re.search(r"stream_(\d+)_\d+_q=(-?\d+(?:\.\d+)?)", line):
+            self.rendition_stats.setdefault(int(match.group(1)), dict())["q"] = float(match.group(2))
+        if match := re.search(r"fps=\s*(\d+(?:\.\d+)?)", line):
+            self.stats["fps"] = float(match.group(1))
+        if match := re.search(r"speed=\s*(\d+(?:\.\d+)?)x", line):
+            self.stats["speed"] = float(match.group(1))
+        if self.total_frames and (match := re.search(r"frame=(\s*\d+)", line)):
+            current_frame = int(match.group(1))
+            progress = {
+                "current_frame": current_frame,
+                "total_frames": self.total_frames,
+                "percent_complete": "{:0.2f}".format(
+                    current_frame / self.total_frames * 100
+                ),
+                **self.stats,
+            }
+            if self.encoder.renditions:
+                progress["renditions"] = [
+                    {"output_file": str(rendition.output), **self.rendition_stats.get(index, dict())}
+                    for index, rendition in enumerate(self.encoder.renditions)
+                ]
+            self.update_progress(progress)
+
+    def build_source_map(self):
+        try:
+            for source in self.data.source_map:
+                temp = Source(
+                    source=source.source,
+                    stream_type=source.stream_type,
+                    stream=source.stream,
+                )
+                self.encoder.mapped_sources.append(temp)
+        except box.BoxKeyError as e:
+            raise ex.JobConfigurationError(
+                message=f"Failed to load job, could not find key 'source_map'.",
+                module="ffmpeg",
+            )
+
+    def validate_renditions(self):
+        """
+        Make sure the source map can feed a rendition ladder: the video source is split in the filter graph, so the
+        source map has to map exactly one video stream and nothing that would pull in the video streams again.
+        """
+        video_sources = [i for i in self.encoder.mapped_sources if i.stream_type == "v"]
+        if len(video_sources) != 1 or any(i.stream_type is None for i in self.encoder.mapped_sources):
+            raise ex.JobValidationError(
+                message="Renditions need a source map with a single video stream and a stream type for every entry.",
+                module=self.module_name,
+            )
+        for rendition in self.encoder.renditions:
+            for output in rendition.video_outputs:
+                if any(k in CODEC_OPTIONS and str(v) == "copy" for k, v in output.options.items()):
+                    raise ex.JobValidationError(
+                        message=f"The video of rendition '{rendition.output.name}' comes out of a filter graph, so "
+                        f"it can't be copied.",
+                        module=self.module_name,
+                    )
+
+    async def build_renditions(self):
+        """
+        Build the output files of a rendition ladder.  The `video_filter` of a rendition (e.g. `scale=-2:720`) goes
+        in front of the video filters of its video outputs, which all end up in one filter graph fed by a single
+        decode of the source.
+        """
+        for rendition in self.data.renditions:
+            outputs = await self.build_source_outputs(rendition.output_map)
+            if video_filter := rendition.get("video_filter"):
+                for output in [i for i in outputs if i.stream_type == "v"]:
+                    chain = [video_filter, *([output.options["vf"]] if "vf" in output.options else [])]
+                    output.options["vf"] = ",".join(str(i) for i in chain)
+            self.encoder.renditions.append(Rendition(rendition.output_file, outputs))
+
+    async def build_source_outputs(self, output_map: list) -> list:
+        """
+        Build the outputs of an output file from its output map, along with their profiles
+        :param output_map: The output map
+        :return: The outputs
+        """
+        outputs = list()
+        for output in output_map:
+            encode_options = dict()
+
+            try:
+                try:
+                    encode_profile = await self.get_profile(output.profile)
+                except json.decoder.JSONDecodeError:
+                    raise ex.JobConfigurationError(
+                        message="Could not validate the profile JSON from the API.",
+                        module=self.module_name,
+                    )
+                encode_profile_options = encode_profile["settings"]
+                encode_options.update(encode_profile_options)
+            except ApiError:
+                raise ex.JobValidationError(
+                    message=f"The profile '{output.profile}' was not found, abandoning job.",
+                    module=self.module_name,
+                )
+            except box.exceptions.BoxKeyError:
+                pass
+            except IndexError:
+                raise ex.JobValidationError(
+                    message=f"The profile '{output.profile}' was not found, abandoning job.",
+                    module=self.module_name,
+                )
+            try:
+                encode_options.update(output.options)
+            except box.exceptions.BoxKeyError:
+                pass
+
+            temp = SourceOutput(
+                stream_type=output.stream_type,
+                stream=output.stream,
+                options=encode_options,
+            )
+            outputs.append(temp)
+            if output.get("quality_search"):
+                self.quality_searches.append((temp, output.quality_search))
+            if output.get("loudnorm"):
+                self.loudnorm_outputs.append((temp, output.loudnorm))
+            passthrough = output.get("passthrough", self.data.get("passthrough", Config.FFMPEG_PASSTHROUGH))
+            # A normalized output gets filtered, so it can't be copied
+            if passthrough and temp.stream_type in ["a", "s"] and not output.get("loudnorm"):
+                self.passthrough_candidates.append(temp)
+        return outputs
+
+    @staticmethod
+    async def get_profile(name: str) -> dict:
+        """
+        Get an encoding profile from the API.  Profiles are cached for `Config.PROFILE_CACHE_TTL` seconds so jobs
+        using the same profiles don't fetch them over and over.  Only profiles the API actually returned are cached.
+        :param name: The name of the profile
+        :return: The profile
+        """
+        cache_key = ("ffmpeg", "profiles", name)
+        if (profile := profile_cache.get(cache_key)) is None:
+            encode_payload = {
+                "module": "ffmpeg",
+                "dataset": "profiles",
+                "name": name,
+            }
+            response = await modules.shared.api.get("/worker/data", params=encode_payload)
+            if not response.ok:
+                raise ex.JobValidationError(
+                    message=f"Could not get the profile '{name}' from the API ({response.status}).",
+                    module="ffmpeg",
+                )
+            profile = response.json()
+            profile_cache.set(cache_key, profile)
+        return profile
@@ -1,138 +1,616 @@
-import re
-import subprocess
-import time
-from pathlib import Path
-
-from box import Box
-
-from config import Config
-from helpers.ffmpeg import FfmpegInfo
-from helpers.handbrake import Handbrake as Hb
-from helpers.handbrake import HandbrakeTrack
-from modules.base import BaseModule
-from modules.exceptions import JobRunFailureError, JobValidationError
-
-
-class Handbrake(BaseModule):
-    def __init__(self, data: dict, job_title: str):
-        super().__init__(data, job_title)
-        self.module_name = "handbrake"
-        if "HANDBRAKE_CLI_PATH" in list(Config.__dict__):
-            self.encoder = Hb(cli_path=getattr(Config, "HANDBRAKE_CLI_PATH"))
-        else:
-            self.encoder = Hb()
-
-    def process_data(self):
-        self.encoder.source = self.data.source
-        self.encoder.output_file = self.data.output_file
-
-        # Go through each group and put the data where Handbrake expects it to be.  If it's not there, no big deal,
-        # just skip it as the default for the module is an empty Box.
-        option_sections = [
-            "general",
-            "source",
-            "destination",
-            "video",
-            "picture",
-            "filters",
-        ]
-        for option in option_sections:
-            try:
-                setattr(
-                    self.encoder, f"{option}_options", self.data[f"{option}_options"]
-                )
-            except KeyError:
-                pass
-
-        # Need to add all the tracks to the audio and subtitle sections.  Again, if there are no audio or subtitle
-        # tracks associated with it, then it's not an issue.
-        track_sections = [
-            "audio",
-            "subtitle",
-        ]
-        for section in track_sections:
-            try:
-                for track in self.data[f"{section}_tracks"]:
-                    a = getattr(self.encoder, f"{section}_tracks")
-                    a.append(HandbrakeTrack(**track))
-            except TypeError:
-                raise JobValidationError(
-                    message=f'Only "track" and "option" definitions allowed in {section} track!',
-                    module=self.module_name,
-                )
-            except KeyError:
-                pass
-
-    def run(self):
-        self.process_data()
-        total_frames = (
-            FfmpegInfo(source_file=self.encoder.source).video_tracks[0].frames
-        )
-        command = self.encoder.generate_cli()
-        if "--json" not in command:
-            command.append("--json")
-        process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-        )
-
-        while True:
-            time.sleep(1)
-            if (return_code := process.poll()) is not None:
-                break
-            for line in process.stdout:
-                if match := re.search(r'"Progress": (\d+\.\d+)', line.decode()):
-                    completed_perc = float(match.group(1))
-                    progress = {
-                        "current_frame": int(completed_perc * total_frames),
-                        "total_frames": total_frames,
-                        "percent_complete": "{:0.2f}".format(completed_perc * 100),
-                    }
-                    self.update_progress(progress)
-
-        if return_code != 0:
-            raise JobRunFailureError(
-                message=f"'{self.module_name}' returned exit code {return_code}: {command}",
-                module=self.module_name,
-            )
-        return True
-
-    def validate(self):
-        # Verify that the encoder actually exists if given via the cli_path variable
-        if not self.encoder.cli_path.exists():
-            raise JobValidationError(
-                message=f"Could not find the HandBrake CLI binary at '{self.encoder.cli_path.absolute()}'",
-                module=self.module_name,
-            )
-
-        # Verify that the source is specified in the data
-        if "source" not in self.data.keys():
-            raise JobValidationError(
-                message="No source file specified.", module=self.module_name
-            )
-
-        # Make sure that the input and output options aren't actually used.  The default style
-        # for these are the "source" and "output_file" settings in the data
-        for section in self.data.values():
-            if type(section) is Box:
-                keys = set(section.keys())
-                illegal = {"i", "input", "o", "output"}
-                if keys.intersection(illegal):
-                    raise JobValidationError(
-                        message=f"Cannot set input/output files via option sections!",
-                        module=self.module_name,
-                    )
-
-        # Make sure that the source actually exists and is a file
-        if not Path(self.data.source).exists() or not Path(self.data.source).is_file():
-            raise JobValidationError(
-                message=f"The source file '{Path(self.data.source).absolute()}' either does not exist "
-                f"or is not a file.",
-                module=self.module_name,
-            )
-
-        # Verify that there is an actual output file
-        if "output_file" not in self.data.keys():
-            raise JobValidationError(
-                message=f"There is no output file defined in the job, abandoning job.",
-                module=self.module_name,
-            )
+import asyncio
+import copy
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List
+
+from box import Box
+
+import modules.shared
+from config import Config
+from helpers.cache import Cache
+from helpers.cpu import CpuLease, format_cpu_list
+from helpers.handbrake import Handbrake as Hb
+from helpers.handbrake import HandbrakePresetError, HandbrakeProgress, HandbrakeQueue, HandbrakeQueueError
+from helpers.handbrake import HandbrakeScan, HandbrakeScanError
+from helpers.handbrake import HandbrakeTrack, Segment, load_preset_file, plan_segments
+from helpers.mkvmerge import Matroska, MkvSource
+from helpers.process import run_process
+from modules.base import BaseModule
+from modules.exceptions import JobRunFailureError, JobValidationError
+
+logger = logging.getLogger(__name__)
+
+preset_cache = Cache(name="handbrake_api_presets", ttl=Config.PROFILE_CACHE_TTL)
+
+# Track values HandBrake takes besides track numbers
+SPECIAL_TRACKS = {"audio": ["none"], "subtitle": ["none", "scan"]}
+# Options that pick the part of the title to encode, which a segmented encode sets itself
+RANGE_OPTIONS = ["chapters", "c", "start_at", "stop_at"]
+
+
+class Handbrake(BaseModule):
+    required_binaries = ["HandBrakeCLI"]
+    output_key = "output_file"
+    leases_cpus = True
+
+    def __init__(self, data: dict, job_title: str):
+        super().__init__(data, job_title)
+        self.module_name = "handbrake"
+        self.progress = HandbrakeProgress()
+        self.work_error = None
+        self.encoder = self.new_encoder()
+        # A batch encodes several sources with the same options, each item gets the data of a single encode
+        self.batch = "items" in self.data
+        self.items = list()
+        self.titles = list()
+        self.item_index = 0
+        # The items of a batch by their `SequenceID` in the queue, and the HandBrake error of every finished item
+        self.item_sequences = dict()
+        self.item_results = dict()
+        self.segments = list()
+        self.preset = None
+
+    @classmethod
+    def check(cls) -> List[str]:
+        if "HANDBRAKE_CLI_PATH" in list(Config.__dict__):
+            cli_path = Path(getattr(Config, "HANDBRAKE_CLI_PATH"))
+            if not cli_path.exists():
+                return [f"could not find the HandBrake CLI binary at '{cli_path}'"]
+            return list()
+        return super().check()
+
+    @staticmethod
+    def new_encoder() -> Hb:
+        if "HANDBRAKE_CLI_PATH" in list(Config.__dict__):
+            return Hb(cli_path=getattr(Config, "HANDBRAKE_CLI_PATH"))
+        return Hb()
+
+    def process_data(self, data: Box) -> Hb:
+        """
+        Build the HandBrake command of an encode
+        :param data: The data of the encode
+        :return: The command builder
+        """
+        encoder = self.new_encoder()
+        encoder.preset = self.preset
+        encoder.source = data.source
+        encoder.output_file = data.output_file
+
+        # Go through each group and put the data where Handbrake expects it to be.  If it's not there, no big deal,
+        # just skip it as the default for the module is an empty Box.
+        option_sections = [
+            "general",
+            "source",
+            "destination",
+            "video",
+            "picture",
+            "filters",
+        ]
+        for option in option_sections:
+            try:
+                setattr(
+                    encoder, f"{option}_options", data[f"{option}_options"]
+                )
+            except KeyError:
+                pass
+
+        # Need to add all the tracks to the audio and subtitle sections.  Again, if there are no audio or subtitle
+        # tracks associated with it, then it's not an issue.
+        track_sections = [
+            "audio",
+            "subtitle",
+        ]
+        for section in track_sections:
+            try:
+                for track in data[f"{section}_tracks"]:
+                    a = getattr(encoder, f"{section}_tracks")
+                    a.append(HandbrakeTrack(**track))
+            except TypeError:
+                raise JobValidationError(
+                    message=f'Only "track" and "option" definitions allowed in {section} track!',
+                    module=self.module_name,
+                )
+            except KeyError:
+                pass
+        return encoder
+
+    async def run(self):
+        encoders = [self.process_data(i) for i in self.items]
+        async with CpuLease() as slot:
+            if slot:
+                logger.info(
+                    f" + [{self.job_title} -> {self.module_name}] Pinned to CPUs {format_cpu_list(slot.cpus)} "
+                    f"(slot {slot.index})"
+                )
+            if self.segments:
+                await self.encode_segments(slot.cpus if slot else None)
+            elif self.batch:
+                await self.encode_batch(encoders, slot.cpus if slot else None)
+            else:
+                await self.encode(encoders[0], slot.cpus if slot else None)
+        return True
+
+    async def encode_batch(self, encoders: List[Hb], cpus: List[int] = None):
+        """
+        Encode every item of a batch in a single `HandBrakeCLI` process through a queue file (see
+        `helpers.handbrake.HandbrakeQueue`), so the items don't each pay for starting `HandBrakeCLI` and scanning.
+        The progress and the outcome of every item are told apart by the `SequenceID` of the progress blocks.  An
+        item that fails doesn't stop the ones after it: the result of every item goes into the details of the task,
+        and the task only fails if every item failed.
+        :param encoders: The command builders of the items
+        :param cpus: Run the encodes on these CPUs
+        """
+        loop = asyncio.get_running_loop()
+        directory = Path(tempfile.mkdtemp(prefix=".sisyphus-queue-", dir=Path(self.items[0].output_file).parent))
+        queue = HandbrakeQueue(self.encoder.cli_path, directory)
+        errors = [None] * len(encoders)
+        self.item_sequences, self.item_results = dict(), dict()
+        return_code = 0
+        try:
+            for index, encoder in enumerate(encoders):
+                if cpus:
+                    encoder.limit_threads(len(cpus))
+                try:
+                    sequence = await queue.add(encoder, len(self.titles[index]["chapters"]))
+                except HandbrakeQueueError as e:
+                    errors[index] = e.message
+                    continue
+                self.item_sequences[sequence] = index
+            if self.item_sequences:
+                queue_file = await loop.run_in_executor(None, queue.write)
+                self.progress = HandbrakeProgress()
+                return_code = await run_process(queue.generate_cli(queue_file), self.parse_progress, cpus=cpus)
+        finally:
+            await loop.run_in_executor(None, shutil.rmtree, directory, True)
+        for index in self.item_sequences.values():
+            if (error := self.item_results.get(index)) is None and return_code != 0:
+                errors[index] = f"'HandBrakeCLI' exited with code {return_code} before finishing the item"
+            elif error:
+                errors[index] = f"'HandBrakeCLI' failed to encode the item (error {error})"
+        for index, error in enumerate(errors):
+            if error:
+                logger.warning(
+                    f" + [{self.job_title} -> {self.module_name}] Item {index + 1} of the batch failed: {error}"
+                )
+        self.details["items"] = [
+            {"source": i.source, "output_file": i.output_file, "completed": error is None, "error": error}
+            for i, error in zip(self.items, errors)
+        ]
+        if all(errors):
+            raise JobRunFailureError(message="Every item of the batch failed.", module=self.module_name)
+
+    async def encode(self, encoder: Hb, cpus: List[int] = None, line_callback=None):
+        """
+        Run a single encode
+        :param encoder: The command builder of the encode
+        :param cpus: Pin the encode to these CPUs, any CPU if not provided
+        :param line_callback: Called with every line of output instead of parsing the progress of the task
+        """
+        if cpus:
+            encoder.limit_threads(len(cpus))
+        command = encoder.generate_cli()
+        if "--json" not in command:
+            command.append("--json")
+        self.progress = HandbrakeProgress()
+        self.work_error = None
+        return_code = await run_process(command, line_callback or self.parse_progress, cpus=cpus)
+        if return_code != 0:
+            error = f" (error {self.work_error})" if self.work_error else ""
+            raise JobRunFailureError(
+                message=f"'{self.module_name}' returned exit code {return_code}{error}: {command}",
+                module=self.module_name,
+            )
+
+    async def encode_segments(self, cpus: List[int] = None):
+        """
+        Encode the title in segments with up to `Config.HANDBRAKE_SEGMENT_PROCESSES` `HandBrakeCLI` processes at
+        once, into intermediate files next to the output, then append them into the output with `mkvmerge`.  The
+        processes running at once share the CPUs.  If any segment fails, the others are stopped.
+        :param cpus: Run the encodes on these CPUs
+        """
+        output_file = Path(self.data.output_file)
+        directory = Path(tempfile.mkdtemp(prefix=f".{output_file.stem}.segments-", dir=output_file.parent))
+        processes = min(len(self.segments), Config.HANDBRAKE_SEGMENT_PROCESSES)
+        threads = max(1, len(cpus or os.sched_getaffinity(0)) // processes)
+        semaphore = asyncio.Semaphore(processes)
+        total = sum(i.duration for i in self.segments) or 1
+        done, rates = [0.0] * len(self.segments), [0.0] * len(self.segments)
+        self.details["segments"] = [i.options for i in self.segments]
+
+        def report():
+            encoded = sum(d * s.duration for d, s in zip(done, self.segments))
+            self.update_progress(
+                {
+                    "stage": "encoding",
+                    "segments_complete": done.count(1.0),
+                    "segments": len(self.segments),
+                    "fps": round(sum(rates), 3),
+                    "percent_complete": "{:0.2f}".format(encoded / total * 100),
+                }
+            )
+
+        async def encode_segment(index: int, segment: Segment, path: Path):
+            encoder = self.process_data(self.data)
+            encoder.output_file = path
+            encoder.source_options = Box({**encoder.source_options, **segment.options})
+            destination_options = {k: v for k, v in encoder.destination_options.items() if k not in ["f", "format"]}
+            encoder.destination_options = Box({**destination_options, "format": "av_mkv"})
+            encoder.limit_threads(threads)
+            parser = HandbrakeProgress()
+
+            def progress(line: str):
+                if (block := parser.feed(line)) is None or (info := parser.progress_info(block)) is None:
+                    return
+                if info["stage"] == "encoding":
+                    done[index], rates[index] = float(info["percent_complete"]) / 100, info["fps"]
+                    report()
+
+            async with semaphore:
+                await self.encode(encoder, cpus, progress)
+            done[index], rates[index] = 1.0, 0.0
+            report()
+
+        try:
+            paths = [directory / f"segment_{i:03d}.mkv" for i in range(len(self.segments))]
+            encodes = [asyncio.create_task(encode_segment(i, *j)) for i, j in enumerate(zip(self.segments, paths))]
+            try:
+                await asyncio.gather(*encodes)
+            except BaseException:
+                for encode in encodes:
+                    encode.cancel()
+                await asyncio.gather(*encodes, return_exceptions=True)
+                raise
+            await self.append_segments(paths, directory / "append.json", cpus)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, directory, True)
+
+    async def append_segments(self, paths: List[Path], options_file: Path, cpus: List[int] = None):
+        """
+        Append the encoded segments into the output file with `mkvmerge`
+        :param paths: The encoded segments, in order
+        :param options_file: Where to write the options of `mkvmerge`
+        :param cpus: Run `mkvmerge` on these CPUs
+        """
+        matroska = Matroska(self.data.output_file)
+        for index, path in enumerate(paths):
+            matroska.add_source(MkvSource(path, append=index > 0))
+        matroska.write_options_file(options_file)
+
+        def progress(line: str):
+            if match := re.match(r"Progress: (\d+)%", line):
+                self.update_progress({"stage": "append", "percent_complete": "{:0.2f}".format(int(match.group(1)))})
+
+        self.update_progress({"stage": "append", "percent_complete": "0.00"})
+        return_code = await run_process(matroska.generate_mux_command(options_file), progress, cpus=cpus)
+        # `mkvmerge` exits with 1 when it only had warnings, like small timestamp gaps where segments meet
+        if return_code > 1:
+            raise JobRunFailureError(
+                message=f"`mkvmerge` returned exit code {return_code} while appending the segments",
+                module=self.module_name,
+            )
+
+    def parse_progress(self, line: str):
+        """
+        Parse a line of `HandBrakeCLI --json` output and update the progress whenever it completes a progress block.
+        :param line: A line of output from `HandBrakeCLI`
+        """
+        if (block := self.progress.feed(line)) is None:
+            return
+        # The encodes of a batch all run in the same process, each with its own `SequenceID`
+        if self.batch and (sequence := self.progress.sequence_id(block)) in self.item_sequences:
+            self.item_index = self.item_sequences[sequence]
+        if block.get("State") == "WORKDONE":
+            self.work_error = block.get("WorkDone", dict()).get("Error") or None
+            if self.batch:
+                self.item_results[self.item_index] = block.get("WorkDone", dict()).get("Error", 0)
+        elif (info := self.progress.progress_info(block)) is not None:
+            self.update_progress(self.batch_progress(info) if self.batch else info)
+
+    def batch_progress(self, info: dict) -> dict:
+        """
+        Put the progress of the item being encoded in the context of the whole batch
+        :param info: The progress of the item
+        :return: The progress of the batch
+        """
+        done = {"encoding": float(info["percent_complete"]) / 100, "muxing": 1.0}.get(info["stage"], 0.0)
+        return {
+            **info,
+            "item": self.item_index + 1,
+            "items": len(self.items),
+            "item_percent_complete": info["percent_complete"],
+            "percent_complete": "{:0.2f}".format((self.item_index + done) / len(self.items) * 100),
+        }
+
+    async def validate(self):
+        # Verify that the encoder actually exists if given via the cli_path variable
+        if not self.encoder.cli_path.exists():
+            raise JobValidationError(
+                message=f"Could not find the HandBrake CLI binary at '{self.encoder.cli_path.absolute()}'",
+                module=self.module_name,
+            )
+
+        # A batch has the source and output file of each encode in its items
+        if self.batch:
+            self.items = self.batch_items()
+        # Verify that the source is specified in the data
+        elif "source" not in self.data.keys():
+            raise JobValidationError(
+                message="No source file specified.", module=self.module_name
+            )
+
+        if "preset" in self.data:
+            self.preset = await self.load_preset()
+
+        # Make sure that the input and output options aren't actually used.  The default style
+        # for these are the "source" and "output_file" settings in the data
+        preset_sections = list(self.preset.sections.values()) if self.preset else list()
+        for section in [*self.data.values(), *preset_sections]:
+            if isinstance(section, dict):
+                keys = set(section.keys())
+                illegal = {"i", "input", "o", "output"}
+                if keys.intersection(illegal):
+                    raise JobValidationError(
+                        message=f"Cannot set input/output files via option sections!",
+                        module=self.module_name,
+                    )
+
+        # Verify that there is an actual output file
+        if not self.batch:
+            if "output_file" not in self.data.keys():
+                raise JobValidationError(
+                    message=f"There is no output file defined in the job, abandoning job.",
+                    module=self.module_name,
+                )
+            self.items = [self.data]
+
+        # Make sure that the sources actually exist and are files
+        for item in self.items:
+            if not Path(item.source).exists() or not Path(item.source).is_file():
+                raise JobValidationError(
+                    message=f"The source file '{Path(item.source).absolute()}' either does not exist "
+                    f"or is not a file.",
+                    module=self.module_name,
+                )
+
+        self.check_capabilities()
+        self.titles = [await self.resolve_tracks(item) for item in self.items]
+        if "segments" in self.data:
+            self.validate_segments(self.titles[0])
+
+    async def load_preset(self):
+        """
+        Load the preset of the job, either from a HandBrake preset export (`preset_file`) or from the API
+        :return: The compiled preset
+        """
+        name = str(self.data.preset)
+        try:
+            if "preset_file" in self.data:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, load_preset_file, self.data.preset_file, name)
+            return self.encoder.compile_preset(name, await self.get_preset(name))
+        except HandbrakePresetError as e:
+            raise JobValidationError(message=e.message, module=self.module_name)
+
+    @staticmethod
+    async def get_preset(name: str) -> dict:
+        """
+        Get a preset from the API.  Presets are cached for `Config.PROFILE_CACHE_TTL` seconds like the profiles of
+        the ffmpeg module.  Once the cached preset expires it's fetched again, but only compiled again if it changed.
+        :param name: The name of the preset
+        :return: The option sections of the preset
+        """
+        cache_key = ("handbrake", "presets", name)
+        if (preset := preset_cache.get(cache_key)) is None:
+            payload = {
+                "module": "handbrake",
+                "dataset": "presets",
+                "name": name,
+            }
+            response = await modules.shared.api.get("/worker/data", params=payload)
+            if not response.ok:
+                raise HandbrakePresetError(f"Could not get the preset '{name}' from the API ({response.status}).")
+            preset = response.json()
+            preset_cache.set(cache_key, preset)
+        return preset
+
+    def batch_items(self) -> List[Box]:
+        """
+        Build the data of every encode of a batch: the options of the job with the source and output file of the item
+        :return: The data of the encodes
+        """
+        if "source" in self.data or "output_file" in self.data:
+            raise JobValidationError(
+                message="A batch sets the 'source' and 'output_file' of every item in 'items' instead of the job.",
+                module=self.module_name,
+            )
+        if not isinstance(self.data["items"], list) or not self.data["items"]:
+            raise JobValidationError(message="There are no items in the batch.", module=self.module_name)
+        options = {k: v for k, v in self.data.items() if k != "items"}
+        items, output_files = list(), set()
+        for item in self.data["items"]:
+            if not isinstance(item, dict) or "source" not in item or "output_file" not in item:
+                raise JobValidationError(
+                    message="Every item of the batch needs a 'source' and an 'output_file'.", module=self.module_name
+                )
+            if (output_file := Path(item["output_file"])) in output_files:
+                raise JobValidationError(
+                    message=f"The output file '{output_file.name}' is used more than once.", module=self.module_name
+                )
+            output_files.add(output_file)
+            # Every item gets its own copy, since resolving tracks changes them to fit the source of the item
+            items.append(Box({**copy.deepcopy(options), "source": item["source"], "output_file": item["output_file"]}))
+        return items
+
+    def validate_segments(self, title: dict):
+        """
+        Check that the job can be encoded in segments, and split the title into them
+        :param title: The title the job encodes
+        """
+        try:
+            count = int(self.data.segments)
+        except (TypeError, ValueError):
+            raise JobValidationError(message="'segments' must be a number.", module=self.module_name)
+        if count < 2:
+            return
+        if self.batch:
+            raise JobValidationError(message="A batch can't be encoded in segments.", module=self.module_name)
+        if Path(self.data.output_file).suffix.lower() != ".mkv":
+            raise JobValidationError(
+                message="Segments are appended with mkvmerge, so the output file has to be a Matroska file.",
+                module=self.module_name,
+            )
+        if shutil.which("mkvmerge") is None:
+            raise JobValidationError(
+                message="Segments are appended with mkvmerge, which isn't installed on this worker.",
+                module=self.module_name,
+            )
+        if any(i in RANGE_OPTIONS for i in self.find_options(self.data)):
+            raise JobValidationError(
+                message=f"A segmented encode picks the ranges of the title itself, so it can't set "
+                f"{', '.join(RANGE_OPTIONS)}.",
+                module=self.module_name,
+            )
+        if title["duration"] <= 0:
+            raise JobValidationError(
+                message=f"Title {title['index']} of the source has no duration to split into segments.",
+                module=self.module_name,
+            )
+        self.segments = plan_segments(title, count)
+
+    @staticmethod
+    def find_options(data: Box) -> dict:
+        """
+        Find the options of all option sections, which take either dashes or underscores
+        :param data: The data of the encode
+        :return: The options by their name with underscores, as the section they're in and their key
+        """
+        sections = [v for k, v in data.items() if str(k).endswith("_options") and isinstance(v, dict)]
+        return {str(k).replace("-", "_"): (section, k) for section in sections for k in list(section.keys())}
+
+    async def resolve_tracks(self, data: Box) -> dict:
+        """
+        Scan the source (or get its cached scan) and check the title and the audio and subtitle tracks of the job
+        against it, so a job asking for something the source doesn't have fails before encoding.  A `main_feature`
+        option is replaced with the title of the main feature, so the encode only has to scan that title, and tracks
+        given as a language (e.g. `jpn` or `Japanese`) are replaced with the first track in that language the job
+        doesn't use yet.
+        :param data: The data of the encode
+        :return: The title the job encodes
+        """
+        try:
+            scan = await HandbrakeScan(self.encoder.cli_path, Path(data.source)).run()
+        except HandbrakeScanError as e:
+            raise JobValidationError(message=e.message, module=self.module_name)
+        title = self.select_title(scan, data)
+        logger.info(
+            f" + [{self.job_title} -> {self.module_name}] Encoding title {title['index']} of "
+            f"'{Path(data.source).name}' ({'cached scan' if scan['cached'] else 'scanned'})"
+        )
+        for section in ["audio", "subtitle"]:
+            self.resolve_section_tracks(title, section, data)
+        return title
+
+    def select_title(self, scan: dict, data: Box) -> dict:
+        """
+        Find the title the job encodes in the scan of the source
+        :param scan: The scan of the source
+        :param data: The data of the encode
+        :return: The title
+        """
+        options = self.find_options(data)
+        if "main_feature" in options:
+            if scan["main_feature"] is None:
+                raise JobValidationError(
+                    message="HandBrake could not find the main feature of the source.", module=self.module_name
+                )
+            for name in ["main_feature", "title", "t"]:
+                if name in options:
+                    section, key = options[name]
+                    del section[key]
+            index = scan["main_feature"]
+            data["source_options"] = {**(data.get("source_options") or dict()), "title": index}
+        elif "title" in options or "t" in options:
+            section, key = options.get("title") or options["t"]
+            index = section[key]
+        else:
+            index = 1
+        title = next((i for i in scan["titles"] if str(i["index"]) == str(index)), None)
+        if title is None:
+            raise JobValidationError(
+                message=f"The source has no title {index}, it has {len(scan['titles'])} title(s).",
+                module=self.module_name,
+            )
+        return title
+
+    def resolve_section_tracks(self, title: dict, section: str, data: Box):
+        """
+        Check the audio or subtitle tracks of the job against the title, and replace languages with track numbers
+        :param title: The title the job encodes
+        :param section: Either 'audio' or 'subtitle'
+        :param data: The data of the encode
+        """
+        available = {i["track"]: i for i in title[section]}
+        used = set()
+        for track in data.get(f"{section}_tracks") or list():
+            # Malformed tracks are rejected when the encoder options are built
+            if not isinstance(track, dict) or "track" not in track:
+                continue
+            value = str(track["track"]).strip()
+            if value.lower() in SPECIAL_TRACKS[section]:
+                continue
+            if value.isdigit():
+                number = int(value)
+                if number not in available:
+                    raise JobValidationError(
+                        message=f"Title {title['index']} of the source has no {section} track {number}, it has "
+                        f"{len(available)} {section} track(s).",
+                        module=self.module_name,
+                    )
+            else:
+                languages = {
+                    number: [str(info["language"]).lower(), str(info["language_name"]).lower()]
+                    for number, info in available.items()
+                    if number not in used
+                }
+                number = next((k for k, v in languages.items() if value.lower() in v), None)
+                if number is None:
+                    raise JobValidationError(
+                        message=f"Title {title['index']} of the source has no {section} track in '{value}' left.",
+                        module=self.module_name,
+                    )
+                track["track"] = number
+            used.add(number)
+
+    def check_capabilities(self):
+        """
+        Make sure the video and audio encoders used by the job are supported by the HandBrake CLI binary on this
+        worker.  Skipped if the binary couldn't be probed.
+        """
+        if (capabilities := modules.shared.encoder_capabilities.get("handbrake")) is None:
+            return
+        video_options = dict(self.preset.sections.get("video_options", dict())) if self.preset else dict()
+        video_options.update(self.data.get("video_options") or dict())
+        for k in ["encoder", "e"]:
+            if k in video_options and str(video_options[k]) not in capabilities["encoders"]:
+                raise JobValidationError(
+                    message=f"The video encoder '{video_options[k]}' is not supported by the HandBrake CLI binary "
+                    f"on this worker.",
+                    module=self.module_name,
+                )
+        for track in self.data.get("audio_tracks") or list():
+            if not isinstance(track, dict):
+                continue
+            options = track.get("options") or dict()
+            for k in ["aencoder", "E"]:
+                encoder = str(options.get(k, "copy"))
+                if not (encoder == "copy" or encoder.startswith("copy:") or encoder in capabilities["audio_encoders"]):
+                    raise JobValidationError(
+                        message=f"The audio encoder '{encoder}' is not supported by the HandBrake CLI binary on this "
+                        f"worker.",
+                        module=self.module_name,
+                    )
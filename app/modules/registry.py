@@ -0,0 +1,160 @@
+import importlib
+import logging
+import pkgutil
+from importlib.metadata import entry_points
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Type
+
+import modules
+from config import Config
+from helpers.cache import FileCache, file_key
+from modules.base import BaseModule, missing_binaries
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "sisyphus.modules"
+NON_TASK_MODULES = ["base", "exceptions", "registry", "shared"]
+
+binaries_cache = FileCache(name="module_binaries", path=Config.MODULE_CACHE_FILE, max_size=64)
+
+
+class ModuleInfo:
+    """
+    A task module found by the registry.  A module that is known to be able to run on this worker without importing
+    it (see `ModuleRegistry`) keeps its loader instead, and is only imported the first time it's used.
+    """
+
+    name: str
+    source: str
+    version: str
+    problems: List[str]
+
+    def __init__(
+        self,
+        name: str,
+        module: Optional[Type[BaseModule]],
+        source: str,
+        version: str,
+        problems: List[str],
+        loader: Callable[[str], type] = None,
+    ):
+        self.name = name
+        self.source = source
+        self.version = version
+        self.problems = problems
+        self.__module = module
+        self.__loader = loader
+
+    @property
+    def available(self) -> bool:
+        return (self.__module is not None or self.__loader is not None) and not self.problems
+
+    def load(self) -> Optional[Type[BaseModule]]:
+        """
+        Get the module class, importing it if it hasn't been yet
+        :return: The module class, None if the module is unavailable or can't be imported
+        """
+        if self.__module is None and self.__loader is not None:
+            loader, self.__loader = self.__loader, None
+            try:
+                self.__module = loader(self.name)
+            except Exception as e:
+                self.problems.append(f"could not load module: {str(e)}")
+                logger.warning(f"Module '{self.name}' ({self.source}) is unavailable: {'; '.join(self.problems)}")
+        return self.__module if self.available else None
+
+
+class ModuleRegistry:
+    """
+    The task modules this worker can run.  Built-in modules are found in the `modules` package (`modules/<task>.py`
+    defining the `<Task>` class), installed ones through the `sisyphus.modules` entry point group.  Every module is
+    imported and checked (e.g. for the binaries it needs) once when the registry is filled, so a task that can't run
+    on this worker is known before a job ever asks for it.  The binaries every module needs, and whether it checks
+    more than those, are cached in `Config.MODULE_CACHE_FILE` by the module file (or the version of the installed
+    module).  The next time, a module whose binaries are missing isn't imported at all, and a module that only needs
+    its binaries (which are all there) is only imported once a task uses it, which keeps filling the registry cheap
+    enough to do before the first poll.
+    """
+
+    def __init__(self):
+        self.modules: Dict[str, ModuleInfo] = dict()
+
+    def discover(self, names: List[str] = None) -> None:
+        """
+        Find, import, and check the built-in and installed modules.  Installed modules take precedence over built-in
+        modules with the same name.
+        :param names: Only load the modules with these names (e.g. in a task process), all of them if not provided
+        """
+        for module_info in pkgutil.iter_modules(modules.__path__):
+            if module_info.name in NON_TASK_MODULES or module_info.ispkg:
+                continue
+            if names is not None and module_info.name not in names:
+                continue
+            path = Path(module_info.module_finder.path) / f"{module_info.name}.py"
+            try:
+                cache_key = ":".join(str(i) for i in file_key(path))
+            except OSError:
+                cache_key = None
+            self.add(module_info.name, "builtin", Config.VERSION, self.load_builtin, cache_key)
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            if names is not None and entry_point.name not in names:
+                continue
+            if entry_point.name in self.modules:
+                logger.warning(f"Installed module '{entry_point.name}' replaces the built-in module.")
+            dist = entry_point.dist
+            source = dist.name if dist else entry_point.value
+            version = dist.version if dist else "unknown"
+            cache_key = f"{source}:{version}:{entry_point.value}"
+            self.add(entry_point.name, source, version, lambda _: entry_point.load(), cache_key)
+
+    @staticmethod
+    def load_builtin(name: str) -> type:
+        return getattr(importlib.import_module(f"modules.{name}"), name.capitalize())
+
+    def add(self, name: str, source: str, version: str, loader, cache_key: str = None) -> None:
+        cached = binaries_cache.get(cache_key) if cache_key is not None else None
+        if not isinstance(cached, dict):
+            cached = None
+        if cached is not None and (problems := missing_binaries(cached["binaries"])):
+            self.modules[name] = ModuleInfo(name, None, source, version, problems)
+            return
+        if cached is not None and not cached["custom_check"]:
+            self.modules[name] = ModuleInfo(name, None, source, version, list(), loader=loader)
+            return
+        try:
+            module = loader(name)
+        except Exception as e:
+            self.modules[name] = ModuleInfo(name, None, source, version, [f"could not load module: {str(e)}"])
+            return
+        if not (isinstance(module, type) and issubclass(module, BaseModule)):
+            self.modules[name] = ModuleInfo(name, None, source, version, ["module is not a BaseModule subclass"])
+            return
+        entry = {
+            "binaries": list(module.required_binaries),
+            "custom_check": module.check.__func__ is not BaseModule.check.__func__,
+        }
+        if cache_key is not None and entry != cached:
+            binaries_cache.set(cache_key, entry)
+        self.modules[name] = ModuleInfo(name, module, source, version, module.check())
+
+    def get(self, name: str) -> Optional[ModuleInfo]:
+        """
+        Look up a task module
+        :param name: The name of the task
+        :return: The module, or None if there's no module by that name
+        """
+        return self.modules.get(name)
+
+    @property
+    def capabilities(self) -> List[str]:
+        """
+        The names of the modules that can run on this worker
+        """
+        return sorted(k for k, v in self.modules.items() if v.available)
+
+    def log_summary(self) -> None:
+        for info in sorted(self.modules.values(), key=lambda i: i.name):
+            if info.available:
+                logger.info(f"Module '{info.name}' ({info.source} {info.version}) is available.")
+            else:
+                logger.warning(f"Module '{info.name}' ({info.source}) is unavailable: {'; '.join(info.problems)}")
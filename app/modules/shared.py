@@ -1,5 +1,28 @@
-message = dict()
-"""Used to pass worker status message to the heartbeat thread."""
-
-is_connected_to_api = True
-"""To keep the worker online during Redis connectivity issues"""
+from helpers.status import WorkerStatus
+
+status = WorkerStatus()
+"""Used to pass worker status message to the heartbeat task."""
+
+api = None
+"""The ApiClient shared by the worker and its modules, set once the event loop is running."""
+
+is_connected_to_api = True
+"""To keep the worker online during Redis connectivity issues"""
+
+draining = None
+"""Event set once the worker is draining: no new jobs are accepted and the current job stops after its task."""
+
+current_job = None
+"""Tuple of the job ID and the asyncio task running the current job, if there is one."""
+
+registry = None
+"""The ModuleRegistry of the task modules this worker can run, filled when the worker starts."""
+
+capabilities = list()
+"""The names of the task modules that can run on this worker, reported to the server with the status."""
+
+encoder_capabilities = dict()
+"""The encoders and filters supported by the encoder binaries on this worker, keyed by module name."""
+
+capability_digest = None
+"""Digest of the modules and encoder capabilities, sent with every poll so the server can match jobs to the worker."""
@@ -1,186 +1,267 @@
-import importlib
-import json
-import logging
-import signal
-import sys
-import time
-from box import Box
-from datetime import datetime
-import requests
-from urllib.parse import urljoin
-
-import modules.shared
-from config import Config
-from helpers.heartbeat import start_heartbeat
-from modules.exceptions import (
-    JobValidationError,
-    JobRunFailureError,
-    JobConfigurationError,
-    JobModuleInitError,
-)
-
-logger = logging.getLogger(__name__)
-
-def main():
-    signal.signal(signal.SIGINT, graceful_exit)
-    configure_logging()
-    startup_message()
-    update_status_message(status="startup", task="startup")
-    time.sleep(5)
-    start_heartbeat()
-    process_queue()
-
-
-def update_status_message(status: str, **kwargs):
-    message = {"status": status, "hostname": Config.HOSTNAME, "version": Config.VERSION}
-    kwargs_filter = ["job_title", "job_id", "task"]
-    for k, v in kwargs.items():
-        if k in kwargs_filter:
-            message[k] = str(v)
-    modules.shared.message = message
-
-
-# TODO: Fix logging (make it look nice)
-def configure_logging():
-    message_format = "%(asctime)s %(levelname)-8s %(message)s"
-    # noinspection PyArgumentList
-    logging.basicConfig(
-        level="INFO",
-        format=message_format,
-        datefmt="[%x %X]",
-    )
-
-
-def startup_message():
-    logging.info(f"Starting worker version {Config.VERSION}")
-    logging.info(f"API Server: {Config.API_URL}")
-    logging.info(f"Hostname  : {Config.HOSTNAME}")
-    logging.info(f"Worker ID : {Config.HOST_UUID}")
-
-
-def get_job() -> Box:
-    try:
-        if r := requests.get(urljoin(Config.API_URL, f"/disable/{Config.HOST_UUID}")):
-            if r.status_code == 404:
-                logging.info("Waiting for worker status from server...")
-                time.sleep(Config.API_POLLING_DELAY)
-                return Box()
-            if r.status_code == 200:
-                data = Box(json.loads(r.text))
-                if data.disabled:
-                    logging.info("Worker is disabled and cannot accept jobs!")
-                    time.sleep(Config.API_POLLING_DELAY)
-                    return Box()
-        if r := requests.get(urljoin(Config.API_URL, "/queue/poll")):
-            if r.status_code == 200:
-                logging.info("New job found for worker!")
-                return Box(json.loads(r.text))
-            if r.status_code == 404:
-                time.sleep(Config.API_POLLING_DELAY)
-                return Box()
-    except requests.exceptions.ConnectionError as e:
-        if modules.shared.is_connected_to_api:
-            logging.warning(f"Cannot connect to the API server: {str(e)}")
-            modules.shared.is_connected_to_api = False
-        time.sleep(Config.API_FAILURE_DELAY)
-        return Box()
-    except (requests.exceptions.InvalidSchema, requests.exceptions.MissingSchema) as e:
-        if modules.shared.is_connected_to_api:
-            logging.warning(f"Malformed API server URL: {str(e)}")
-            modules.shared.is_connected_to_api = False
-        time.sleep(Config.API_FAILURE_DELAY)
-        return Box()
-
-
-def process_queue():
-    logging.info("Worker online, ready to process jobs.")
-    been_waiting = False
-    while True:
-        time.sleep(Config.API_POLLING_DELAY)
-        if not (job := get_job()):
-            if not been_waiting:
-                logging.info(
-                    f"Waiting for job from API queue '{Config.API_URL}'"
-                )
-                been_waiting = True
-            update_status_message(status="idle", task="idle")
-
-        job_failed = False
-        job_start_time = datetime.now()
-        been_waiting = False
-        job_title = job.job_title
-        job_id = job.job_id
-        job_tasks = [list(i.keys())[0] for i in job.tasks]
-        job_tasks_str = " -> ".join(job_tasks)
-        update_status_message(
-            status="in_progress",
-            job_title=job_title,
-            job_id=job_id,
-            task="preparing",
-        )
-        logging.info(f"ACCEPTED JOB: {job_title}: {job_id}")
-        logging.info(f" + [{job_title}] Tasks in job: {job_tasks_str}")
-        for task_data in job.tasks:
-            task = list(task_data.keys())[0]
-            update_status_message(
-                status="in_progress", job_title=job_title, job_id=job_id, task=task
-            )
-            data = task_data[task]
-            task_start_time = datetime.now()
-            module_path = f"modules.{task}"
-            try:
-                module = getattr(
-                    importlib.import_module(module_path), task.capitalize()
-                )
-            except (AttributeError, ModuleNotFoundError):
-                logging.critical(
-                    f" ! [{job_title} -> {task}] TASK FAILED: Could not load module, abandoning task."
-                )
-                logging.critical(f"JOB FAILED: {job_title}: {job_id}")
-                job_failed = True
-                break
-            try:
-                task_instance = module(data=data, job_title=job_title)
-            except JobModuleInitError as e:
-                logging.critical(
-                    f" ! [{job_title}] Could not initialize module '{task}': {e.message}"
-                )
-                logging.critical(f"JOB FAILED: {job_title}: {job_id}")
-                job_failed = True
-                break
-            logging.info(f" + [{job_title}] Successfully loaded module: {task}")
-            logging.debug(f" + [{job_title} -> {task}] Validating data: '{data}'")
-            try:
-                task_instance.validate()
-                logging.info(
-                    f" + [{job_title} -> {task}] Running task from module..."
-                )
-                task_instance.run()
-            except (
-                JobValidationError,
-                JobRunFailureError,
-                JobConfigurationError,
-            ) as e:
-                logging.critical(
-                    f" ! [{job_title} -> {task}] {type(e).__name__}: {e.message}"
-                )
-                logging.critical(f"JOB FAILED: {job_title}: {job_id}")
-                job_failed = True
-                break
-            task_run_time = datetime.now() - task_start_time
-            logging.info(
-                f" + [{job_title} -> {task}] Completed task in '{task_run_time}'."
-            )
-        if not job_failed:
-            logging.info(f"COMPLETED JOB: {job_title}: {job_id}")
-            job_run_time = datetime.now() - job_start_time
-            logging.info(f"DURATION: {job_run_time}")
-
-
-def graceful_exit(_sig, _frame):
-    logging.info("Exiting the program due to SIGINT")
-    sys.exit(1)
-
-
-if __name__ == "__main__":
-    main()
+import asyncio
+import logging
+import signal
+import sys
+
+import modules.shared
+from config import Config
+from helpers import metrics
+from helpers.api import ApiClient, ApiError
+from helpers.heartbeat import HeartbeatPublisher, update_status_message
+from helpers.report import JobReport
+from helpers.status import wait_for_event
+
+logger = logging.getLogger(__name__)
+
+def main():
+    configure_logging()
+    startup_message()
+    try:
+        asyncio.run(run_worker())
+    except asyncio.CancelledError:
+        graceful_exit()
+
+
+async def run_worker():
+    """
+    Everything the worker does runs on this event loop: the heartbeat, the API polling, and the jobs.  Cancelling
+    the main task cancels all of them, killing any encoder processes along the way.
+    """
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, asyncio.current_task().cancel)
+    loop.add_signal_handler(signal.SIGTERM, start_drain)
+    modules.shared.status.bind(loop)
+    modules.shared.draining = asyncio.Event()
+    update_status_message(status="startup", task="startup")
+    metrics_server = await metrics.start_metrics_server()
+    async with ApiClient() as api:
+        modules.shared.api = api
+        # Every poll asks for the jobs the modules can run, so the registry is filled before the first one
+        await load_modules()
+        publisher = HeartbeatPublisher(api, on_cancel=cancel_jobs)
+        # The server has to know about the worker before it hands out jobs, so the first status goes out right away
+        await publisher.flush()
+        heartbeat = asyncio.create_task(publisher.run())
+        probe = asyncio.create_task(probe_capabilities())
+        try:
+            await process_queue(api)
+        finally:
+            probe.cancel()
+            heartbeat.cancel()
+            await asyncio.gather(probe, heartbeat, return_exceptions=True)
+            update_status_message(status="offline", task="offline")
+            await publisher.flush()
+            if metrics_server:
+                await metrics_server.cleanup()
+
+
+async def load_modules():
+    """
+    Fill the module registry.  Only the modules that weren't checked on an earlier start (or that check more than
+    their binaries) get imported, so this is cheap on every start but the first.
+    """
+    from modules.registry import ModuleRegistry
+
+    modules.shared.registry = ModuleRegistry()
+    await asyncio.get_running_loop().run_in_executor(None, modules.shared.registry.discover)
+    modules.shared.registry.log_summary()
+    modules.shared.capabilities = modules.shared.registry.capabilities
+    publish_capabilities()
+
+
+async def probe_capabilities():
+    """
+    Probe the encoders in the background, so the probe doesn't hold up the first poll.  The encoder capabilities
+    (and with them the capability digest) are sent once the probe is done; probing is cached on disk by binary, so it
+    only runs the encoders when they're new or have changed.
+    """
+    from helpers.capabilities import capability_digest, probe_encoders
+
+    modules.shared.encoder_capabilities = await asyncio.get_running_loop().run_in_executor(None, probe_encoders)
+    modules.shared.capability_digest = capability_digest(
+        {"modules": modules.shared.capabilities, "encoders": modules.shared.encoder_capabilities}
+    )
+    publish_capabilities()
+
+
+def publish_capabilities():
+    """
+    Update the capabilities in the current status message without changing the status itself
+    """
+    message = modules.shared.status.snapshot()
+    message.update(
+        capabilities=modules.shared.capabilities,
+        encoders=modules.shared.encoder_capabilities,
+        capability_digest=modules.shared.capability_digest,
+    )
+    modules.shared.status.set_state(message)
+
+
+# TODO: Fix logging (make it look nice)
+def configure_logging():
+    message_format = "%(asctime)s %(levelname)-8s %(message)s"
+    # noinspection PyArgumentList
+    logging.basicConfig(
+        level="INFO",
+        format=message_format,
+        datefmt="[%x %X]",
+    )
+
+
+def startup_message():
+    logging.info(f"Starting worker version {Config.VERSION}")
+    logging.info(f"API Server: {Config.API_URL}")
+    logging.info(f"Hostname  : {Config.HOSTNAME}")
+    logging.info(f"Worker ID : {Config.HOST_UUID}")
+
+
+async def get_job(api: ApiClient) -> dict:
+    try:
+        if r := await api.get(f"/disable/{Config.HOST_UUID}"):
+            if r.status == 404:
+                logging.info("Waiting for worker status from server...")
+                await wait_for_event(modules.shared.draining, Config.API_POLLING_DELAY)
+                return dict()
+            if r.status == 200:
+                if r.json().get("disabled"):
+                    logging.info("Worker is disabled and cannot accept jobs!")
+                    await wait_for_event(modules.shared.draining, Config.API_POLLING_DELAY)
+                    return dict()
+        poll_start_time = asyncio.get_running_loop().time()
+        # The full capabilities go out with the status; the poll only carries what the server needs to match jobs
+        poll_params = {
+            "worker_id": Config.HOST_UUID,
+            "modules": ",".join(modules.shared.capabilities),
+        }
+        if modules.shared.capability_digest is not None:
+            poll_params["capability_digest"] = modules.shared.capability_digest
+        r = await api.get("/queue/poll", params=poll_params)
+        metrics.poll_duration.observe(asyncio.get_running_loop().time() - poll_start_time)
+        if r.status == 200:
+            logging.info("New job found for worker!")
+            return r.json()
+        await wait_for_event(modules.shared.draining, Config.API_POLLING_DELAY)
+        return dict()
+    except ApiError as e:
+        if modules.shared.is_connected_to_api:
+            logging.warning(f"Cannot connect to the API server: {e.message}")
+            modules.shared.is_connected_to_api = False
+        await wait_for_event(modules.shared.draining, Config.API_FAILURE_DELAY)
+        return dict()
+
+
+async def process_queue(api: ApiClient):
+    logging.info("Worker online, ready to process jobs.")
+    been_waiting = False
+    # Jobs are polled for right away; get_job waits out the polling delay itself when there's nothing to do
+    while not modules.shared.draining.is_set():
+        if not (job := await get_job(api)):
+            if not been_waiting:
+                logging.info(
+                    f"Waiting for job from API queue '{Config.API_URL}'"
+                )
+                been_waiting = True
+            update_status_message(status="idle", task="idle")
+            continue
+
+        been_waiting = False
+        await run_queued_job(api, job)
+    logging.info("Worker drained, no longer accepting jobs.")
+
+
+async def run_queued_job(api: ApiClient, job: dict):
+    """
+    Run a job from the API queue as the current job of the worker, then report its outcome to the API.
+    :param api: The API client
+    :param job: The job from the API queue
+    """
+    from jobs import run_job
+
+    job_id, job_title = job["job_id"], job["job_title"]
+    report = JobReport(job_id=job_id, job_title=job_title)
+    job_task = asyncio.create_task(run_job(job, report))
+    modules.shared.current_job = (job_id, job_task)
+    try:
+        await asyncio.wait({job_task})
+    except asyncio.CancelledError:
+        job_task.cancel()
+        await asyncio.gather(job_task, return_exceptions=True)
+        raise
+    finally:
+        modules.shared.current_job = None
+    if job_task.cancelled():
+        logging.critical(f"JOB CANCELLED: {job_title}: {job_id}")
+        report.finish("cancelled")
+        update_status_message(
+            status="cancelled", job_title=job_title, job_id=job_id
+        )
+    elif (e := job_task.exception()) is not None:
+        logging.critical(
+            f" ! [{job_title}] Unhandled {type(e).__name__}: {str(e)}",
+            exc_info=e,
+        )
+        logging.critical(f"JOB FAILED: {job_title}: {job_id}")
+        report.finish("failed")
+        update_status_message(
+            status="failed", job_title=job_title, job_id=job_id
+        )
+    metrics.record_job(report)
+    await send_job_report(api, report)
+
+
+async def send_job_report(api: ApiClient, report: JobReport):
+    """
+    Post the outcome, timings, and resource usage of a finished job to the API.
+    :param api: The API client
+    :param report: The report of the finished job
+    """
+    try:
+        r = await api.post(f"/worker/result/{Config.HOST_UUID}", json=report.to_dict())
+        if not r.ok:
+            logging.warning(
+                f"API rejected the report for job '{report.job_id}' with status {r.status}"
+            )
+    except ApiError as e:
+        logging.warning(f"Could not send the report for job '{report.job_id}': {e.message}")
+
+
+def cancel_jobs(job_ids: list):
+    """
+    Cancel the running job if the server asked for it to be cancelled.  Cancelling the job kills its encoder
+    processes.
+    :param job_ids: The job IDs the server wants cancelled
+    """
+    if modules.shared.current_job is None:
+        return
+    job_id, job_task = modules.shared.current_job
+    if job_id in job_ids and not job_task.done():
+        logging.warning(f"Server requested cancellation of job: {job_id}")
+        job_task.cancel()
+
+
+def start_drain():
+    """
+    Put the worker into drain mode: no new jobs are accepted and the current job stops after its running task.  A
+    second request to drain cancels the current job outright.  If `Config.DRAIN_TIMEOUT` is set, the running task
+    gets cancelled once the timeout expires.
+    """
+    if modules.shared.draining.is_set():
+        logging.warning("Received SIGTERM while draining, cancelling the current job.")
+        if modules.shared.current_job is not None:
+            modules.shared.current_job[1].cancel()
+        return
+    logging.info("Received SIGTERM, draining the worker.")
+    modules.shared.draining.set()
+    if modules.shared.current_job is not None and Config.DRAIN_TIMEOUT:
+        asyncio.get_running_loop().call_later(
+            Config.DRAIN_TIMEOUT, modules.shared.current_job[1].cancel
+        )
+
+
+def graceful_exit():
+    logging.info("Exiting the program due to SIGINT")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Runs a single task for the worker when `TASK_ISOLATION` is enabled (see `helpers.isolation.run_isolated_task`).  The
+task is read as JSON from stdin, and the status changes, progress, and result of the task are written back to the
+worker as JSON lines on stdout.  Anything else written to stdout (like the output of a module) goes to stderr
+instead, along with the logs.
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+
+from box import Box
+
+import modules.shared
+from helpers.api import ApiClient
+from helpers.isolation import TaskChannel
+from helpers.profiler import TaskProfiler
+from helpers.resources import ResourceUsage, TaskUsageTracker
+from modules.registry import ModuleRegistry
+from jobs import run_task
+from sisyphus import configure_logging
+
+
+async def run(spec: dict, channel: TaskChannel) -> None:
+    # The worker terminates the task process to cancel the task, which kills its encoders on the way out
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    modules.shared.status = channel
+    modules.shared.capabilities = spec["capabilities"]
+    modules.shared.encoder_capabilities = spec["encoder_capabilities"]
+    modules.shared.registry = ModuleRegistry()
+    modules.shared.registry.discover(names=[spec["task"]])
+    profiler = TaskProfiler(spec["job_id"], spec["task"], spec["index"]) if spec["profile"] else None
+    usage = ResourceUsage()
+    details = dict()
+    async with ApiClient() as api:
+        modules.shared.api = api
+        with TaskUsageTracker(usage):
+            completed = await run_task(spec["job_title"], spec["task"], Box(spec["data"]), profiler, details)
+    channel.send(
+        "result",
+        completed=completed,
+        usage={"max_rss": usage.max_rss},
+        profile=profiler.finish() if profiler else None,
+        details=details,
+    )
+
+
+def main():
+    # Keep stdout for the worker and send everything else that gets printed to stderr
+    channel = TaskChannel(os.fdopen(os.dup(sys.stdout.fileno()), "w"))
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    configure_logging()
+    spec = json.load(sys.stdin)
+    try:
+        asyncio.run(run(spec, channel))
+    except asyncio.CancelledError:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
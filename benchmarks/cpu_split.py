@@ -0,0 +1,109 @@
+"""
+CPU split benchmark: finds how many concurrent encodes of a profile get the most frames through a machine.  For
+every split, the CPUs are partitioned the same way the worker does with `CPU_SLOTS`, and that many `ffmpeg` encodes
+run at once, each pinned to its CPU set with matching thread options.
+
+    python -m benchmarks.cpu_split --source sample.mkv --profile profile.json --splits 1,2,4
+"""
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+
+from helpers.cpu import format_cpu_list, partition_cpus  # noqa: E402
+from helpers.ffmpeg import SourceOutput  # noqa: E402
+from helpers.process import run_process  # noqa: E402
+
+
+def encode_command(ffmpeg: str, source: Path, settings: dict, frames: int, threads: int) -> list:
+    output = SourceOutput(stream_type="v", stream=0, options=dict(settings))
+    output.limit_threads(threads)
+    return [
+        ffmpeg,
+        "-hide_banner",
+        "-nostats",
+        "-y",
+        "-i",
+        str(source),
+        "-map",
+        "0:v:0",
+        "-frames:v",
+        str(frames),
+        *shlex.split(output.cli_options),
+        "-f",
+        "null",
+        os.devnull,
+    ]
+
+
+async def run_split(ffmpeg: str, source: Path, settings: dict, frames: int, slots: int) -> dict:
+    """
+    Run one encode per CPU slot at the same time
+    :param ffmpeg: The `ffmpeg` binary
+    :param source: The source to encode
+    :param settings: The ffmpeg profile settings
+    :param frames: The number of frames each encode processes
+    :param slots: The number of concurrent encodes
+    :return: The results of the split
+    """
+    partitions = partition_cpus(slots)
+    start = time.monotonic()
+    return_codes = await asyncio.gather(
+        *[
+            run_process(encode_command(ffmpeg, source, settings, frames, len(cpus)), cpus=cpus)
+            for cpus in partitions
+        ]
+    )
+    elapsed = time.monotonic() - start
+    return {
+        "encodes": len(partitions),
+        "cpus": [format_cpu_list(i) for i in partitions],
+        "elapsed": round(elapsed, 3),
+        "failed": sum(1 for i in return_codes if i != 0),
+        "fps_per_encode": round(frames / elapsed, 2),
+        "total_fps": round(frames * len(partitions) / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the number of concurrent encodes with the best throughput.")
+    parser.add_argument("--source", type=Path, required=True, help="the source to encode")
+    parser.add_argument("--profile", type=Path, required=True, help="ffmpeg profile JSON (as served by the API)")
+    parser.add_argument("--splits", default=None, help="comma separated encodes per machine to try")
+    parser.add_argument("--frames", type=int, default=500, help="frames to encode in every encode")
+    parser.add_argument("--ffmpeg", default=os.getenv("FFMPEG_PATH", "ffmpeg"), help="the ffmpeg binary")
+    parser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    profile = json.loads(args.profile.read_text())
+    settings = profile.get("settings", profile)
+    cpu_count = len(os.sched_getaffinity(0))
+    if args.splits:
+        splits = [int(i) for i in args.splits.split(",")]
+    else:
+        splits = [i for i in range(1, cpu_count + 1) if cpu_count % i == 0]
+    results = list()
+    for slots in splits:
+        result = asyncio.run(run_split(args.ffmpeg, args.source, settings, args.frames, slots))
+        results.append(result)
+        failed = f"  ({result['failed']} failed)" if result["failed"] else ""
+        print(
+            f"{result['encodes']:>3} encodes x {len(partition_cpus(slots)[0]):>3} CPUs  "
+            f"{result['total_fps']:>10.2f} fps total  {result['fps_per_encode']:>9.2f} fps each{failed}"
+        )
+    best = max((i for i in results if not i["failed"]), key=lambda i: i["total_fps"], default=None)
+    if best:
+        print(f"Best split: CPU_SLOTS={best['encodes']} ({best['total_fps']} fps total)")
+    if args.output:
+        args.output.write_text(json.dumps({"cpu_count": cpu_count, "splits": results, "best": best}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Synthetic fixtures for the benchmarks.  Nothing here needs real media: video sources are raw YUV4MPEG2 streams
+(which MediaInfo happily reports frame counts for), fonts are generated with fontTools, and subtitles are plain
+ASS files.
+"""
+import json
+from pathlib import Path
+from typing import List, Tuple, Union
+
+Y4M_FRAME_HEADER = b"FRAME\n"
+
+
+def write_y4m(path: Union[str, Path], frames: int, width: int = 64, height: int = 48, rate: int = 24) -> Path:
+    """
+    Write a grey 4:2:0 YUV4MPEG2 video
+    :param path: The file to write
+    :param frames: The number of frames in the video
+    :param width: The width of the video
+    :param height: The height of the video
+    :param rate: The frame rate of the video
+    :return: The path of the video
+    """
+    path = Path(path)
+    frame = Y4M_FRAME_HEADER + bytes([128]) * (width * height * 3 // 2)
+    with path.open("wb") as f:
+        f.write(f"YUV4MPEG2 W{width} H{height} F{rate}:1 Ip A1:1 C420jpeg\n".encode())
+        for _ in range(frames):
+            f.write(frame)
+    return path
+
+
+def read_y4m_info(path: Union[str, Path]) -> Tuple[int, int, int]:
+    """
+    Read the frame count and frame rate of a YUV4MPEG2 video without reading the frames
+    :param path: The video file
+    :return: Tuple of the frame count, frame rate, and the size of a frame (including its header) in bytes
+    """
+    path = Path(path)
+    with path.open("rb") as f:
+        header = f.readline()
+    params = {i[:1]: i[1:] for i in header.decode().split()[1:]}
+    width, height = int(params["W"]), int(params["H"])
+    rate = params.get("F", "24:1").split(":")
+    frame_size = len(Y4M_FRAME_HEADER) + width * height * 3 // 2
+    frames = (path.stat().st_size - len(header)) // frame_size
+    return frames, round(int(rate[0]) / int(rate[1])), frame_size
+
+
+def write_font(path: Union[str, Path], family: str, subfamily: str = "Regular") -> Path:
+    """
+    Write a minimal TrueType font with no glyphs, only the name records the font matching cares about
+    :param path: The file to write
+    :param family: The family name of the font
+    :param subfamily: The subfamily (style) name of the font
+    :return: The path of the font
+    """
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    path = Path(path)
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder([".notdef"])
+    builder.setupCharacterMap({})
+    builder.setupGlyf({".notdef": TTGlyphPen(None).glyph()})
+    builder.setupHorizontalMetrics({".notdef": (500, 0)})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable(
+        {
+            "familyName": family,
+            "styleName": subfamily,
+            "fullName": f"{family} {subfamily}",
+            "psName": f"{family}-{subfamily}".replace(" ", ""),
+        }
+    )
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(str(path))
+    return path
+
+
+def ass_timestamp(seconds: int) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.00"
+
+
+def write_ass(path: Union[str, Path], styles: List[Tuple[str, str, bool, bool]], events: int = 100) -> Path:
+    """
+    Write an ASS subtitle file
+    :param path: The file to write
+    :param styles: List of (style name, font family, bold, italic)
+    :param events: The number of dialogue lines, spread over the styles
+    :return: The path of the subtitle file
+    """
+    path = Path(path)
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+        "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, "
+        "MarginR, MarginV, Encoding",
+    ]
+    for name, family, bold, italic in styles:
+        lines.append(
+            f"Style: {name},{family},48,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,{-1 if bold else 0},"
+            f"{-1 if italic else 0},0,0,100,100,0,0,1,2,2,2,10,10,10,1"
+        )
+    lines.extend(
+        [
+            "",
+            "[Events]",
+            "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+        ]
+    )
+    for i in range(events):
+        style = styles[i % len(styles)][0] if styles else "Default"
+        lines.append(
+            f"Dialogue: 0,{ass_timestamp(i * 2)},{ass_timestamp(i * 2 + 1)},{style},,0,0,0,,"
+            f"Line {i} of the synthetic subtitles."
+        )
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def ffmpeg_progress_stream(frames: int, step: int = 12, rate: int = 24) -> bytes:
+    """
+    Build the merged stdout/stderr of `ffmpeg -progress pipe:1`: a `-progress` block and a stats line (redrawn with
+    a carriage return) for every `step` frames.
+    :param frames: The number of frames encoded
+    :param step: The number of frames between progress updates
+    :param rate: The frame rate of the video
+    :return: The output of the encode
+    """
+    chunks = list()
+    for frame in list(range(step, frames, step)) + [frames]:
+        seconds = frame / rate
+        timestamp = f"{int(seconds // 3600):02d}:{int(seconds // 60 % 60):02d}:{seconds % 60:09.6f}"
+        chunks.append(
+            f"frame={frame:5d} fps= 48 q=28.0 size={frame * 4:8d}kB time={timestamp[:-4]} "
+            f"bitrate=1234.5kbits/s speed=2.01x\r"
+        )
+        chunks.append(
+            f"frame={frame}\nfps=48.00\nstream_0_0_q=28.0\nbitrate=1234.5kbits/s\ntotal_size={frame * 4096}\n"
+            f"out_time_us={int(seconds * 1e6)}\nout_time_ms={int(seconds * 1e6)}\nout_time={timestamp}\n"
+            f"dup_frames=0\ndrop_frames=0\nspeed=2.01x\nprogress={'end' if frame == frames else 'continue'}\n"
+        )
+    return "".join(chunks).encode()
+
+
+def handbrake_progress_stream(updates: int) -> bytes:
+    """
+    Build the output of `HandBrakeCLI --json`: the multi-line `Progress: {...}` blocks of a scan, an encode, and
+    the final mux.
+    :param updates: The number of progress updates while encoding
+    :return: The output of the encode
+    """
+    blocks = [{"Scanning": {"Preview": 0, "PreviewCount": 10, "Progress": 0.5, "SequenceID": 0, "Title": 1,
+                            "TitleCount": 1}, "State": "SCANNING"}]
+    for i in range(1, updates + 1):
+        eta = updates - i
+        blocks.append({"State": "WORKING", "Working": {
+            "ETASeconds": eta, "Hours": eta // 3600, "Minutes": eta // 60 % 60, "Pass": 1, "PassCount": 1,
+            "PassID": -1, "Paused": 0, "Progress": i / updates, "Rate": 48.0, "RateAvg": 47.5, "Seconds": eta % 60,
+            "SequenceID": 1}})
+    blocks.append({"Muxing": {"Progress": 0.0}, "State": "MUXING"})
+    blocks.append({"State": "WORKDONE", "WorkDone": {"Error": 0, "SequenceID": 1}})
+    return "".join(f"Progress: {json.dumps(i, indent=4)}\n" for i in blocks).encode()
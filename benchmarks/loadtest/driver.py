@@ -0,0 +1,360 @@
+"""
+Load-test driver: runs N real workers against M queued jobs served by the stand-in API, with the fake encoders
+from `fake_bin` first on the PATH.  Reports throughput, the idle gaps between jobs on each worker, the time spent
+in a job outside of its tasks, and how many API requests (and bytes) each job costs.
+
+    python -m benchmarks.loadtest.driver --workers 4 --jobs 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.fixtures import write_ass, write_font, write_y4m
+from benchmarks.loadtest.server import StandInApi
+
+ROOT = Path(__file__).resolve().parents[2]
+FAKE_BIN = Path(__file__).resolve().parent / "fake_bin"
+FONT_FAMILY = "Loadtest Sans"
+
+PROFILES = {
+    "video": {"name": "video", "settings": {"codec": "libx265", "crf": 19, "preset": "slow"}},
+    "audio": {"name": "audio", "settings": {"codec": "libopus", "b": "128k"}},
+    "proxy": {"name": "proxy", "settings": {"codec": "libx264", "crf": 23, "preset": "veryfast"}},
+}
+PRESETS = {
+    "x265": {
+        "video_options": {"encoder": "x265", "q": 20, "encoder_preset": "slow"},
+        "filters_options": {"nlmeans": "light"},
+    },
+}
+
+
+def ffmpeg_job(work: Path, source: Path, subtitles: Path, index: int) -> dict:
+    encoded, muxed = work / f"encoded_{index}.mkv", work / f"muxed_{index}.mkv"
+    return {
+        "job_id": str(uuid.uuid4()),
+        "job_title": f"loadtest_ffmpeg_{index}",
+        "tasks": [
+            {
+                "ffmpeg": {
+                    "sources": [str(source)],
+                    "source_map": [{"source": 0, "stream_type": "v", "stream": 0}],
+                    "output_map": [
+                        {"stream_type": "v", "stream": 0, "profile": "video"},
+                        {"stream_type": "a", "stream": 0, "profile": "audio"},
+                    ],
+                    "output_file": str(encoded),
+                }
+            },
+            {
+                "mkvmerge": {
+                    "sources": [str(encoded), str(subtitles)],
+                    "tracks": [
+                        {"source": 0, "track": 0, "options": {"language": "und"}},
+                        {"source": 1, "track": 0, "options": {"language": "eng", "track-name": "Subtitles"}},
+                    ],
+                    "output_file": str(muxed),
+                    "options": {"no-global-tags": None, "title": f"Load Test {index}"},
+                }
+            },
+            {"cleanup": {"verify_exists": [str(muxed)], "delete_files": [str(encoded), str(muxed)]}},
+        ],
+    }
+
+
+def handbrake_job(work: Path, source: Path, _subtitles: Path, index: int) -> dict:
+    encoded = work / f"handbrake_{index}.mkv"
+    return {
+        "job_id": str(uuid.uuid4()),
+        "job_title": f"loadtest_handbrake_{index}",
+        "tasks": [
+            {
+                "handbrake": {
+                    "source": str(source),
+                    "output_file": str(encoded),
+                    "preset": "x265",
+                    "video_options": {"q": 19},
+                    "audio_tracks": [{"track": "jpn", "options": {"aencoder": "opus", "ab": 128}}],
+                }
+            },
+            {"cleanup": {"verify_exists": [str(encoded)], "delete_files": [str(encoded)]}},
+        ],
+    }
+
+
+def ladder_job(work: Path, source: Path, _subtitles: Path, index: int) -> dict:
+    master, proxy = work / f"master_{index}.mkv", work / f"proxy_{index}.mkv"
+    return {
+        "job_id": str(uuid.uuid4()),
+        "job_title": f"loadtest_ladder_{index}",
+        "tasks": [
+            {
+                "ffmpeg": {
+                    "sources": [str(source)],
+                    "source_map": [{"source": 0, "stream_type": "v", "stream": 0}],
+                    "renditions": [
+                        {
+                            "output_file": str(master),
+                            "output_map": [{"stream_type": "v", "stream": 0, "profile": "video"}],
+                        },
+                        {
+                            "output_file": str(proxy),
+                            "video_filter": "scale=-2:720",
+                            "output_map": [{"stream_type": "v", "stream": 0, "profile": "proxy"}],
+                        },
+                    ],
+                }
+            },
+            {"cleanup": {"verify_exists": [str(master), str(proxy)], "delete_files": [str(master), str(proxy)]}},
+        ],
+    }
+
+
+def extract_job(work: Path, source: Path, _subtitles: Path, index: int) -> dict:
+    encoded = work / f"encoded_{index}.mkv"
+    extracted = [work / f"extracted_{index}_{i}.mka" for i in range(2)]
+    return {
+        "job_id": str(uuid.uuid4()),
+        "job_title": f"loadtest_extract_{index}",
+        "tasks": [
+            {
+                "ffmpeg": {
+                    "sources": [str(source)],
+                    "source_map": [{"source": 0, "stream_type": "v", "stream": 0}],
+                    "output_map": [{"stream_type": "v", "stream": 0, "profile": "video"}],
+                    "output_file": str(encoded),
+                }
+            },
+            {
+                "extract": {
+                    "source": str(encoded),
+                    "streams": [
+                        {"stream_type": "a", "stream": i, "output_file": str(path)} for i, path in enumerate(extracted)
+                    ],
+                }
+            },
+            {
+                "cleanup": {
+                    "verify_exists": [str(i) for i in extracted],
+                    "delete_files": [str(encoded), *[str(i) for i in extracted]],
+                }
+            },
+        ],
+    }
+
+
+def batch_job(work: Path, source: Path, _subtitles: Path, index: int) -> dict:
+    encoded = [work / f"batch_{index}_{i}.mkv" for i in range(3)]
+    return {
+        "job_id": str(uuid.uuid4()),
+        "job_title": f"loadtest_batch_{index}",
+        "tasks": [
+            {
+                "handbrake": {
+                    "items": [{"source": str(source), "output_file": str(i)} for i in encoded],
+                    "video_options": {"encoder": "x265", "q": 19},
+                    "audio_tracks": [{"track": "jpn", "options": {"aencoder": "opus", "ab": 128}}],
+                }
+            },
+            {"cleanup": {"verify_exists": [str(i) for i in encoded], "delete_files": [str(i) for i in encoded]}},
+        ],
+    }
+
+
+def segmented_job(work: Path, source: Path, _subtitles: Path, index: int) -> dict:
+    job = handbrake_job(work, source, _subtitles, index)
+    job["job_title"] = f"loadtest_segmented_{index}"
+    job["tasks"][0]["handbrake"]["segments"] = 3
+    return job
+
+
+JOB_TYPES = {
+    "ffmpeg": [ffmpeg_job],
+    "handbrake": [handbrake_job],
+    "ladder": [ladder_job],
+    "extract": [extract_job],
+    "batch": [batch_job],
+    "segmented": [segmented_job],
+    "mixed": [ffmpeg_job, handbrake_job],
+}
+
+
+def summarize(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 3),
+        "p50": round(values[len(values) // 2], 3),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def analyze(server: StandInApi, launched_at: float, elapsed: float) -> dict:
+    """
+    Turn what the stand-in API saw into the load-test results
+    :param server: The stand-in API after the run
+    :param launched_at: When the workers were started (epoch seconds)
+    :param elapsed: The wall time of the whole run in seconds
+    :return: The results
+    """
+    reports: Dict[str, list] = defaultdict(list)
+    for report in server.results:
+        report["started"] = datetime.fromisoformat(report["started_at"]).timestamp()
+        reports[report["worker_id"]].append(report)
+
+    idle_gaps, startup, job_overhead = list(), list(), list()
+    task_times = defaultdict(list)
+    for worker_reports in reports.values():
+        worker_reports.sort(key=lambda i: i["started"])
+        startup.append(worker_reports[0]["started"] - launched_at)
+        for previous, current in zip(worker_reports, worker_reports[1:]):
+            idle_gaps.append(current["started"] - previous["started"] - previous["wall_time"])
+        for report in worker_reports:
+            job_overhead.append(report["wall_time"] - sum(i["wall_time"] for i in report["tasks"]))
+            for task in report["tasks"]:
+                task_times[task["task"]].append(task["wall_time"])
+
+    completed = len(server.results)
+    window = (max(server.finished.values()) - min(server.handed_out.values())) if completed else 0
+    per_job = max(completed, 1)
+    return {
+        "workers": len(reports),
+        "jobs": server.job_count,
+        "jobs_reported": completed,
+        "outcomes": dict(sorted(Counter(i["outcome"] for i in server.results).items())),
+        "elapsed": round(elapsed, 3),
+        "jobs_per_minute": round(completed / window * 60, 3) if window else 0,
+        "worker_startup": summarize(startup),
+        "idle_gap": summarize(idle_gaps),
+        "job_overhead": summarize(job_overhead),
+        "task_wall_time": {k: summarize(v) for k, v in sorted(task_times.items())},
+        "api_requests_per_job": round(sum(server.requests.values()) / per_job, 3),
+        "api_requests": {k: round(v / per_job, 3) for k, v in sorted(server.requests.items())},
+        "api_bytes_per_job": {k: round(v / per_job) for k, v in sorted(server.request_bytes.items()) if v},
+    }
+
+
+def print_results(results: dict) -> None:
+    def line(name: str, value) -> None:
+        if type(value) is dict and "count" in value:
+            value = "  ".join(f"{k}={v}" for k, v in value.items())
+        print(f"  {name:<32} {value}")
+
+    print(f"Load test: {results['jobs_reported']}/{results['jobs']} jobs on {results['workers']} workers")
+    line("elapsed (s)", results["elapsed"])
+    line("jobs/minute", results["jobs_per_minute"])
+    line("outcomes", ", ".join(f"{k}={v}" for k, v in results["outcomes"].items()))
+    line("worker startup (s)", results["worker_startup"])
+    line("idle gap between jobs (s)", results["idle_gap"])
+    line("job overhead outside tasks (s)", results["job_overhead"])
+    for task, times in results["task_wall_time"].items():
+        line(f"task '{task}' wall time (s)", times)
+    line("API requests/job", results["api_requests_per_job"])
+    for endpoint, count in results["api_requests"].items():
+        line(f"  {endpoint}", count)
+    for endpoint, size in results["api_bytes_per_job"].items():
+        line(f"  bytes/job {endpoint}", size)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    work = Path(tempfile.mkdtemp(prefix="sisyphus-loadtest-"))
+    fonts = work / "fonts"
+    fonts.mkdir()
+    write_font(fonts / "loadtest.ttf", FONT_FAMILY)
+    source = write_y4m(work / "source.y4m", frames=args.frames)
+    subtitles = write_ass(work / "subtitles.ass", [("Default", FONT_FAMILY, False, False)])
+    builders = JOB_TYPES[args.job_type]
+    jobs = [builders[i % len(builders)](work, source, subtitles, i) for i in range(args.jobs)]
+
+    server = StandInApi(jobs, profiles=PROFILES, presets=PRESETS, latency=args.latency)
+    url = await server.start(port=args.port)
+    env = {
+        **os.environ,
+        "API_URL": url,
+        "PATH": f"{FAKE_BIN}{os.pathsep}{os.environ.get('PATH', '')}",
+        "FONT_DIRECTORY": str(fonts),
+        "FAKE_ENCODER_FPS": str(args.fps),
+        "FAKE_PROGRESS_INTERVAL": str(args.progress_interval),
+        "FAKE_ENCODER_FAIL_RATE": str(args.fail_rate),
+        "PYTHONUNBUFFERED": "1",
+        "TASK_ISOLATION": "true" if args.isolation else "false",
+        "TASK_HANDOFF": "true" if args.handoff else "false",
+        "HANDOFF_DIRECTORY": str(work / "handoff"),
+    }
+    launched_at = time.time()
+    start = time.monotonic()
+    workers = list()
+    for i in range(args.workers):
+        log = (work / f"worker_{i}.log").open("wb")
+        workers.append(
+            await asyncio.create_subprocess_exec(
+                sys.executable,
+                str(ROOT / "app" / "sisyphus.py"),
+                cwd=ROOT / "app",
+                env={**env, "HOSTNAME_OVERRIDE": f"loadtest-{i}"},
+                stdout=log,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        )
+        log.close()
+    try:
+        await asyncio.wait_for(server.done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        print(f"Timed out after {args.timeout} seconds, logs are in '{work}'", file=sys.stderr)
+        args.keep = True
+    elapsed = time.monotonic() - start
+    for worker in workers:
+        if worker.returncode is None:
+            worker.send_signal(signal.SIGTERM)
+    await asyncio.gather(*[i.wait() for i in workers])
+    await server.stop()
+    results = analyze(server, launched_at, elapsed)
+    if args.keep:
+        results["work_directory"] = str(work)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run workers against a stand-in API with fake encoders.")
+    parser.add_argument("--workers", type=int, default=2, help="number of workers to run")
+    parser.add_argument("--jobs", type=int, default=10, help="number of jobs to queue")
+    parser.add_argument("--job-type", choices=list(JOB_TYPES.keys()), default="mixed", help="the kind of jobs")
+    parser.add_argument("--frames", type=int, default=240, help="frames in the synthetic source")
+    parser.add_argument("--fps", type=float, default=240, help="encoding speed of the fake encoders")
+    parser.add_argument("--progress-interval", type=float, default=0.5, help="seconds between progress updates")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="probability of a fake encoder failing")
+    parser.add_argument("--isolation", action="store_true", help="run every task in its own task process")
+    parser.add_argument("--handoff", action="store_true", help="hand intermediate files to the next task locally")
+    parser.add_argument("--latency", type=float, default=0.0, help="extra latency of every API response")
+    parser.add_argument("--port", type=int, default=0, help="port of the stand-in API (default: any free port)")
+    parser.add_argument("--timeout", type=float, default=600, help="give up after this many seconds")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory and worker logs")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Local stand-in for the API endpoints the worker talks to.  Jobs are handed out first come, first served, every
+request is counted per endpoint, and the job reports the workers post back are kept for the driver to analyze.
+"""
+import asyncio
+import json
+import time
+from collections import Counter, deque
+from typing import Dict, List
+
+from aiohttp import web
+
+
+class StandInApi:
+    """
+    Serves `/queue/poll`, `/disable/<worker_id>`, `/worker/status/<worker_id>` (full POSTs and PATCH deltas),
+    `/worker/data` and `/worker/result/<worker_id>`.  Workers are unknown (404 on `/disable`) until they send their
+    first status, just like the real server.
+    """
+
+    def __init__(
+        self, jobs: List[dict], profiles: Dict[str, dict] = None, presets: Dict[str, dict] = None, latency: float = 0.0
+    ):
+        """
+        StandInApi constructor
+        :param jobs: The jobs to queue, in order
+        :param profiles: The ffmpeg profiles served by `/worker/data`, keyed by name
+        :param presets: The handbrake presets served by `/worker/data`, keyed by name
+        :param latency: Extra delay added to every response in seconds
+        """
+        self.queue = deque(jobs)
+        self.job_count = len(jobs)
+        self.profiles = profiles if profiles else dict()
+        self.presets = presets if presets else dict()
+        self.latency = latency
+        self.workers: Dict[str, dict] = dict()
+        self.results: List[dict] = list()
+        self.requests = Counter()
+        self.request_bytes = Counter()
+        self.handed_out: Dict[str, float] = dict()
+        self.finished: Dict[str, float] = dict()
+        self.polls: List[float] = list()
+        self.polled = asyncio.Event()
+        # Polls from workers that have loaded their modules and can be handed jobs
+        self.ready_polls: List[float] = list()
+        self.polled_ready = asyncio.Event()
+        self.done = asyncio.Event()
+        self.app = web.Application(middlewares=[self.count_requests])
+        self.app.add_routes(
+            [
+                web.get("/queue/poll", self.poll),
+                web.get("/disable/{worker_id}", self.disable),
+                web.post("/worker/status/{worker_id}", self.status_post),
+                web.patch("/worker/status/{worker_id}", self.status_patch),
+                web.get("/worker/data", self.data),
+                web.post("/worker/result/{worker_id}", self.result),
+            ]
+        )
+        self.runner = None
+        self.port = None
+
+    @web.middleware
+    async def count_requests(self, request: web.Request, handler):
+        route = request.match_info.route.resource
+        endpoint = f"{request.method} {route.canonical if route else request.path}"
+        self.requests[endpoint] += 1
+        self.request_bytes[endpoint] += request.content_length or 0
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving
+        :param host: The address to listen on
+        :param port: The port to listen on, a free port is picked if not provided
+        :return: The URL of the server
+        """
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.port = self.runner.addresses[0][1]
+        return f"http://{host}:{self.port}"
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def poll(self, request: web.Request) -> web.Response:
+        self.polls.append(time.time())
+        self.polled.set()
+        # Only hand out jobs whose tasks the worker can run, if it said which modules it has
+        modules = set(request.query["modules"].split(",")) if "modules" in request.query else None
+        if modules != {""}:
+            self.ready_polls.append(time.time())
+            self.polled_ready.set()
+        for job in self.queue:
+            if modules is None or all(set(task).issubset(modules) for task in job["tasks"]):
+                break
+        else:
+            return web.json_response({"message": "No jobs in queue"}, status=404)
+        self.queue.remove(job)
+        self.handed_out[job["job_id"]] = time.time()
+        return web.json_response(job)
+
+    async def disable(self, request: web.Request) -> web.Response:
+        if request.match_info["worker_id"] not in self.workers:
+            return web.json_response({"message": "Worker not found"}, status=404)
+        return web.json_response({"disabled": False})
+
+    async def status_post(self, request: web.Request) -> web.Response:
+        self.workers[request.match_info["worker_id"]] = await request.json()
+        return web.json_response({})
+
+    async def status_patch(self, request: web.Request) -> web.Response:
+        if (status := self.workers.get(request.match_info["worker_id"])) is None:
+            return web.json_response({"message": "Worker not found"}, status=404)
+        for k, v in (await request.json()).items():
+            if v is None:
+                status.pop(k, None)
+            else:
+                status[k] = v
+        return web.json_response({})
+
+    async def data(self, request: web.Request) -> web.Response:
+        name = request.query.get("name")
+        dataset = {"profiles": self.profiles, "presets": self.presets}.get(request.query.get("dataset"), dict())
+        if name not in dataset:
+            return web.json_response({"message": f"'{name}' not found"}, status=404)
+        return web.json_response(dataset[name])
+
+    async def result(self, request: web.Request) -> web.Response:
+        report = json.loads(await request.text())
+        self.results.append(report)
+        self.finished[report["job_id"]] = time.time()
+        if len(self.results) >= self.job_count:
+            self.done.set()
+        return web.json_response({})
@@ -0,0 +1,97 @@
+"""
+Usage check: runs a HandBrake job with the fake encoders, in the worker process and in a task process, and compares
+the IO reported for the task with the size of the file the encoder wrote.  The reported `write_chars` include the
+progress the encoder writes to its pipe, but anything close to twice the size of the output means the IO got
+counted twice.
+
+    python -m benchmarks.loadtest.usage
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+from benchmarks.fixtures import write_y4m
+from benchmarks.loadtest.driver import FAKE_BIN, PRESETS, ROOT
+from benchmarks.loadtest.server import StandInApi
+
+# How much more than the output the task may report having written (progress, logs, and the task channel)
+TOLERANCE = 1.25
+
+
+async def measure(work: Path, source: Path, isolation: bool, timeout: float) -> tuple:
+    """
+    Run a single HandBrake job on a fresh worker
+    :param work: The work directory
+    :param source: The source of the job
+    :param isolation: Run the task in a task process
+    :param timeout: Give up on the worker after this many seconds
+    :return: The size of the output file and the usage reported for the task
+    """
+    output = work / f"usage_{'isolated' if isolation else 'inline'}.mkv"
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "job_title": f"usage_{'isolated' if isolation else 'inline'}",
+        "tasks": [{"handbrake": {"source": str(source), "output_file": str(output), "preset": "x265"}}],
+    }
+    server = StandInApi([job], presets=PRESETS)
+    url = await server.start()
+    worker = await asyncio.create_subprocess_exec(
+        sys.executable,
+        str(ROOT / "app" / "sisyphus.py"),
+        cwd=ROOT / "app",
+        env={
+            **os.environ,
+            "API_URL": url,
+            "METRICS_PORT": "0",
+            "PATH": f"{FAKE_BIN}{os.pathsep}{os.environ.get('PATH', '')}",
+            "TASK_ISOLATION": "true" if isolation else "false",
+        },
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        await asyncio.wait_for(server.done.wait(), timeout=timeout)
+    finally:
+        worker.terminate()
+        await worker.wait()
+        await server.stop()
+    report = server.results[0]
+    if report["outcome"] != "completed":
+        raise RuntimeError(f"The job {report['outcome']} with isolation {'on' if isolation else 'off'}")
+    return output.stat().st_size, report["tasks"][0]["usage"]
+
+
+async def run(args: argparse.Namespace) -> bool:
+    work = Path(tempfile.mkdtemp(prefix="sisyphus-usage-"))
+    passed = True
+    try:
+        source = write_y4m(work / "source.y4m", frames=args.frames)
+        for isolation in [False, True]:
+            size, usage = await measure(work, source, isolation, args.timeout)
+            ratio = usage["write_chars"] / size
+            within = 1 <= ratio <= TOLERANCE
+            passed = passed and within
+            print(
+                f"{'task process' if isolation else 'worker process':<16} output {size} B, reported "
+                f"write_chars {usage['write_chars']} B ({ratio:.2f}x): {'ok' if within else 'FAILED'}"
+            )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the IO reported for a task against what it wrote.")
+    parser.add_argument("--frames", type=int, default=2400, help="frames in the synthetic source")
+    parser.add_argument("--timeout", type=float, default=120, help="give up on a worker after this many seconds")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+from benchmarks.micro.runner import main
+
+main()
@@ -0,0 +1,112 @@
+"""
+Command builders: HandBrake CLI options, the ffmpeg command line, and the mkvmerge options.
+"""
+from helpers.ffmpeg import Ffmpeg, Source, SourceOutput
+from helpers.handbrake import Handbrake, HandbrakeTrack
+from helpers.mkvmerge import Matroska, MkvAttachment, MkvSource, MkvSourceTrack
+
+from benchmarks.micro.runner import Fixtures, benchmark
+
+
+def build_handbrake(fixture: Fixtures) -> Handbrake:
+    h = Handbrake()
+    h.source = "/media/source file.mkv"
+    h.output_file = "/media/output file.mkv"
+    h.general_options.verbose = 1
+    h.source_options.chapters = "1-3"
+    h.destination_options.format = "av_mkv"
+    h.video_options.encoder = "x265_10bit"
+    h.video_options.q = 19
+    h.video_options.encoder_preset = "slow"
+    h.picture_options.crop = "0:0:0:0"
+    h.filters_options.no_comb_detect = True
+    h.filters_options.no_deinterlace = True
+    for i in range(fixture.count(64)):
+        options = {"aencoder": "opus", "ab": 128, "mixdown": "stereo"}
+        if i % 2:
+            options["drc"] = 1.5
+        h.audio_tracks.append(HandbrakeTrack(track=i + 1, options=options))
+        h.subtitle_tracks.append(HandbrakeTrack(track=i + 1, options={"subname": f"Track {i}"} if i % 3 else None))
+    return h
+
+
+@benchmark("commands.handbrake_generate_cli")
+def handbrake_generate_cli(fixture: Fixtures):
+    return build_handbrake(fixture).generate_cli
+
+
+@benchmark("commands.handbrake_preset_generate_cli")
+def handbrake_preset_generate_cli(fixture: Fixtures):
+    preset = {
+        "destination_options": {"format": "av_mkv"},
+        "video_options": {"encoder": "x265_10bit", "q": 20, "encoder_preset": "slow"},
+        "picture_options": {"crop": "0:0:0:0"},
+        "filters_options": {"no_comb_detect": True, "no_deinterlace": True},
+    }
+
+    def run():
+        h = Handbrake()
+        h.source = "/media/source file.mkv"
+        h.output_file = "/media/output file.mkv"
+        h.preset = Handbrake.compile_preset("benchmark", preset)
+        h.video_options.q = 19
+        return h.generate_cli()
+
+    return run
+
+
+@benchmark("commands.handbrake_generate_track_options")
+def handbrake_generate_track_options(fixture: Fixtures):
+    h = build_handbrake(fixture)
+    return lambda: h.generate_track_options("audio")
+
+
+@benchmark("commands.ffmpeg_generate_command")
+def ffmpeg_generate_command(fixture: Fixtures):
+    f = Ffmpeg(ffmpeg_path="/usr/bin/ffmpeg")
+    f.settings.overwrite = True
+    f.output = "/media/output file.mkv"
+    for i in range(fixture.count(32)):
+        f.inputs.append(f"/media/source {i}.mkv")
+        f.mapped_sources.append(Source(source=i, stream_type="a", stream=0))
+    f.mapped_sources.append(Source(source=0, stream_type="v", stream=0))
+    f.mapped_outputs.extend(output_map(fixture))
+    return f.generate_command
+
+
+def output_map(fixture: Fixtures) -> list:
+    outputs = [
+        SourceOutput(
+            stream_type="v",
+            stream=0,
+            options={"codec": "libx265", "crf": 19, "preset": "slow", "pix_fmt": "yuv420p10le",
+                     "x265-params": {"aq-mode": 3, "psy-rd": 2.0, "psy-rdoq": 1.0, "deblock": "-1,-1"}},
+        )
+    ]
+    for i in range(fixture.count(32)):
+        outputs.append(SourceOutput(stream_type="a", stream=i, options={"codec": "libopus", "b": "128k", "ac": 2}))
+    return outputs
+
+
+@benchmark("commands.ffmpeg_source_output_cli_options")
+def ffmpeg_source_output_cli_options(fixture: Fixtures):
+    outputs = output_map(fixture)
+    return lambda: [i.cli_options for i in outputs]
+
+
+@benchmark("commands.matroska_generate_options")
+def matroska_generate_options(fixture: Fixtures):
+    m = Matroska(output="/media/output file.mkv")
+    m.global_options = {"no-global-tags": None, "no-track-tags": None, "title": "Benchmark"}
+    for i in range(fixture.count(16)):
+        source = MkvSource(f"/media/source {i}.mkv")
+        for j in range(fixture.count(16)):
+            track = MkvSourceTrack(track=j)
+            track.set_option("language", "eng")
+            track.set_option("track-name", f"Track {j}")
+            track.set_option("default-track", "no")
+            source.add_track(track)
+        m.add_source(source)
+    for i in range(fixture.count(256)):
+        m.add_attachment(MkvAttachment(name=f"font_{i}.ttf", mime_type="font/sfnt", filename=f"/fonts/font_{i}.ttf"))
+    return m.generate_options
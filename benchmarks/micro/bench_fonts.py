@@ -0,0 +1,44 @@
+"""
+Font matching: scanning the font directory, reading the styles of a large ASS file, and matching styles to fonts.
+"""
+from helpers.font import font_cache, generate_font_list, generate_font_map, generate_style_map, remove_duplicates
+
+from benchmarks.micro.runner import Fixtures, benchmark
+
+
+@benchmark("fonts.generate_font_map")
+def font_map_uncached(fixture: Fixtures):
+    directory = fixture.font_directory
+
+    def run():
+        font_cache.clear()
+        return generate_font_map(directory)
+
+    return run
+
+
+@benchmark("fonts.generate_font_map_cached")
+def font_map_cached(fixture: Fixtures):
+    directory = fixture.font_directory
+    generate_font_map(directory)
+    return lambda: generate_font_map(directory)
+
+
+@benchmark("fonts.generate_style_map")
+def style_map(fixture: Fixtures):
+    subtitle_file = fixture.subtitle_file
+    return lambda: generate_style_map(subtitle_file)
+
+
+@benchmark("fonts.generate_font_list")
+def font_list(fixture: Fixtures):
+    font_map = generate_font_map(fixture.font_directory)
+    style_map = generate_style_map(fixture.subtitle_file)
+    return lambda: generate_font_list(font_map, style_map)
+
+
+@benchmark("fonts.remove_duplicates")
+def duplicates(fixture: Fixtures):
+    font_map = generate_font_map(fixture.font_directory)
+    fonts = font_map + font_map[::2]
+    return lambda: remove_duplicates(fonts)
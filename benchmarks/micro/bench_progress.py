@@ -0,0 +1,53 @@
+"""
+Progress parsing: splitting encoder output into lines and the progress parsers of the modules.
+"""
+import asyncio
+
+from helpers.process import LINE_SEPARATOR, read_lines
+from modules.ffmpeg import Ffmpeg
+from modules.handbrake import Handbrake
+
+from benchmarks.micro.runner import Fixtures, benchmark
+
+
+def split_lines(stream: bytes) -> list:
+    return [i.decode() for i in LINE_SEPARATOR.split(stream) if i]
+
+
+@benchmark("progress.read_lines")
+def process_read_lines(fixture: Fixtures):
+    stream = fixture.ffmpeg_stream
+    loop = asyncio.new_event_loop()
+
+    async def consume():
+        reader = asyncio.StreamReader()
+        reader.feed_data(stream)
+        reader.feed_eof()
+        return [i async for i in read_lines(reader)]
+
+    return lambda: loop.run_until_complete(consume())
+
+
+@benchmark("progress.ffmpeg_parse_progress")
+def ffmpeg_parse_progress(fixture: Fixtures):
+    lines = split_lines(fixture.ffmpeg_stream)
+    module = Ffmpeg(data=dict(), job_title="benchmark")
+    module.total_frames = fixture.count(200000)
+
+    def run():
+        for line in lines:
+            module.parse_progress(line)
+
+    return run
+
+
+@benchmark("progress.handbrake_parse_progress")
+def handbrake_parse_progress(fixture: Fixtures):
+    lines = split_lines(fixture.handbrake_stream)
+    module = Handbrake(data=dict(), job_title="benchmark")
+
+    def run():
+        for line in lines:
+            module.parse_progress(line)
+
+    return run
@@ -0,0 +1,217 @@
+"""
+Runner for the micro-benchmarks of the pure-Python hot paths.  Benchmarks register themselves with `@benchmark`
+and get a `Fixtures` instance to build their (synthetic) inputs from; they return the callable to time.
+
+    python -m benchmarks.micro --output results.json
+    python -m benchmarks.micro --compare results.json --threshold 1.2
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import cached_property
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from benchmarks import fixtures
+
+ROOT = Path(__file__).resolve().parents[2]
+FAKE_BIN = ROOT / "benchmarks" / "loadtest" / "fake_bin"
+BENCHMARK_MODULES = [
+    "benchmarks.micro.bench_commands",
+    "benchmarks.micro.bench_fonts",
+    "benchmarks.micro.bench_progress",
+]
+STYLES = [("Regular", False, False), ("Bold", True, False), ("Italic", False, True), ("Bold Italic", True, True)]
+
+BENCHMARKS: Dict[str, Callable[["Fixtures"], Callable[[], object]]] = dict()
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark.  The decorated function builds everything the benchmark needs and returns the callable
+    that gets timed.
+    :param name: The name of the benchmark, grouped by the part before the first dot
+    """
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+class Fixtures:
+    """
+    Synthetic inputs shared between the benchmarks.  Everything is generated on first use in a temporary directory,
+    and the sizes are multiplied by `scale`.
+    """
+
+    def __init__(self, directory: Path, scale: float = 1.0):
+        self.directory = directory
+        self.scale = scale
+
+    def count(self, n: int) -> int:
+        return max(1, int(n * self.scale))
+
+    @cached_property
+    def font_families(self) -> List[str]:
+        return [f"Synthetic Family {i}" for i in range(self.count(500))]
+
+    @cached_property
+    def font_directory(self) -> Path:
+        """
+        Four fonts (regular, bold, italic, bold italic) for every family
+        """
+        directory = self.directory / "fonts"
+        directory.mkdir()
+        for i, family in enumerate(self.font_families):
+            for style, _, _ in STYLES:
+                fixtures.write_font(directory / f"font_{i}_{style.replace(' ', '')}.ttf", family, style)
+        return directory
+
+    @cached_property
+    def subtitle_file(self) -> Path:
+        """
+        An ASS file with a style for a quarter of the font families and a couple hundred thousand lines
+        """
+        styles = [
+            (f"Style{i}", family, *STYLES[i % len(STYLES)][1:])
+            for i, family in enumerate(self.font_families[:: len(STYLES)])
+        ]
+        return fixtures.write_ass(self.directory / "subtitles.ass", styles, events=self.count(200000))
+
+    @cached_property
+    def ffmpeg_stream(self) -> bytes:
+        return fixtures.ffmpeg_progress_stream(frames=self.count(200000))
+
+    @cached_property
+    def handbrake_stream(self) -> bytes:
+        return fixtures.handbrake_progress_stream(updates=self.count(10000))
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """
+    Time a callable.  The number of calls per sample is picked so a sample takes at least `min_time` seconds.
+    :param func: The callable to time
+    :param repeat: The number of samples
+    :param min_time: The minimum duration of a sample in seconds
+    :return: The per-call timings in seconds
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - start) / loops)
+    return {
+        "loops": loops,
+        "repeat": repeat,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def metadata(scale: float) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "scale": scale,
+    }
+
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> List[str]:
+    """
+    Compare the results against a baseline run
+    :param results: The benchmark results
+    :param baseline: The results file of the baseline run
+    :param threshold: The ratio to the baseline minimum above which a benchmark counts as a regression
+    :return: The names of the regressed benchmarks
+    """
+    previous = {i["name"]: i for i in baseline["benchmarks"]}
+    regressions = list()
+    for result in results:
+        if (base := previous.get(result["name"])) is None:
+            continue
+        result["baseline"] = base["min"]
+        result["ratio"] = round(result["min"] / base["min"], 3)
+        if result["ratio"] > threshold:
+            regressions.append(result["name"])
+    return regressions
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the micro-benchmarks.")
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="number of samples per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum duration of a sample in seconds")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the size of the fixtures")
+    parser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="results file of a baseline run")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio that counts as a regression")
+    args = parser.parse_args()
+
+    # The command builders look for the encoder binaries when they're created
+    os.environ["PATH"] = f"{FAKE_BIN}{os.pathsep}{os.environ.get('PATH', '')}"
+    sys.path.insert(0, str(ROOT / "app"))
+    for module in BENCHMARK_MODULES:
+        importlib.import_module(module)
+
+    directory = Path(tempfile.mkdtemp(prefix="sisyphus-benchmarks-"))
+    results = list()
+    try:
+        fixture = Fixtures(directory, scale=args.scale)
+        for name, setup in BENCHMARKS.items():
+            if args.filter not in name:
+                continue
+            result = {"name": name, **measure(setup(fixture), args.repeat, args.min_time)}
+            results.append(result)
+            print(f"{name:<44} {format_time(result['min']):>12}  (median {format_time(result['median'])})")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    regressions = list()
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.threshold)
+        for result in results:
+            if "ratio" in result:
+                flag = "  REGRESSION" if result["name"] in regressions else ""
+                print(f"{result['name']:<44} {result['ratio']:>8.3f}x baseline{flag}")
+    if args.output:
+        args.output.write_text(json.dumps({"metadata": metadata(args.scale), "benchmarks": results}, indent=2))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,127 @@
+"""
+Startup benchmark: how long it takes to import the worker, which heavy dependencies get loaded before the first
+job, and how long a fresh worker takes until its first poll of the stand-in API that can be handed a job (one that
+lists the modules of the worker).
+
+    python -m benchmarks.startup --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.loadtest.server import StandInApi
+
+ROOT = Path(__file__).resolve().parents[1]
+APP = ROOT / "app"
+# Dependencies that only the modules (or the jobs, or optional features) need.  `yaml` is also pulled in by python-box.
+HEAVY_MODULES = ["rich", "fontTools", "pymediainfo", "yaml", "wcmatch", "redis", "aiohttp.web", "box", "pstats"]
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import sisyphus
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_time": elapsed, "loaded": [i for i in {HEAVY_MODULES!r} if i in sys.modules]}}))
+"""
+
+
+def summarize(values: list) -> dict:
+    return {
+        "min": round(min(values), 4),
+        "median": round(statistics.median(values), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def measure_interpreter(runs: int) -> list:
+    samples = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def measure_imports(runs: int) -> tuple:
+    samples, loaded = list(), set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], cwd=APP, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output)
+        samples.append(result["import_time"])
+        loaded.update(result["loaded"])
+    return samples, sorted(loaded)
+
+
+async def measure_first_poll(runs: int, timeout: float) -> list:
+    """
+    Start fresh workers against an empty queue and time how long it takes until they poll for a job with their
+    modules, since a poll without them can't be handed one
+    :param runs: The number of workers to start, one after the other
+    :param timeout: How long to wait for a worker to poll in seconds
+    :return: The time from starting each worker to its first poll with modules in seconds
+    """
+    samples = list()
+    for _ in range(runs):
+        server = StandInApi(jobs=list())
+        url = await server.start()
+        start = time.time()
+        worker = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(APP / "sisyphus.py"),
+            cwd=APP,
+            env={**os.environ, "API_URL": url, "METRICS_PORT": "0"},
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            await asyncio.wait_for(server.polled_ready.wait(), timeout=timeout)
+            samples.append(server.ready_polls[0] - start)
+        except asyncio.TimeoutError:
+            samples.append(float("inf"))
+        finally:
+            worker.send_signal(signal.SIGTERM)
+            await worker.wait()
+            await server.stop()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the worker.")
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to measure")
+    parser.add_argument("--budget", type=float, default=0.4, help="time to first poll budget in seconds")
+    parser.add_argument("--timeout", type=float, default=30, help="give up on a worker after this many seconds")
+    parser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    interpreter = measure_interpreter(args.runs)
+    imports, loaded = measure_imports(args.runs)
+    first_poll = asyncio.run(measure_first_poll(args.runs, args.timeout))
+    results = {
+        "interpreter": summarize(interpreter),
+        "import_time": summarize(imports),
+        "heavy_modules_loaded": loaded,
+        "time_to_first_poll": summarize(first_poll),
+        "budget": args.budget,
+        "within_budget": statistics.median(first_poll) <= args.budget,
+    }
+    print(f"{'interpreter startup (s)':<28} {results['interpreter']}")
+    print(f"{'import sisyphus (s)':<28} {results['import_time']}")
+    print(f"{'heavy modules loaded':<28} {', '.join(loaded) if loaded else 'none'}")
+    print(f"{'time to first poll (s)':<28} {results['time_to_first_poll']}")
+    print(f"{'within budget':<28} {results['within_budget']} (median first poll <= {args.budget}s)")
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    sys.exit(0 if results["within_budget"] else 1)
+
+
+if __name__ == "__main__":
+    main()
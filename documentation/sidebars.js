@@ -5,12 +5,14 @@ module.exports = {
       label: 'Sisyphus',
       items: [
         'getting-started',
+        'benchmarks',
       ],
     },
     {
       type: 'category',
       label: 'Modules',
       items: [
+        'modules/extract',
         'modules/ffmpeg',
         'modules/handbrake',
  	    'modules/mkvmerge',